@@ -3,44 +3,234 @@
 # ----------------------------------------------------------------------------#
 
 import dateutil.parser
-import babel
-import psycopg2
-from flask import render_template, request, Response, flash, redirect, url_for, abort, jsonify
-import logging
-from logging import Formatter, FileHandler
+import functools
+import json
+from datetime import timedelta
+import babel.dates
+from flask import render_template, request, Response, flash, redirect, url_for, abort, jsonify, stream_with_context
 from forms import *
 from models import *
+from pagination import paginate, page_url
+from search import search, genre_filter
+from genres import GENRES, BITS
+import autocomplete
+from cache import cached, invalidate, tag_version, ALL_PAGES
+from conditional import conditional
+import counters
+import importer
+import dataset
+import benchmark
+from database import pool_stats
+from metrics import metrics
+from budget import query_budget
+import logs
+import assets
+import templating
+import bookings
+import partitions
+import geo
+import matching
+import edits
 # ----------------------------------------------------------------------------#
-# App Config.
+# Filters.
 # ----------------------------------------------------------------------------#
 
-# TODO: connect to a local postgresql database
-conn = psycopg2.connect(
-    host="localhost",
-    database="Fyyur",
-    user="postgres",
-    password="admin"
-)
 
-# ----------------------------------------------------------------------------#
-# Filters.
-# ----------------------------------------------------------------------------#
+DATETIME_FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma"
+}
 
 
-def format_datetime(value, format='medium'):
+@functools.lru_cache(maxsize=64)
+def datetime_pattern(format, locale):
+    # Compiled babel pattern and parsed locale, resolved once per (format, locale)
+    return babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format)), babel.Locale.parse(locale)
+
+
+def format_datetime(value, format='medium', locale='en'):
+    # Controllers pass datetimes; strings are still accepted but cost a parse
     if isinstance(value, str):
-        date = dateutil.parser.parse(value)
-    else:
-        date = value
-    
-    if format == 'full':
-        format = "EEEE MMMM, d, y 'at' h:mma"
-    elif format == 'medium':
-        format = "EE MM, dd, y h:mma"
-    return babel.dates.format_datetime(date, format, locale='en')
+        value = dateutil.parser.parse(value)
+    pattern, locale = datetime_pattern(format, locale)
+    return pattern.apply(value, locale)
+
+
+def format_datetimes(values, format='medium', locale='en'):
+    # Batch form for whole show lists: resolves the pattern once and formats
+    # each distinct time once
+    pattern, locale = datetime_pattern(format, locale)
+    formatted = {}
+    result = []
+    for value in values:
+        if value not in formatted:
+            date = dateutil.parser.parse(value) if isinstance(value, str) else value
+            formatted[value] = pattern.apply(date, locale)
+        result.append(formatted[value])
+    return result
 
 
 app.jinja_env.filters['datetime'] = format_datetime
+app.jinja_env.filters['datetimes'] = format_datetimes
+app.jinja_env.globals['page_url'] = page_url
+
+# ----------------------------------------------------------------------------#
+# Helpers.
+# ----------------------------------------------------------------------------#
+
+
+def wants_json():
+    # Listing routes answer with JSON for `?format=json` or an Accept header preferring it
+    if request.args.get('format') == 'json':
+        return True
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+
+def datetime_arg(name, day_end=False):
+    # Naive ISO 8601 date or datetime request argument, or None when absent.
+    # A bare date means its midnight, or with day_end the next one, so that
+    # ?to=2024-05-12 includes the whole day.
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        abort(400)
+    if parsed.tzinfo is not None:
+        abort(400)
+    if day_end and len(value) == len('YYYY-MM-DD'):
+        parsed += timedelta(days=1)
+    return parsed
+
+
+def genre_args():
+    # (?genre= values, ?match=) of a listing: rows with any (the default) or
+    # all of the genres
+    genres = request.args.getlist('genre')
+    match = request.args.get('match', 'any')
+    if match not in ('any', 'all') or any(genre not in BITS for genre in genres):
+        abort(400)
+    return genres, match
+
+
+def venue_validators(venue_id):
+    # What the venue page is built from, without touching its shows: the
+    # venue row, whose show counters (and updated_at) move with every show
+    # added at the venue or rolled over to past, and the venue:<id> tag, which
+    # every write to its shows or their artists bumps
+    row = db.session.query(Venue.updated_at, Venue.past_shows_count, Venue.upcoming_shows_count) \
+        .filter(Venue.id == venue_id) \
+        .first()
+    if row is None:
+        return None
+    return tuple(row), tag_version(ALL_PAGES), tag_version(f'venue:{venue_id}')
+
+
+def artist_validators(artist_id):
+    # As venue_validators, for the artist page
+    row = db.session.query(Artist.updated_at, Artist.past_shows_count, Artist.upcoming_shows_count) \
+        .filter(Artist.id == artist_id) \
+        .first()
+    if row is None:
+        return None
+    return tuple(row), tag_version(ALL_PAGES), tag_version(f'artist:{artist_id}')
+
+
+def shows_validators():
+    # The shows listing covers every show regardless of time, and every write
+    # to a show, venue or artist bumps the shows tag
+    return tag_version(ALL_PAGES), tag_version('shows')
+
+
+def venue_cache_tags(*venue_ids):
+    # A venue appears on its own page, the area and shows listings, and the
+    # pages of every artist who plays there; it is also a candidate for
+    # artists' suggestions
+    artist_ids = db.session.query(Show.artist_id).filter(Show.venue_id.in_(venue_ids)).distinct()
+    return [f'venue:{venue_id}' for venue_id in venue_ids] + ['venues', 'shows', matching.CHANGED[Venue]] + \
+        [f'artist:{artist_id}' for artist_id, in artist_ids]
+
+
+def artist_cache_tags(*artist_ids):
+    # An artist appears on their own page, the artists and shows listings,
+    # and the pages of every venue they play at; they are also a candidate
+    # for venues' suggestions
+    venue_ids = db.session.query(Show.venue_id).filter(Show.artist_id.in_(artist_ids)).distinct()
+    return [f'artist:{artist_id}' for artist_id in artist_ids] + ['artists', 'shows', matching.CHANGED[Artist]] + \
+        [f'venue:{venue_id}' for venue_id, in venue_ids]
+
+
+# Per editable model: its autocomplete index and cache tags
+EDIT_TARGETS = {
+    Venue: ('venue', venue_cache_tags),
+    Artist: ('artist', artist_cache_tags)
+}
+
+
+def save_edit(entity, form):
+    # Writes the changed fields of a posted edit form to entity. Returns 200,
+    # including when nothing changed; otherwise flashes why and returns 400
+    # for invalid changes or 409 when the row has moved on since the form
+    # was opened, moving the form to the current version.
+    label = f'{type(entity).__name__} {entity.name}'
+    if form.version.data == entity.version:
+        changes, errors = edits.form_changes(entity, form)
+        if errors:
+            flash(f'{label} could not be updated: ' + '; '.join(
+                f'{field} {" ".join(messages)}' for field, messages in errors.items()))
+            return 400
+        if not changes:
+            return 200
+        edits.apply_changes(entity, changes)
+        if edits.commit([entity]) is not None:
+            index, cache_tags = EDIT_TARGETS[type(entity)]
+            if 'name' in changes:
+                autocomplete.indexes[index].add(entity.id, entity.name)
+            invalidate(*cache_tags(entity.id))
+            return 200
+    # The posted raw value would otherwise be rendered again
+    form.version.data, form.version.raw_data = entity.version, None
+    flash(f'{label} was changed by someone else meanwhile. Check the form and save again.')
+    return 409
+
+
+def show_listing_columns():
+    # Each show with the venue and artist fields it is listed with; shared by
+    # /shows and the shows export
+    return (
+        Show.id,
+        Show.start_time,
+        Show.end_time,
+        Show.venue_id,
+        Venue.name.label('venue_name'),
+        Show.artist_id,
+        Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link')
+    )
+
+
+def version(*updated_at):
+    # Fragment cache version of a tile drawn from several rows: the latest
+    # of their updated_at, which moves forward whenever any of them changes
+    stamps = [stamp for stamp in updated_at if stamp is not None]
+    return max(stamps) if len(stamps) == len(updated_at) else None
+
+
+def without_version(item):
+    return {key: value for key, value in item.items() if key != 'version'}
+
+
+def export_columns(kind):
+    # Exportable columns by name, plus the model whose updated_at `since` filters on
+    if kind == 'shows':
+        columns = show_listing_columns() + (Show.updated_at,)
+        return {column.key: column for column in columns}, Show
+    model = Venue if kind == 'venues' else Artist
+    columns = [getattr(model, column.key) for column in model.__table__.columns
+               if column.key not in ('search_vector', 'geocell', 'genre_mask')]
+    return {column.key: column for column in columns}, model
+
 
 # ----------------------------------------------------------------------------#
 # Controllers.
@@ -56,69 +246,101 @@ def index():
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@query_budget(1)
+@cached('venues')
 def venues():
     # TODO: replace with real venues data.
     #       num_upcoming_shows should be aggregated based on number of upcoming shows per venue.
 
-    # Retrieve all venues from the database
-    venues = Venue.query.all()
-
-    # Create a list to store venue data
-    data = []
-    area_data = []
-
-    for venue in venues:
-        # Get the upcoming shows for the venue
-        upcoming_shows = Show.query.filter(Show.venue_id == venue.id, Show.start_time > datetime.now()).all()
-
-        if len(area_data) == 0:
-            area_data.append({
+    # Retrieve a page of venues; upcoming show counts are materialized on the
+    # venue (see counters.py), so the Show table is not touched
+    genres, match = genre_args()
+    query = db.session.query(
+        Venue.id,
+        Venue.name,
+        Venue.image_link,
+        Venue.city,
+        Venue.state,
+        Venue.upcoming_shows_count.label('num_upcoming_shows'),
+        Venue.updated_at
+    )
+    if genres:
+        query = query.filter(genre_filter(Venue, genres, match))
+    page = paginate(query, (Venue.name, Venue.id))
+
+    # Group the venues by (city, state) in one linear pass
+    areas = {}
+    for venue in page.items:
+        area = areas.get((venue.city, venue.state))
+        if area is None:
+            area = areas[(venue.city, venue.state)] = {
                 'city': venue.city,
                 'state': venue.state,
-                'num_upcoming_shows': len(upcoming_shows),
-                'venues': [{
-                    'id': venue.id,
-                    'name': venue.name,
-                    'image_link': venue.image_link
-                }]
-            })
-
-        for area in area_data:
-            if area['city'] == venue.city:
-                for ven in area['venues']:
-                    if ven['id'] != venue.id:
-                        area['venues'].append({
-                            'id': venue.id,
-                            'name': venue.name,
-                            'image_link': venue.image_link
-                        })
-            else:
-                area_data.append({
-                    'city': venue.city,
-                    'state': venue.state,
-                    'num_upcoming_shows': len(upcoming_shows),
-                    'venues': [{
-                        'id': venue.id,
-                        'name': venue.name,
-                        'image_link': venue.image_link
-                    }]
-                })
-        
+                'num_upcoming_shows': 0,
+                'venues': []
+            }
 
-    data = area_data
+        area['venues'].append({
+            'id': venue.id,
+            'name': venue.name,
+            'image_link': venue.image_link,
+            'num_upcoming_shows': venue.num_upcoming_shows,
+            'version': venue.updated_at
+        })
+        area['num_upcoming_shows'] += venue.num_upcoming_shows
+
+    data = list(areas.values())
+
+    if wants_json():
+        return jsonify(areas=[dict(area, venues=[without_version(venue) for venue in area['venues']]) for area in data],
+                       **page.to_dict())
 
     # Render the venues template with the venue data
-    return render_template('pages/venues.html', areas=data)
+    return render_template('pages/venues.html', areas=data, page=page, genre_choices=GENRES)
+
+
+@app.route('/venues/nearby')
+@query_budget(6)
+def nearby_venues():
+    # Venues within ?radius= km of (?lat=, ?lng=), nearest first
+    latitude = request.args.get('lat', type=float)
+    longitude = request.args.get('lng', type=float)
+    radius = request.args.get('radius', app.config['NEARBY_DEFAULT_KM'], type=float)
+    limit = max(1, min(request.args.get('limit', app.config['PAGE_SIZE'], type=int), app.config['MAX_PAGE_SIZE']))
+    if latitude is None or longitude is None or not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        abort(400)
+    if not 0 < radius <= app.config['NEARBY_MAX_KM']:
+        abort(400)
+
+    found = geo.nearby(latitude, longitude, radius, limit, columns=(
+        Venue.id, Venue.name, Venue.city, Venue.state, Venue.address, Venue.image_link))
+    data = [{
+        'id': venue.id,
+        'name': venue.name,
+        'city': venue.city,
+        'state': venue.state,
+        'address': venue.address,
+        'image_link': venue.image_link,
+        'latitude': venue.latitude,
+        'longitude': venue.longitude,
+        'distance_km': round(distance, 2)
+    } for distance, venue in found]
+
+    if wants_json():
+        return jsonify(venues=data, lat=latitude, lng=longitude, radius=radius)
+
+    return render_template('pages/nearby_venues.html', venues=data, radius=radius)
 
 
 @app.route('/venues/search', methods=['POST'])
+@query_budget(1)
 def search_venues():
     # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
     # seach for Hop should return "The Musical Hop".
     # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
 
     search_term = request.form.get('search_term', '')
-    venues = Venue.query.filter(Venue.name.ilike(f'%{search_term}%')).all()
+    venues = search(Venue, search_term)
     response = {
         'count': len(venues),
         'data': [{
@@ -131,6 +353,9 @@ def search_venues():
 
 
 @app.route('/venues/<int:venue_id>')
+@query_budget(3)
+@conditional(venue_validators)
+@cached('venue:{venue_id}')
 def show_venue(venue_id):
     # shows the venue page with the given venue_id
     # TODO: replace with real venue data from the venues table, using venue_id
@@ -141,31 +366,40 @@ def show_venue(venue_id):
     if venue is None:
         abort(404)  # Venue not found
 
-    past_shows = Show.query.join(Venue).filter(Show.venue_id == venue.id, Show.start_time < datetime.now()).all()
-    upcoming_shows = Show.query.join(Venue).filter(Show.venue_id == venue.id, Show.start_time > datetime.now()).all()
+    # Fetch every show at the venue together with its artist in one query,
+    # then split past and upcoming as the venue's show counters do
+    shows = db.session.query(
+        Show.id,
+        Show.start_time,
+        Show.is_past,
+        Show.updated_at,
+        Artist.id.label('artist_id'),
+        Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link'),
+        Artist.updated_at.label('artist_updated_at')
+    ) \
+        .join(Artist, Artist.id == Show.artist_id) \
+        .filter(Show.venue_id == venue.id) \
+        .order_by(Show.start_time) \
+        .all()
 
     past_shows_data = []
-    for show in past_shows:
-        past_shows_data.append({
-            'artist_id': show.artist.id,
-            'artist_name': show.artist.name,
-            'artist_image_link': show.artist.image_link,
-            'start_time': show.start_time.strftime('%Y-%m-%d %H:%M:%S')
-        })
-
     upcoming_shows_data = []
-    for show in upcoming_shows:
-        upcoming_shows_data.append({
-            'artist_id': show.artist.id,
-            'artist_name': show.artist.name,
-            'artist_image_link': show.artist.image_link,
-            'start_time': show.start_time.strftime('%Y-%m-%d %H:%M:%S')
+    for show in shows:
+        (past_shows_data if show.is_past else upcoming_shows_data).append({
+            'id': show.id,
+            'artist_id': show.artist_id,
+            'artist_name': show.artist_name,
+            'artist_image_link': show.artist_image_link,
+            'start_time': show.start_time,
+            'version': version(show.updated_at, show.artist_updated_at)
         })
 
     response = {
         'id': venue.id,
         'name': venue.name,
         'genres': venue.genres,
+        'address': venue.address,
         'city': venue.city,
         'state': venue.state,
         'phone': venue.phone,
@@ -176,14 +410,24 @@ def show_venue(venue_id):
         'image_link': venue.image_link,
         'past_shows': past_shows_data,
         'upcoming_shows': upcoming_shows_data,
-        'past_shows_count': len(past_shows),
-        'upcoming_shows_count': len(upcoming_shows)
+        'past_shows_count': len(past_shows_data),
+        'upcoming_shows_count': len(upcoming_shows_data)
     }
 
     # Render the venue page with the venue data
     return render_template('pages/show_venue.html', venue=response)
 
 
+@app.route('/venues/<int:venue_id>/suggested-artists')
+@query_budget(5)
+def suggested_artists(venue_id):
+    # Artists seeking a venue that suit this one; see matching.py
+    artists = matching.suggestions(Venue, venue_id)
+    if artists is None:
+        abort(404)
+    return jsonify(venue_id=venue_id, artists=artists)
+
+
 #  Create Venue
 #  ----------------------------------------------------------------
 
@@ -220,10 +464,12 @@ def create_venue_submission():
         # Add the new venue to the database
         db.session.add(venue)
         db.session.commit()
+        autocomplete.indexes['venue'].add(venue.id, venue.name)
+        invalidate('venues', matching.CHANGED[Venue])
 
         # on successful db insert, flash success
         flash('Venue ' + venue.name + ' was successfully listed!')
-    except Exception as ex:
+    except Exception:
         # If an error occurs, rollback the session and show an error message
         db.session.rollback()
 
@@ -248,8 +494,11 @@ def delete_venue(venue_id):
     if venue is None:
         abort(404)  # Venue not found
     try:
+        tags = venue_cache_tags(venue.id)
         db.session.delete(venue)
         db.session.commit()
+        autocomplete.indexes['venue'].remove(venue.id)
+        invalidate(*tags, matching.STALE)
         return jsonify({'success': True})
     except:
         db.session.rollback()
@@ -264,31 +513,42 @@ def delete_venue(venue_id):
 
 
 @app.route('/artists')
+@query_budget(1)
+@cached('artists')
 def artists():
     # TODO: replace with real data returned from querying the database
 
-    # Query the database to get all the artists
-    artists = Artist.query.all()
+    # Query the database for one page of artists, ordered by name, optionally
+    # only those with any or all of the ?genre= genres
+    genres, match = genre_args()
+    query = db.session.query(Artist.id, Artist.name)
+    if genres:
+        query = query.filter(genre_filter(Artist, genres, match))
+    page = paginate(query, (Artist.name, Artist.id))
 
     # Convert the list of artists to a list of dictionaries
     data = []
-    for artist in artists:
+    for artist in page.items:
         data.append({
             "id": artist.id,
             "name": artist.name
         })
 
-    return render_template('pages/artists.html', artists=data)
+    if wants_json():
+        return jsonify(artists=data, **page.to_dict())
+
+    return render_template('pages/artists.html', artists=data, page=page, genre_choices=GENRES)
 
 
 @app.route('/artists/search', methods=['POST'])
+@query_budget(1)
 def search_artists():
     # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
     # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
     # search for "band" should return "The Wild Sax Band".
 
     search_term = request.form.get('search_term', '')
-    artists = Artist.query.filter(Artist.name.ilike(f'%{search_term}%')).all()
+    artists = search(Artist, search_term)
     response = {
         'count': len(artists),
         'data': [{
@@ -301,6 +561,9 @@ def search_artists():
 
 
 @app.route('/artists/<int:artist_id>')
+@query_budget(3)
+@conditional(artist_validators)
+@cached('artist:{artist_id}')
 def show_artist(artist_id):
     # shows the artist page with the given artist_id
     # TODO: replace with real artist data from the artist table, using artist_id
@@ -311,27 +574,33 @@ def show_artist(artist_id):
     if artist is None:
         abort(404)  # Artist not found
 
-    past_shows = Show.query.join(Artist).filter(
-        Show.artist_id == artist_id, Show.start_time < datetime.now()).all()
-    upcoming_shows = Show.query.join(Artist).filter(
-        Show.artist_id == artist_id, Show.start_time > datetime.now()).all()
+    # Fetch every show of the artist together with its venue in one query,
+    # then split past and upcoming as the artist's show counters do
+    shows = db.session.query(
+        Show.id,
+        Show.start_time,
+        Show.is_past,
+        Show.updated_at,
+        Venue.id.label('venue_id'),
+        Venue.name.label('venue_name'),
+        Venue.image_link.label('venue_image_link'),
+        Venue.updated_at.label('venue_updated_at')
+    ) \
+        .join(Venue, Venue.id == Show.venue_id) \
+        .filter(Show.artist_id == artist.id) \
+        .order_by(Show.start_time) \
+        .all()
 
     past_shows_data = []
-    for show in past_shows:
-        past_shows_data.append({
-            'venue_id': show.venue.id,
-            'venue_name': show.venue.name,
-            'venue_image_link': show.venue.image_link,
-            'start_time': show.start_time.strftime('%Y-%m-%d %H:%M:%S')
-        })
-
     upcoming_shows_data = []
-    for show in upcoming_shows:
-        upcoming_shows_data.append({
-            'venue_id': show.venue.id,
-            'venue_name': show.venue.name,
-            'venue_image_link': show.venue.image_link,
-            'start_time': show.start_time.strftime('%Y-%m-%d %H:%M:%S')
+    for show in shows:
+        (past_shows_data if show.is_past else upcoming_shows_data).append({
+            'id': show.id,
+            'venue_id': show.venue_id,
+            'venue_name': show.venue_name,
+            'venue_image_link': show.venue_image_link,
+            'start_time': show.start_time,
+            'version': version(show.updated_at, show.venue_updated_at)
         })
 
     response = {
@@ -348,17 +617,29 @@ def show_artist(artist_id):
         'image_link': artist.image_link,
         'past_shows': past_shows_data,
         'upcoming_shows': upcoming_shows_data,
-        'past_shows_count': len(past_shows),
-        'upcoming_shows_count': len(upcoming_shows)
+        'past_shows_count': len(past_shows_data),
+        'upcoming_shows_count': len(upcoming_shows_data)
     }
 
     return render_template('pages/show_artist.html', artist=response)
 
+
+@app.route('/artists/<int:artist_id>/suggested-venues')
+@query_budget(5)
+def suggested_venues(artist_id):
+    # Venues seeking talent that suit this artist; see matching.py
+    venues = matching.suggestions(Artist, artist_id)
+    if venues is None:
+        abort(404)
+    return jsonify(artist_id=artist_id, venues=venues)
+
+
 #  Update
 #  ----------------------------------------------------------------
 
 
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@query_budget(1)
 def edit_artist(artist_id):
 
     form = ArtistForm()
@@ -379,6 +660,7 @@ def edit_artist(artist_id):
     form.seeking_venue.data = artist.seeking_venue
     form.seeking_description.data = artist.seeking_description
     form.image_link.data = artist.image_link
+    form.version.data = artist.version
 
     return render_template('forms/edit_artist.html', form=form, artist=artist)
 
@@ -395,25 +677,20 @@ def edit_artist_submission(artist_id):
     if artist is None:
         abort(404)  # Artist not found
 
-    # Update the artist record with the new attributes from the form submission
-    artist.name = form.name
-    artist.genres = form.genres
-    artist.city = form.city
-    artist.state = form.state
-    artist.phone = form.phone
-    artist.website_link = form.website_link
-    artist.facebook_link = form.facebook_link
-    artist.seeking_venue = bool(form.seeking_venue)
-    artist.seeking_description = form.seeking_description
-    artist.image_link = form.image_link
-
-    # Commit the changes to the database
-    db.session.commit()
+    if form.version.data is None:
+        abort(400)  # Not from the edit form
+
+    # Write the changed attributes if they are valid and nobody else saved the
+    # artist since the form was opened; otherwise show the form again
+    status = save_edit(artist, form)
+    if status != 200:
+        return render_template('forms/edit_artist.html', form=form, artist=artist), status
 
     return redirect(url_for('show_artist', artist_id=artist_id))
 
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@query_budget(1)
 def edit_venue(venue_id):
     # Create an instance of the VenueForm
     form = VenueForm()
@@ -437,6 +714,7 @@ def edit_venue(venue_id):
     form.seeking_talent.data = venue.seeking_talent
     form.seeking_description.data = venue.seeking_description
     form.image_link.data = venue.image_link
+    form.version.data = venue.version
 
     return render_template('forms/edit_venue.html', form=form, venue=venue)
 
@@ -451,34 +729,14 @@ def edit_venue_submission(venue_id):
     if venue is None:
         abort(404)  # Venue not found
 
-    # Retrieve the values from the form submitted
-    name = form.name.data
-    genres = form.genres.data
-    address = form.address.data
-    city = form.city.data
-    state = form.state.data
-    phone = form.phone.data
-    website_link = form.website_link.data
-    facebook_link = form.facebook_link.data
-    seeking_talent = bool(form.seeking_talent.data)
-    seeking_description = form.seeking_description.data
-    image_link = form.image_link.data
-
-    # Update the venue record with the new attributes
-    venue.name = name
-    venue.genres = genres
-    venue.address = address
-    venue.city = city
-    venue.state = state
-    venue.phone = phone
-    venue.website_link = website_link
-    venue.facebook_link = facebook_link
-    venue.seeking_talent = seeking_talent
-    venue.seeking_description = seeking_description
-    venue.image_link = image_link
-
-    # Commit the changes to the database
-    db.session.commit()
+    if form.version.data is None:
+        abort(400)  # Not from the edit form
+
+    # Write the changed attributes if they are valid and nobody else saved the
+    # venue since the form was opened; otherwise show the form again
+    status = save_edit(venue, form)
+    if status != 200:
+        return render_template('forms/edit_venue.html', form=form, venue=venue), status
 
     return redirect(url_for('show_venue', venue_id=venue_id))
 
@@ -517,6 +775,8 @@ def create_artist_submission():
         # Add the new artist record to the database
         db.session.add(new_artist)
         db.session.commit()
+        autocomplete.indexes['artist'].add(new_artist.id, new_artist.name)
+        invalidate('artists', matching.CHANGED[Artist])
 
         # Flash a success message
         flash('Artist ' + new_artist.name + ' was successfully listed!')
@@ -538,28 +798,81 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@query_budget(2)
+@conditional(shows_validators)
+@cached('shows')
 def shows():
     # displays list of shows at /shows
     # TODO: replace with real venues data.
-    # Query the database to get the show information
-    shows = Show.query \
+    # Optionally only the shows starting in [?from=, ?to=) and at venues in ?city=
+    start = datetime_arg('from')
+    end = datetime_arg('to', day_end=True)
+    city = request.args.get('city', '').strip()
+    if start is not None and end is not None and end <= start:
+        abort(400)
+
+    # Query the database for one page of shows, with the venue and artist
+    # columns selected in the same query
+    query = db.session.query(*show_listing_columns(), Show.updated_at, Venue.updated_at.label('venue_updated_at'),
+                             Artist.updated_at.label('artist_updated_at')) \
         .join(Venue, Venue.id == Show.venue_id) \
-        .join(Artist, Artist.id == Show.artist_id) \
-        .all()
+        .join(Artist, Artist.id == Show.artist_id)
+    # Ranges on start_time use ix_show_start_time_id, and on Postgres only
+    # scan the monthly partitions they cover
+    if start is not None:
+        query = query.filter(Show.start_time >= start)
+    if end is not None:
+        query = query.filter(Show.start_time < end)
+    if city:
+        query = query.filter(Venue.city == city)
+    page = paginate(query, (Show.start_time, Show.id))
 
     # Convert the query result to the desired format
     data = []
-    for show in shows:
+    for show in page.items:
         data.append({
             "venue_id": show.venue_id,
-            "venue_name": show.venue.name,
+            "venue_name": show.venue_name,
             "artist_id": show.artist_id,
-            "artist_name": show.artist.name,
-            "artist_image_link": show.artist.image_link,
-            "start_time": str(show.start_time)
+            "artist_name": show.artist_name,
+            "artist_image_link": show.artist_image_link,
+            "start_time": show.start_time,
+            "end_time": show.end_time,
+            "id": show.id,
+            "version": version(show.updated_at, show.venue_updated_at, show.artist_updated_at)
         })
 
-    return render_template('pages/shows.html', shows=data)
+    if wants_json():
+        return jsonify(shows=[dict(without_version(show), start_time=show['start_time'].isoformat(),
+                                   end_time=show['end_time'].isoformat()) for show in data],
+                       **page.to_dict())
+
+    return render_template('pages/shows.html', shows=data, page=page,
+                           filters={'from': request.args.get('from', ''), 'to': request.args.get('to', ''), 'city': city})
+
+
+@app.route('/venues/<int:venue_id>/availability')
+@query_budget(2)
+def venue_availability(venue_id):
+    # Booked shows and free slots at the venue between ?from= and ?to=
+    # (ISO 8601), the next AVAILABILITY_DEFAULT_DAYS by default
+    venue = db.session.query(Venue.id).filter(Venue.id == venue_id).first()
+    if venue is None:
+        abort(404)
+    start = datetime_arg('from') or datetime.now().replace(second=0, microsecond=0)
+    end = datetime_arg('to') or start + timedelta(days=app.config['AVAILABILITY_DEFAULT_DAYS'])
+    if not start < end <= start + timedelta(days=app.config['AVAILABILITY_MAX_DAYS']):
+        abort(400)
+
+    booked, free = bookings.availability(venue_id, start, end)
+    return jsonify(
+        venue_id=venue_id,
+        start=start.isoformat(),
+        end=end.isoformat(),
+        booked=[{'show_id': id, 'start_time': show_start.isoformat(), 'end_time': show_end.isoformat()}
+                for id, show_start, show_end in booked],
+        free=[{'start': free_start.isoformat(), 'end': free_end.isoformat()} for free_start, free_end in free]
+    )
 
 
 @app.route('/shows/create')
@@ -582,14 +895,30 @@ def create_show_submission():
         artist_id = form.artist_id.data
         venue_id = form.venue_id.data
         start_time = form.start_time.data
+        end_time = form.end_time.data or default_end_time(start_time)
+        if not start_time < end_time <= start_time + timedelta(minutes=app.config['SHOW_MAX_MINUTES']):
+            flash('An error occurred. A show must end after it starts and last at most {} hours.'.format(
+                app.config['SHOW_MAX_MINUTES'] // 60))
+            return render_template('pages/home.html')
+
+        # Refuse double bookings of the venue or the artist, holding the
+        # booking lock until the commit so no other show slips in meanwhile
+        bookings.lock()
+        clashes = bookings.conflicts(venue_id, artist_id, start_time, end_time)
+        if clashes:
+            flash('An error occurred. Show could not be listed: it overlaps {} already booked from {} to {}.'.format(
+                'a show at the venue' if str(clashes[0].venue_id) == str(venue_id) else 'a show by the artist',
+                format_datetime(clashes[0].start_time), format_datetime(clashes[0].end_time)))
+            return render_template('pages/home.html')
 
         # Create a new Show record with the form data
-        show = Show(artist_id=artist_id, venue_id=venue_id, start_time=start_time)
+        show = Show(artist_id=artist_id, venue_id=venue_id, start_time=start_time, end_time=end_time)
 
         # on successful db insert, flash success
         # Add the new Show record to the database
         db.session.add(show)
         db.session.commit()
+        invalidate(f'venue:{show.venue_id}', f'artist:{show.artist_id}', 'venues', 'shows')
         flash('Show was successfully listed!')
     except:
         # TODO: on unsuccessful db insert, flash an error instead.
@@ -603,6 +932,139 @@ def create_show_submission():
     return render_template('pages/home.html')
 
 
+#  Batch edits
+#  ----------------------------------------------------------------
+
+@app.route('/api/<any(venues, artists):kind>', methods=['PATCH'])
+def patch_entities(kind):
+    # Applies a JSON list of {"id", "version", <field>: <value>...} changes in
+    # one transaction: all of them or none. 400 for a malformed or invalid
+    # change, 404 for an unknown id, 409 when a version is no longer current.
+    model = Venue if kind == 'venues' else Artist
+    batch, error = edits.parse_batch(model, request.get_json(silent=True))
+    if error:
+        return jsonify(error=error), 400
+
+    entities = edits.load(model, [id for id, version, changes in batch])
+    missing = [id for id, version, changes in batch if id not in entities]
+    if missing:
+        return jsonify(error='Not found.', missing=missing), 404
+    stale = [{'id': id, 'version': entities[id].version}
+             for id, version, changes in batch if version != entities[id].version]
+    if stale:
+        return jsonify(error='Changed since read.', stale=stale), 409
+
+    changed = {}
+    errors = {}
+    for id, version, changes in batch:
+        values, field_errors = edits.validate(entities[id], changes)
+        if field_errors:
+            errors[id] = field_errors
+        else:
+            changed[id] = edits.apply_changes(entities[id], values)
+    if errors:
+        db.session.rollback()
+        return jsonify(error='Invalid changes.', errors=errors), 400
+
+    written = [id for id, version, changes in batch if changed[id]]
+    versions = edits.commit([entities[id] for id, version, changes in batch])
+    if versions is None:
+        return jsonify(error='Changed since read.'), 409
+
+    index, cache_tags = EDIT_TARGETS[model]
+    for id in written:
+        if 'name' in changed[id]:
+            autocomplete.indexes[index].add(id, entities[id].name)
+    if written:
+        invalidate(*cache_tags(*written))
+
+    return jsonify(updated=[{
+        'id': id,
+        'version': version,
+        'changed': changed[id]
+    } for (id, _, _), version in zip(batch, versions)])
+
+
+#  Autocomplete
+#  ----------------------------------------------------------------
+
+@app.route('/api/autocomplete')
+@query_budget(1)
+def autocomplete_names():
+    # Typeahead for the navbar search, answered from the in-process prefix index
+    index = autocomplete.indexes.get(request.args.get('type'))
+    if index is None:
+        abort(400)  # Unknown entity type
+
+    limit = request.args.get('limit', app.config['AUTOCOMPLETE_LIMIT'], type=int)
+    limit = max(1, min(limit, app.config['AUTOCOMPLETE_LIMIT']))
+    results = index.complete(request.args.get('q', ''), limit)
+
+    return jsonify(results=[{
+        'id': id,
+        'name': name
+    } for id, name in results])
+
+
+#  Database pool
+#  ----------------------------------------------------------------
+
+@app.route('/api/pool')
+def pool_status():
+    # Connection pool usage of this worker process
+    return jsonify(pool_stats.snapshot(db.engine.pool))
+
+
+#  Metrics
+#  ----------------------------------------------------------------
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Per-endpoint latency and SQL statistics of this worker process
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+#  Export
+#  ----------------------------------------------------------------
+
+@app.route('/api/export/<any(shows, venues, artists):kind>')
+def export(kind):
+    # Streams every row as newline-delimited JSON from a server-side cursor,
+    # so memory use does not grow with the table.
+    # ?since=<ISO datetime> limits to rows updated since then,
+    # ?fields=a,b,c selects the fields written.
+    columns, model = export_columns(kind)
+
+    names = request.args.get('fields')
+    names = [name.strip() for name in names.split(',') if name.strip()] if names else list(columns)
+    if not names or any(name not in columns for name in names):
+        abort(400)  # Unknown field
+
+    query = db.session.query(*[columns[name] for name in names]).select_from(model)
+    if kind == 'shows':
+        query = query \
+            .join(Venue, Venue.id == Show.venue_id) \
+            .join(Artist, Artist.id == Show.artist_id)
+
+    since = request.args.get('since')
+    if since:
+        try:
+            query = query.filter(model.updated_at >= datetime.fromisoformat(since))
+        except ValueError:
+            abort(400)  # Malformed since
+
+    query = query \
+        .order_by(model.id) \
+        .execution_options(stream_results=True) \
+        .yield_per(app.config['EXPORT_BATCH_SIZE'])
+
+    def generate():
+        for row in query:
+            yield json.dumps(dict(zip(names, row)), default=lambda value: value.isoformat()) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -614,15 +1076,20 @@ def server_error(error):
 
 
 if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter(
-            '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
+    logs.init_error_log(app)
     app.logger.info('errors')
+logs.init_access_log(app)
+
+
+@app.before_first_request
+def warm():
+    # Only processes serving requests build the autocomplete indexes and
+    # precompute suggestions; CLI commands importing the app never get here
+    if app.config['AUTOCOMPLETE_WARM']:
+        autocomplete.warm()
+    if app.config['SUGGESTIONS_WARM']:
+        matching.warm()
+
 
 # ----------------------------------------------------------------------------#
 # Launch.
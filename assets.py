@@ -0,0 +1,204 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import click
+from flask import request, send_from_directory, url_for
+from models import app
+import cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+# ----------------------------------------------------------------------------#
+# Static assets.
+#
+# `flask build-assets` concatenates and minifies the bundles below into
+# static/dist under content-hashed names, next to .gz (and, with the brotli
+# package installed, .br) copies and a manifest.json. Templates link them
+# with asset_url() / asset_urls(), which read the manifest and fall back to
+# the unbundled source files until a build exists. Hashed files are served
+# precompressed when the client accepts it, and cached for a year.
+# ----------------------------------------------------------------------------#
+
+DIST_DIR = 'dist'
+MANIFEST = os.path.join(app.static_folder, DIST_DIR, 'manifest.json')
+
+# Bundle name: source files under static/, in load order. Bundles are written
+# to static/dist, at the same depth as static/css, so the stylesheets'
+# relative url(../fonts/...) references still resolve.
+BUNDLES = {
+    'site.css': [
+        'css/bootstrap.min.css',
+        'css/layout.main.css',
+        'css/main.css',
+        'css/main.responsive.css',
+        'css/main.quickfix.css'
+    ],
+    'head.js': [
+        'js/libs/modernizr-2.8.2.min.js',
+        'js/libs/moment.min.js'
+    ],
+    'site.js': [
+        'js/script.js',
+        'js/libs/bootstrap-3.1.1.min.js',
+        'js/plugins.js'
+    ],
+    'jquery.js': ['js/libs/jquery-1.11.1.min.js'],
+    'respond.js': ['js/libs/respond-1.4.2.min.js']
+}
+
+# Compressing tiny files costs more than it saves
+MIN_COMPRESS_BYTES = 256
+
+
+def minify_css(css):
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    # Not around ':' and friends in general: 'a :hover' differs from 'a:hover'
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    return css.replace(';}', '}').strip()
+
+
+def minify_js(js, path):
+    # Already-minified libraries are left alone; the rest only with rjsmin
+    if path.endswith('.min.js') or rjsmin is None:
+        return js
+    return rjsmin.jsmin(js)
+
+
+def build_bundle(name, sources):
+    contents = []
+    for source in sources:
+        with open(os.path.join(app.static_folder, source), encoding='utf-8') as f:
+            text = f.read()
+        contents.append(minify_css(text) if name.endswith('.css') else minify_js(text, source))
+    # A separator after each script in case one lacks a final semicolon
+    return ('\n' if name.endswith('.css') else '\n;\n').join(contents).encode('utf-8')
+
+
+def build(clean=False):
+    # Writes every bundle and the manifest; returns the manifest
+    directory = os.path.join(app.static_folder, DIST_DIR)
+    os.makedirs(directory, exist_ok=True)
+    manifest = {'assets': {}, 'compressed': []}
+    written = set()
+
+    def write(filename, data):
+        with open(os.path.join(directory, filename), 'wb') as f:
+            f.write(data)
+        written.add(filename)
+
+    for name, sources in BUNDLES.items():
+        data = build_bundle(name, sources)
+        stem, extension = os.path.splitext(name)
+        filename = '{}.{}{}'.format(stem, hashlib.sha256(data).hexdigest()[:12], extension)
+        write(filename, data)
+        path = f'{DIST_DIR}/{filename}'
+        manifest['assets'][name] = path
+        if len(data) >= MIN_COMPRESS_BYTES:
+            write(filename + '.gz', gzip.compress(data, 9, mtime=0))
+            manifest['compressed'].append(path + '.gz')
+            if brotli is not None:
+                write(filename + '.br', brotli.compress(data, quality=11))
+                manifest['compressed'].append(path + '.br')
+
+    if clean:
+        # Old hashed files stay by default: pages rendered before the build may still link them
+        for entry in os.scandir(directory):
+            if entry.name not in written and entry.name != 'manifest.json':
+                os.remove(entry.path)
+
+    with open(MANIFEST + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(MANIFEST + '.tmp', MANIFEST)
+    return manifest
+
+
+_manifest = {'mtime': None, 'assets': {}, 'compressed': frozenset()}
+
+
+def manifest():
+    # The build's manifest, reloaded when the file changes
+    try:
+        mtime = os.stat(MANIFEST).st_mtime
+    except OSError:
+        mtime = None
+    if mtime != _manifest['mtime']:
+        data = {}
+        if mtime is not None:
+            with open(MANIFEST) as f:
+                data = json.load(f)
+        _manifest.update(
+            mtime=mtime,
+            assets=data.get('assets', {}),
+            compressed=frozenset(data.get('compressed', ()))
+        )
+    return _manifest
+
+
+@app.template_global()
+def asset_urls(name):
+    # URLs to link for a bundle: the built file, or its sources before a build
+    built = manifest()['assets'].get(name)
+    if built is not None:
+        return [url_for('static', filename=built)]
+    return [url_for('static', filename=source) for source in BUNDLES.get(name, [name])]
+
+
+@app.template_global()
+def asset_url(name):
+    # URL of a single-file bundle or a plain static file
+    return asset_urls(name)[0]
+
+
+def send_static(filename):
+    if not filename.startswith(DIST_DIR + '/'):
+        return app.send_static_file(filename)
+
+    compressed = manifest()['compressed']
+    encoding = None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[candidate] and filename + suffix in compressed:
+            encoding = candidate
+            break
+    max_age = app.config['ASSETS_MAX_AGE']
+    if encoding is None:
+        response = send_from_directory(app.static_folder, filename, max_age=max_age)
+    else:
+        response = send_from_directory(
+            app.static_folder, filename + suffix, max_age=max_age,
+            mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['Content-Encoding'] = encoding
+    # Hashed names change with their content, so a copy never goes stale
+    response.headers['Cache-Control'] = f'public, max-age={max_age}, immutable'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+app.view_functions['static'] = send_static
+
+
+@app.cli.command('build-assets')
+@click.option('--clean', is_flag=True, help='Delete files left over from earlier builds.')
+def build_assets_command(clean):
+    """Bundle, minify, fingerprint and precompress the static assets."""
+    built = build(clean)
+    # Cached pages link the previous build
+    cache.clear()
+    for name, path in sorted(built['assets'].items()):
+        size = os.path.getsize(os.path.join(app.static_folder, path))
+        variants = [variant[len(path):] for variant in built['compressed'] if variant.startswith(path + '.')]
+        click.echo(f'{name:<12} {path:<36} {size:>8} bytes {" ".join(variants)}')
+    if brotli is None:
+        click.echo('Install brotli to also write .br files.', err=True)
@@ -0,0 +1,162 @@
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from datetime import timedelta
+from sqlalchemy.exc import SQLAlchemyError
+from models import app, db, Venue, Artist
+from cache import tag_version, invalidate, ALL_PAGES
+
+# ----------------------------------------------------------------------------#
+# In-process prefix index for name typeahead.
+#
+# Every word start of a normalized name is kept in a sorted array of
+# (key, id) pairs, so a lookup is one bisect plus a short scan and never
+# touches the database. Each worker builds the indexes before handling its
+# first request (see warm()); an index that could not be built then is built
+# by the first lookup instead.
+#
+# Each worker holds its own copy, versioned by cache tags that every worker
+# on the host shares (see cache.py). A write updates the copy of the worker
+# that made it and bumps the tag; the others notice on their next lookup and
+# read the rows updated since they last looked. Deletes bump a second tag,
+# and clear() the all-pages one, either of which rebuilds the index. CLI
+# writers (flask import, flask seed) bump the same tags through changed().
+# Without a page cache the tags have no versions, so each worker only sees
+# its own writes until it restarts.
+# ----------------------------------------------------------------------------#
+
+# Rows written by transactions still open at a refresh carry an updated_at
+# from before it; look back this far so they are picked up next time
+REFRESH_OVERLAP = timedelta(minutes=1)
+
+
+def normalize(name):
+    # Case-folded, accent-stripped, single-spaced
+    decomposed = unicodedata.normalize('NFKD', name or '')
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(stripped.casefold().split())
+
+
+def _keys(id, name):
+    words = normalize(name).split(' ')
+    return [(' '.join(words[i:]), id) for i in range(len(words)) if words[i]]
+
+
+class PrefixIndex(object):
+    def __init__(self, kind, model):
+        self.model = model
+        # Bumped on inserts and renames, and on deletes
+        self.tag = f'autocomplete:{kind}'
+        self.deleted_tag = f'autocomplete:{kind}:deleted'
+        self._keys = []
+        self._names = {}
+        self._version = None
+        self._updated_at = None
+        self._lock = threading.RLock()
+
+    def _current(self):
+        return tag_version(ALL_PAGES), tag_version(self.deleted_tag), tag_version(self.tag)
+
+    def load(self):
+        # (Re)builds the index from the database
+        version = self._current()
+        rows = db.session.query(self.model.id, self.model.name, self.model.updated_at).all()
+        keys = sorted(key for row in rows for key in _keys(row.id, row.name))
+        with self._lock:
+            self._keys = keys
+            self._names = {row.id: row.name for row in rows}
+            self._updated_at = max((row.updated_at for row in rows), default=None)
+            self._version = version
+
+    def _refresh(self):
+        # Catches up with writes made by other workers and the CLI since the
+        # last lookup
+        version = self._current()
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            if self._version is None or version[:2] != self._version[:2] or self._updated_at is None:
+                self.load()
+                return
+            rows = db.session.query(self.model.id, self.model.name, self.model.updated_at) \
+                .filter(self.model.updated_at >= self._updated_at - REFRESH_OVERLAP) \
+                .all()
+            for row in rows:
+                self._add(row.id, row.name)
+            self._updated_at = max([self._updated_at] + [row.updated_at for row in rows])
+            self._version = version
+
+    def add(self, id, name):
+        # Inserts or renames an entry, here and, through the tag, in every worker
+        with self._lock:
+            if self._version is not None:
+                self._add(id, name)
+        invalidate(self.tag)
+
+    def remove(self, id):
+        with self._lock:
+            if self._version is not None:
+                self._discard(id)
+        invalidate(self.deleted_tag)
+
+    def _add(self, id, name):
+        self._discard(id)
+        self._names[id] = name
+        for key in _keys(id, name):
+            insort(self._keys, key)
+
+    def _discard(self, id):
+        name = self._names.pop(id, None)
+        if name is None:
+            return
+        for key in _keys(id, name):
+            position = bisect_left(self._keys, key)
+            if position < len(self._keys) and self._keys[position] == key:
+                del self._keys[position]
+
+    def complete(self, prefix, limit=10):
+        # Returns up to `limit` (id, name) pairs whose name has a word starting with prefix
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        self._refresh()
+        results = []
+        seen = set()
+        with self._lock:
+            position = bisect_left(self._keys, (prefix,))
+            while position < len(self._keys) and len(results) < limit:
+                key, id = self._keys[position]
+                if not key.startswith(prefix):
+                    break
+                if id not in seen:
+                    seen.add(id)
+                    results.append((id, self._names[id]))
+                position += 1
+        return results
+
+
+indexes = {
+    'artist': PrefixIndex('artist', Artist),
+    'venue': PrefixIndex('venue', Venue)
+}
+
+
+def changed(*kinds):
+    # Tells every worker's index of kinds ('venue', 'artist') about rows
+    # written outside the request handlers, e.g. by the CLI
+    invalidate(*(indexes[kind].tag for kind in kinds))
+
+
+def warm():
+    # Builds every index now; call within an app or request context. A
+    # database that is unreachable or has no tables yet only costs a warning.
+    for kind, index in indexes.items():
+        try:
+            index.load()
+        except SQLAlchemyError as ex:
+            db.session.rollback()
+            app.logger.warning('Autocomplete index %s not built in advance: %s', kind, ex)
+    db.session.remove()
@@ -0,0 +1,269 @@
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+import babel.dates
+import click
+import dateutil.parser
+from models import app, db, Venue, Artist
+from formdata import to_formdata
+from dataset import Generator, WORDS, CITIES
+import geo
+import cache
+
+# ----------------------------------------------------------------------------#
+# Route benchmarks.
+#
+# `flask benchmark` drives every route in app.py through the Flask test client
+# against the configured database (SQLite or Postgres, seeded with
+# `flask seed`), reports throughput and p50/p95/p99 latency per route, and
+# compares them with a stored baseline. Write routes really write, so run it
+# against a scratch database.
+# ----------------------------------------------------------------------------#
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+
+# Endpoints left out on purpose
+SKIPPED = {'static'}
+
+
+class Bench(object):
+    # Random but reproducible request arguments drawn from the seeded data
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+        self.generator = Generator(seed)
+        self.venue_ids = [id for id, in db.session.query(Venue.id).order_by(Venue.id)]
+        self.artist_ids = [id for id, in db.session.query(Artist.id).order_by(Artist.id)]
+        self.created = 0
+        if not self.venue_ids or not self.artist_ids:
+            raise click.ClickException('No venues or artists to benchmark; run `flask seed` first.')
+
+    def venue(self):
+        return self.random.choice(self.venue_ids)
+
+    def artist(self):
+        return self.random.choice(self.artist_ids)
+
+    def near(self):
+        # A point somewhere around one of the seeded cities
+        city, state, weight = self.random.choice(CITIES)
+        latitude, longitude = geo.centroid(city, state)
+        return latitude + self.random.gauss(0, 0.1), longitude + self.random.gauss(0, 0.1)
+
+    def edit(self, model, values):
+        # Form data editing a random row of model into values, at its current version
+        id = self.venue() if model is Venue else self.artist()
+        version, = db.session.query(model.version).filter(model.id == id).one()
+        db.session.remove()
+        return f'/{model.__tablename__.lower()}s/{id}/edit', to_formdata(dict(values, version=version))
+
+    def patch(self, model, count=50):
+        # A PATCH batch changing the seeking description of count random rows
+        ids = self.venue_ids if model is Venue else self.artist_ids
+        ids = self.random.sample(ids, min(count, len(ids)))
+        versions = db.session.query(model.id, model.version).filter(model.id.in_(ids))
+        changes = [{'id': id, 'version': version, 'seeking_description': ' '.join(self.random.sample(WORDS, 3))}
+                   for id, version in versions]
+        db.session.remove()
+        return '/api/{}s'.format(model.__tablename__.lower()), changes
+
+    def word(self):
+        return self.random.choice(WORDS)
+
+    def number(self):
+        self.created += 1
+        return 900000000 + self.created
+
+    def new_venue(self):
+        venue = Venue(**self.generator.venue(self.number()))
+        db.session.add(venue)
+        db.session.commit()
+        id = venue.id
+        db.session.remove()
+        return id
+
+
+# endpoint: (method, request factory returning (url, form data, a JSON list or None))
+ROUTES = {
+    'index': ('GET', lambda bench: ('/', None)),
+    'venues': ('GET', lambda bench: ('/venues', None)),
+    'nearby_venues': ('GET', lambda bench: ('/venues/nearby?lat={:.4f}&lng={:.4f}&radius={}&format=json'.format(
+        *bench.near(), bench.random.choice((2, 10, 50))), None)),
+    'search_venues': ('POST', lambda bench: ('/venues/search', {'search_term': bench.word()})),
+    'show_venue': ('GET', lambda bench: (f'/venues/{bench.venue()}', None)),
+    'venue_availability': ('GET', lambda bench: (f'/venues/{bench.venue()}/availability', None)),
+    'suggested_artists': ('GET', lambda bench: (f'/venues/{bench.venue()}/suggested-artists', None)),
+    'create_venue_form': ('GET', lambda bench: ('/venues/create', None)),
+    'create_venue_submission': ('POST', lambda bench: (
+        '/venues/create', to_formdata(bench.generator.venue(bench.number())))),
+    'delete_venue': ('DELETE', lambda bench: (f'/venues/{bench.new_venue()}', None)),
+    'artists': ('GET', lambda bench: ('/artists', None)),
+    'search_artists': ('POST', lambda bench: ('/artists/search', {'search_term': bench.word()})),
+    'show_artist': ('GET', lambda bench: (f'/artists/{bench.artist()}', None)),
+    'suggested_venues': ('GET', lambda bench: (f'/artists/{bench.artist()}/suggested-venues', None)),
+    'edit_artist': ('GET', lambda bench: (f'/artists/{bench.artist()}/edit', None)),
+    'edit_artist_submission': ('POST', lambda bench: bench.edit(Artist, bench.generator.artist(bench.number()))),
+    'edit_venue': ('GET', lambda bench: (f'/venues/{bench.venue()}/edit', None)),
+    'edit_venue_submission': ('POST', lambda bench: bench.edit(Venue, bench.generator.venue(bench.number()))),
+    'create_artist_form': ('GET', lambda bench: ('/artists/create', None)),
+    'create_artist_submission': ('POST', lambda bench: (
+        '/artists/create', to_formdata(bench.generator.artist(bench.number())))),
+    'shows': ('GET', lambda bench: ('/shows', None)),
+    'create_shows': ('GET', lambda bench: ('/shows/create', None)),
+    'create_show_submission': ('POST', lambda bench: ('/shows/create', {
+        'artist_id': bench.artist(),
+        'venue_id': bench.venue(),
+        'start_time': bench.generator.start_time().strftime('%Y-%m-%d %H:%M:%S')
+    })),
+    'patch_entities': ('PATCH', lambda bench: bench.patch(bench.random.choice((Venue, Artist)))),
+    'autocomplete_names': ('GET', lambda bench: (
+        '/api/autocomplete?type={}&q={}'.format(bench.random.choice(('venue', 'artist')), bench.word()[:3]), None)),
+    'pool_status': ('GET', lambda bench: ('/api/pool', None)),
+    'prometheus_metrics': ('GET', lambda bench: ('/metrics', None)),
+    'export': ('GET', lambda bench: ('/api/export/{}?since={}'.format(
+        bench.random.choice(('shows', 'venues', 'artists')),
+        (datetime.utcnow() - timedelta(minutes=1)).isoformat()), None))
+}
+
+
+def percentile(timings, fraction):
+    # Nearest-rank percentile of sorted timings
+    return timings[min(len(timings) - 1, max(0, int(round(fraction * len(timings) + 0.5)) - 1))]
+
+
+def run(endpoints, requests, warmup, seed=0):
+    # Returns {endpoint: stats}, latencies in milliseconds
+    bench = Bench(seed)
+    client = app.test_client()
+    results = {}
+    for endpoint in endpoints:
+        method, make = ROUTES[endpoint]
+        timings = []
+        errors = 0
+        for number in range(warmup + requests):
+            url, data = make(bench)
+            started = time.perf_counter()
+            body = {'json': data} if isinstance(data, list) else {'data': data}
+            response = client.open(url, method=method, **body)
+            response.get_data()
+            elapsed = time.perf_counter() - started
+            response.close()
+            # The CLI's app context outlives each request, so its session would too
+            db.session.remove()
+            if number < warmup:
+                continue
+            timings.append(elapsed)
+            if response.status_code >= 500:
+                errors += 1
+        total = sum(timings)
+        timings.sort()
+        results[endpoint] = {
+            'requests': requests,
+            'errors': errors,
+            'rps': requests / total if total else 0.0,
+            'p50': percentile(timings, 0.50) * 1000,
+            'p95': percentile(timings, 0.95) * 1000,
+            'p99': percentile(timings, 0.99) * 1000
+        }
+    return results
+
+
+def compare(results, baseline, tolerance, floor_ms=1.0):
+    # Endpoints whose p95 got slower than the baseline by more than tolerance
+    # (a fraction) and floor_ms, as (endpoint, baseline p95, current p95)
+    regressions = []
+    for endpoint, stats in results.items():
+        before = baseline.get('routes', {}).get(endpoint)
+        if before and stats['p95'] > before['p95'] * (1 + tolerance) and stats['p95'] - before['p95'] > floor_ms:
+            regressions.append((endpoint, before['p95'], stats['p95']))
+    return regressions
+
+
+@app.cli.command('benchmark')
+@click.option('--requests', 'count', default=200, help='Timed requests per route.')
+@click.option('--warmup', default=10, help='Untimed requests per route first.')
+@click.option('--route', 'routes', multiple=True, help='Benchmark only this endpoint; repeatable.')
+@click.option('--cache/--no-cache', 'use_cache', default=True, help='Serve cacheable pages from the page cache.')
+@click.option('--baseline', type=click.Path(dir_okay=False), help='Defaults to benchmarks/<dialect>.json.')
+@click.option('--save', is_flag=True, help='Store these results as the new baseline.')
+@click.option('--tolerance', default=0.25, help='Allowed p95 slowdown against the baseline, as a fraction.')
+@click.option('--seed', default=0, help='Random seed for the request arguments.')
+def benchmark_command(count, warmup, routes, use_cache, baseline, save, tolerance, seed):
+    """Benchmark every route and compare against the stored baseline."""
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        raise click.BadParameter(', '.join(sorted(unknown)), param_hint='--route')
+    missing = set(app.view_functions) - set(ROUTES) - SKIPPED
+    if missing:
+        click.echo('Not benchmarked: ' + ', '.join(sorted(missing)), err=True)
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    if not use_cache:
+        cache.page_cache = cache.NullCache()
+
+    dialect = db.engine.dialect.name
+    results = run(routes or list(ROUTES), count, warmup, seed)
+
+    click.echo(f'{"route":<26} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"errors":>7}')
+    for endpoint, stats in results.items():
+        click.echo('{:<26} {rps:>9.1f} {p50:>9.2f} {p95:>9.2f} {p99:>9.2f} {errors:>7}'.format(endpoint, **stats))
+
+    baseline = baseline or os.path.join(BASELINE_DIR, f'{dialect}.json')
+    if save:
+        os.makedirs(os.path.dirname(os.path.abspath(baseline)), exist_ok=True)
+        with open(baseline, 'w') as f:
+            json.dump({
+                'dialect': dialect,
+                'created': datetime.utcnow().isoformat(),
+                'cache': use_cache,
+                'routes': results
+            }, f, indent=2, sort_keys=True)
+        click.echo(f'Saved baseline to {baseline}.')
+        return
+    if not os.path.exists(baseline):
+        raise click.ClickException(f'No baseline at {baseline}; use --save to create one.')
+
+    with open(baseline) as f:
+        stored = json.load(f)
+    if stored.get('cache') != use_cache:
+        click.echo('The baseline was recorded with the page cache {}.'.format(
+            'on' if stored.get('cache') else 'off'), err=True)
+    regressions = compare(results, stored, tolerance)
+    for endpoint, before, after in regressions:
+        click.echo(f'REGRESSION {endpoint}: p95 {before:.2f}ms -> {after:.2f}ms', err=True)
+    if regressions:
+        raise click.exceptions.Exit(1)
+    click.echo(f'No p95 regressions beyond {tolerance:.0%} against {baseline}.')
+
+
+@app.cli.command('benchmark-datetime')
+@click.option('--shows', 'count', default=10000, help='Show times formatted, as on one /shows page.')
+@click.option('--format', 'format', default='full', type=click.Choice(['full', 'medium']))
+@click.option('--seed', default=0, help='Random seed for the show times.')
+def benchmark_datetime_command(count, format, seed):
+    """Compare the per-tile cost of the datetime filter with the original one."""
+    from app import DATETIME_FORMATS, format_datetime, format_datetimes
+    generator = Generator(seed)
+    times = [generator.start_time() for _ in range(count)]
+
+    def original(value):
+        # The filter as it was: views passed str(start_time), parsed again here,
+        # and babel resolved the pattern and locale on every call
+        return babel.dates.format_datetime(dateutil.parser.parse(value), DATETIME_FORMATS[format], locale='en')
+
+    cases = (
+        ('str -> parse -> babel', lambda values: [original(value) for value in values], [str(value) for value in times]),
+        ('format_datetime', lambda values: [format_datetime(value, format) for value in values], times),
+        ('format_datetimes', lambda values: format_datetimes(values, format), times)
+    )
+    outputs = []
+    click.echo(f'{"":<24} {"us/tile":>9}')
+    for name, formatter, values in cases:
+        started = time.perf_counter()
+        outputs.append(formatter(values))
+        elapsed = time.perf_counter() - started
+        click.echo(f'{name:<24} {elapsed / count * 1e6:>9.1f}')
+    for (name, _, _), output in zip(cases[1:], outputs[1:]):
+        if output != outputs[0]:
+            raise click.ClickException(f'{name} output differs from the original filter.')
@@ -0,0 +1,147 @@
+from bisect import bisect_left, insort
+from datetime import timedelta
+from models import app, db, Show
+
+# ----------------------------------------------------------------------------#
+# Bookings.
+#
+# A show occupies its venue and its artist over [start_time, end_time).
+# Overlap queries go through the interval indexes created by
+# models.booking_ddl: the GiST exclusion indexes on Postgres and the
+# Show_intervals R*Tree on SQLite. Other databases fall back to a start_time
+# range bounded by the longest allowed show. Postgres only enforces overlaps
+# within each monthly partition, so the checks here (conflicts() for a new
+# show, booked_between() for an import batch) are what catch the ones across
+# a month boundary; writers take lock() first so two of them can't both pass
+# their check before either commits.
+# ----------------------------------------------------------------------------#
+
+
+def _minutes(value, round_up=False):
+    # Minutes since the epoch, as stored in Show_intervals
+    seconds = (value - value.__class__(1970, 1, 1)).total_seconds()
+    return int(seconds // 60) + (1 if round_up and seconds % 60 else 0)
+
+
+def _overlapping_postgresql(kind, key, start, end):
+    # The start_time bounds let Postgres skip the other monthly partitions
+    earliest = start - timedelta(minutes=app.config['SHOW_MAX_MINUTES'])
+    return db.session.query(Show).filter(
+        getattr(Show, f'{kind}_id') == key,
+        Show.start_time > earliest,
+        Show.start_time < end,
+        db.func.tsrange(Show.start_time, Show.end_time).op('&&')(db.func.tsrange(start, end))
+    )
+
+
+def _overlapping_sqlite(kind, key, start, end):
+    intervals = db.table(
+        'Show_intervals',
+        db.column('id'), db.column(f'{kind}_lo'), db.column(f'{kind}_hi'), db.column('start_lo'), db.column('end_hi')
+    )
+    return db.session.query(Show) \
+        .join(intervals, intervals.c.id == Show.id) \
+        .filter(
+            intervals.c[f'{kind}_lo'] <= key,
+            intervals.c[f'{kind}_hi'] >= key,
+            intervals.c.start_lo < _minutes(end, round_up=True),
+            intervals.c.end_hi > _minutes(start),
+            Show.start_time < end,
+            Show.end_time > start
+        )
+
+
+def _overlapping_fallback(kind, key, start, end):
+    earliest = start - timedelta(minutes=app.config['SHOW_MAX_MINUTES'])
+    return db.session.query(Show).filter(
+        getattr(Show, f'{kind}_id') == key, Show.start_time > earliest, Show.start_time < end, Show.end_time > start
+    )
+
+
+def overlapping(kind, key, start, end):
+    # Query of the shows at venue (kind 'venue') or by artist ('artist') key
+    # that overlap [start, end)
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return _overlapping_postgresql(kind, key, start, end)
+    if dialect == 'sqlite':
+        return _overlapping_sqlite(kind, key, start, end)
+    return _overlapping_fallback(kind, key, start, end)
+
+
+def lock():
+    # Holds off other new bookings until the transaction ends (Postgres; the
+    # SQLite triggers check every overlap themselves). Take it before checking
+    # for conflicts and keep it through the insert.
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(db.text('LOCK TABLE "Show" IN SHARE ROW EXCLUSIVE MODE'))
+
+
+def conflicts(venue_id, artist_id, start, end, exclude_id=None):
+    # Shows that a booking of the artist at the venue over [start, end) would
+    # overlap, ordered by start time
+    shows = []
+    for kind, key in (('venue', venue_id), ('artist', artist_id)):
+        query = overlapping(kind, key, start, end)
+        if exclude_id is not None:
+            query = query.filter(Show.id != exclude_id)
+        shows.extend(query.all())
+    return sorted(set(shows), key=lambda show: (show.start_time, show.id))
+
+
+def booked_between(venue_ids, artist_ids, start, end):
+    # Every show at one of the venues or by one of the artists that overlaps
+    # [start, end), as (id, venue_id, artist_id, start_time, end_time) rows;
+    # one query for checking a whole batch of new bookings
+    earliest = start - timedelta(minutes=app.config['SHOW_MAX_MINUTES'])
+    return db.session.query(Show.id, Show.venue_id, Show.artist_id, Show.start_time, Show.end_time).filter(
+        db.or_(Show.venue_id.in_(venue_ids), Show.artist_id.in_(artist_ids)),
+        Show.start_time > earliest,
+        Show.start_time < end,
+        Show.end_time > start
+    ).all()
+
+
+def availability(venue_id, start, end):
+    # (booked, free) for the venue over [start, end): booked as the
+    # overlapping (show id, start, end) rows, free as (start, end) gaps
+    booked = overlapping('venue', venue_id, start, end) \
+        .with_entities(Show.id, Show.start_time, Show.end_time) \
+        .order_by(Show.start_time) \
+        .all()
+    free = []
+    cursor = start
+    for id, show_start, show_end in booked:
+        if show_start > cursor:
+            free.append((cursor, show_start))
+        cursor = max(cursor, show_end)
+    if cursor < end:
+        free.append((cursor, end))
+    return booked, free
+
+
+class IntervalIndex(object):
+    # In-memory interval index for checking many new bookings against each
+    # other and the shows already booked (e.g. one import batch): per key,
+    # (start, end, show id, 0 when not saved yet) sorted by start; an overlap starts at most
+    # SHOW_MAX_MINUTES before
+
+    def __init__(self, max_length):
+        self.max_length = max_length
+        self._intervals = {}
+
+    def find(self, key, start, end):
+        # The first interval of key overlapping [start, end), or None
+        intervals = self._intervals.get(key, [])
+        index = bisect_left(intervals, (start - self.max_length,))
+        while index < len(intervals) and intervals[index][0] < end:
+            if intervals[index][1] > start:
+                return intervals[index]
+            index += 1
+        return None
+
+    def overlaps(self, key, start, end):
+        return self.find(key, start, end) is not None
+
+    def add(self, key, start, end, id=0):
+        insort(self._intervals.setdefault(key, []), (start, end, id))
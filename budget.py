@@ -0,0 +1,91 @@
+import os
+import traceback
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from models import app
+# metrics registers its after_request hook first; Flask runs them in reverse
+import metrics
+
+# ----------------------------------------------------------------------------#
+# Query budgets.
+#
+# A view decorated with @query_budget(n) (or listed in QUERY_BUDGETS) may run
+# at most n SQL statements per request, however many rows it shows, which
+# catches N+1 patterns such as lazy show.venue / show.artist access. Going
+# over budget raises QueryBudgetExceeded, listing every statement and the line
+# that ran it, when QUERY_BUDGET_RAISE is set (debug and testing by default),
+# and logs a warning otherwise.
+# ----------------------------------------------------------------------------#
+
+SOURCE_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(limit):
+    # functools.wraps carries the attribute up through @cached and @conditional
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def _budget_for(endpoint):
+    budgets = app.config['QUERY_BUDGETS']
+    if endpoint in budgets:
+        return budgets[endpoint]
+    view = app.view_functions.get(endpoint)
+    return getattr(view, 'query_budget', None)
+
+
+def _raise_on_overrun():
+    setting = app.config['QUERY_BUDGET_RAISE']
+    return app.debug or app.testing if setting is None else setting
+
+
+def _call_site():
+    # Innermost frame in this repository outside the instrumentation itself
+    for frame in reversed(traceback.extract_stack()):
+        if frame.filename.startswith(SOURCE_ROOT) and frame.filename != __file__:
+            return f'{os.path.relpath(frame.filename, SOURCE_ROOT)}:{frame.lineno} in {frame.name}'
+    return 'unknown'
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _log_statement(conn, cursor, statement, parameters, context, executemany):
+    if not has_request_context() or 'query_log' not in g:
+        return
+    # Replica health checks are routing overhead, not the view's queries
+    if context is not None and context.execution_options.get('health_check'):
+        return
+    g.query_log.append((statement, _call_site() if g.query_call_sites else None))
+
+
+@app.before_request
+def start_query_log():
+    budget = _budget_for(request.endpoint)
+    if budget is not None:
+        g.query_budget = budget
+        g.query_log = []
+        # Walking the stack per statement is only worth it when raising
+        g.query_call_sites = _raise_on_overrun()
+
+
+@app.after_request
+def check_query_budget(response):
+    log = g.pop('query_log', None)
+    if log is None or len(log) <= g.query_budget:
+        return response
+
+    message = f'{request.endpoint} ran {len(log)} SQL statements, over its budget of {g.query_budget}'
+    if g.query_call_sites:
+        details = '\n'.join(
+            f'  {number}. {site}\n     {" ".join(statement.split())}'
+            for number, (statement, site) in enumerate(log, start=1)
+        )
+        raise QueryBudgetExceeded(f'{message}:\n{details}')
+    app.logger.warning('%s: %s', message, ' | '.join(' '.join(statement.split())[:200] for statement, site in log))
+    return response
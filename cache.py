@@ -0,0 +1,259 @@
+import functools
+import hashlib
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from flask import Response, g, make_response, request, session
+from models import app
+
+# ----------------------------------------------------------------------------#
+# Rendered page cache.
+#
+# Pages are cached under their route, URL and the current version of every
+# tag they depend on ("venue:1", "venues", ...). Writes invalidate by giving
+# a tag a new version, which makes every page built from the old one
+# unreachable; stale entries then age out through the TTL or LRU bound.
+#
+# Tag versions decide what every worker may serve, so they are kept where all
+# the workers on the host see them: with the filesystem backend, next to the
+# pages; with the memory one, in a shared directory of their own
+# (CACHE_TAG_DIR). An edit handled by one worker then invalidates the pages of
+# all of them. clear() does the same for every page at once.
+#
+# With no page cache (CACHE_TYPE 'null') there is no tag store either: tags
+# have no version (see versioned()), invalidate() writes nothing, and the
+# conditional GET, autocomplete and matching code that reads versions falls
+# back to what it can do without them.
+# ----------------------------------------------------------------------------#
+
+
+class NullCache(object):
+    def get(self, key):
+        return None
+
+    def set(self, key, value, timeout=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryCache(object):
+    # Per-process LRU with a TTL per entry and a bound on the bytes stored
+
+    def __init__(self, default_timeout=300, max_bytes=64 * 1024 * 1024):
+        self.default_timeout = default_timeout
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires and expires < time.time():
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        timeout = self.default_timeout if timeout is None else timeout
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (time.time() + timeout if timeout else 0, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(key) + len(entry[1])
+
+
+class FileSystemCache(object):
+    # One file per entry in a directory shared by every worker on the host.
+    # Each file holds its expiry time followed by the value; writes go through
+    # a temporary file and an atomic rename.
+
+    _header = struct.Struct('!d')
+
+    def __init__(self, directory, default_timeout=300, max_entries=10000):
+        self.directory = directory
+        self.default_timeout = default_timeout
+        self.max_entries = max_entries
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                expires, = self._header.unpack(f.read(self._header.size))
+                if expires and expires < time.time():
+                    raise EOFError(path)
+                return f.read()
+        except (OSError, struct.error):
+            return None
+        except EOFError:
+            self.delete(key)
+            return None
+
+    def set(self, key, value, timeout=None):
+        timeout = self.default_timeout if timeout is None else timeout
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self._header.pack(time.time() + timeout if timeout else 0))
+                f.write(value)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._prune()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def _prune(self):
+        # Drops the least recently written entries once over max_entries
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if not entry.name.startswith('.tmp')]
+        except OSError:
+            return
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def create_cache(config):
+    cache_type = config.get('CACHE_TYPE', 'null')
+    timeout = config.get('CACHE_DEFAULT_TIMEOUT', 300)
+    if cache_type == 'memory':
+        return MemoryCache(timeout, config.get('CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    if cache_type == 'filesystem':
+        return FileSystemCache(config['CACHE_DIR'], timeout, config.get('CACHE_MAX_ENTRIES', 10000))
+    return NullCache()
+
+
+def create_tag_store(config, pages):
+    if isinstance(pages, NullCache):
+        return NullCache()
+    if isinstance(pages, FileSystemCache):
+        return pages
+    return FileSystemCache(config['CACHE_TAG_DIR'], 0, config.get('CACHE_MAX_TAGS', 100000))
+
+
+page_cache = create_cache(app.config)
+tag_store = create_tag_store(app.config, page_cache)
+
+# Tag every cached page depends on, for clear()
+ALL_PAGES = '*'
+
+
+def versioned():
+    # Whether tags have versions, i.e. there is a tag store
+    return not isinstance(tag_store, NullCache)
+
+
+def tag_version(tag):
+    # The tag's current version, or None when tags are not versioned
+    if not versioned():
+        return None
+    version = tag_store.get('tag:' + tag)
+    if version is None:
+        version = uuid.uuid4().hex.encode('ascii')
+        tag_store.set('tag:' + tag, version, timeout=0)
+    return version.decode('ascii')
+
+
+def invalidate(*tags):
+    # Gives each tag a fresh version; pages cached under the old one are never read again
+    for tag in tags:
+        tag_store.set('tag:' + tag, uuid.uuid4().hex.encode('ascii'), timeout=0)
+
+
+def clear():
+    # Invalidates every cached page in every worker, e.g. from a CLI command
+    invalidate(ALL_PAGES)
+    page_cache.clear()
+
+
+def cached(*tags):
+    # Caches the rendered response of a GET view. Tags are formatted with the
+    # view arguments, e.g. @cached('venue:{venue_id}').
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            # Pages rendered with pending flash messages are personal; never serve or store them
+            if isinstance(page_cache, NullCache) or request.method != 'GET' or '_flashes' in session:
+                return view(**kwargs)
+
+            # Under @conditional the page is also keyed on its ETag, which
+            # covers what tags miss, such as shows passing from upcoming to past
+            versions = ','.join(tag_version(tag) for tag in (ALL_PAGES,) + tuple(tag.format(**kwargs) for tag in tags))
+            key = 'page:{}:{}:{}:{}:{}'.format(
+                request.endpoint, versions, request.full_path, request.headers.get('Accept', ''), g.get('etag', ''))
+
+            hit = page_cache.get(key)
+            if hit is not None:
+                status, mimetype, body = pickle.loads(hit)
+                response = Response(body, status=status, mimetype=mimetype)
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            response = make_response(view(**kwargs))
+            if response.status_code == 200 and not response.direct_passthrough:
+                page_cache.set(key, pickle.dumps((response.status_code, response.mimetype, response.get_data())))
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
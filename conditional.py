@@ -0,0 +1,58 @@
+import functools
+import hashlib
+from flask import Response, g, make_response, request
+from cache import versioned
+
+# ----------------------------------------------------------------------------#
+# Conditional GET.
+#
+# A view decorated with @conditional(validators) first asks `validators` for
+# the current version of everything the page is built from. When the client
+# already holds that version the 304 is returned straight away, without
+# running the view's queries or rendering its template. The ETag is also left
+# in g.etag, which @cached puts in its page keys: a cached body is only ever
+# served under the ETag it was rendered for.
+#
+# Validators run on every request, so they read versions that writes already
+# maintain (cache tags, the counters on an entity's row) rather than
+# aggregating the tables. Without versioned tags (no page cache) they could
+# not see every change, so pages are then served in full, without an ETag.
+# ----------------------------------------------------------------------------#
+
+
+def conditional(validators):
+    # validators(**view_args) returns the current version, or None when the
+    # entity does not exist (the view then handles the 404 itself)
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            if not versioned():
+                return view(**kwargs)
+            version = validators(**kwargs)
+            if version is None:
+                return view(**kwargs)
+
+            # The representation depends on the URL (cursors, format) and Accept header too
+            etag = hashlib.sha1(repr((
+                request.full_path,
+                request.headers.get('Accept', ''),
+                version
+            )).encode('utf-8')).hexdigest()
+            g.etag = etag
+
+            def stamp(response):
+                response.set_etag(etag)
+                response.vary.add('Accept')
+                response.cache_control.no_cache = True
+                return response
+
+            not_modified = stamp(Response()).make_conditional(request)
+            if not_modified.status_code == 304:
+                return not_modified
+
+            response = make_response(view(**kwargs))
+            if response.status_code == 200:
+                stamp(response)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,143 @@
+from collections import Counter
+from datetime import datetime
+import click
+from models import app, db, Venue, Artist, Show
+from cache import invalidate
+from matching import STALE
+
+# ----------------------------------------------------------------------------#
+# Show counter maintenance.
+#
+# Insert/delete bookkeeping lives in models.py; this module moves shows whose
+# start time has passed from the upcoming to the past counters, and checks
+# (and optionally repairs) the counters against the Show table.
+# ----------------------------------------------------------------------------#
+
+
+def _move_counts(model, counts):
+    # One executemany per entity table: n shows leave upcoming and join past
+    if not counts:
+        return
+    table = model.__table__
+    db.session.execute(
+        table.update()
+        .where(table.c.id == db.bindparam('_id'))
+        .values(
+            upcoming_shows_count=table.c.upcoming_shows_count - db.bindparam('_n'),
+            past_shows_count=table.c.past_shows_count + db.bindparam('_n')
+        ),
+        [{'_id': id, '_n': n} for id, n in counts.items()]
+    )
+
+
+def count_shows(shows):
+    # Adds shows inserted outside the ORM (e.g. by the bulk importer) to their
+    # venue and artist counters; each show is a dict with venue_id, artist_id
+    # and is_past
+    for model, key in ((Venue, 'venue_id'), (Artist, 'artist_id')):
+        past = Counter(show[key] for show in shows if show['is_past'])
+        upcoming = Counter(show[key] for show in shows if not show['is_past'])
+        ids = set(past) | set(upcoming)
+        if not ids:
+            continue
+        table = model.__table__
+        db.session.execute(
+            table.update()
+            .where(table.c.id == db.bindparam('_id'))
+            .values(
+                past_shows_count=table.c.past_shows_count + db.bindparam('_past'),
+                upcoming_shows_count=table.c.upcoming_shows_count + db.bindparam('_upcoming')
+            ),
+            [{'_id': id, '_past': past[id], '_upcoming': upcoming[id]} for id in ids]
+        )
+
+
+def rollover_shows(now=None, batch_size=1000):
+    # Flips shows that have started to is_past in batches of batch_size,
+    # adjusting their venue and artist counters in the same transaction.
+    # Returns the number of shows moved.
+    now = now or datetime.now()
+    moved = 0
+    while True:
+        shows = db.session.query(Show.id, Show.venue_id, Show.artist_id) \
+            .filter(Show.is_past == db.false(), Show.start_time <= now) \
+            .order_by(Show.start_time, Show.id) \
+            .limit(batch_size) \
+            .with_for_update(skip_locked=True) \
+            .all()
+        if not shows:
+            break
+
+        db.session.query(Show) \
+            .filter(Show.id.in_([show.id for show in shows])) \
+            .update({Show.is_past: True}, synchronize_session=False)
+        _move_counts(Venue, Counter(show.venue_id for show in shows))
+        _move_counts(Artist, Counter(show.artist_id for show in shows))
+        db.session.commit()
+        moved += len(shows)
+
+    return moved
+
+
+def check_show_counts(repair=False):
+    # Recomputes every venue and artist counter from the Show table and
+    # returns the rows that drifted as (model, id, stored, actual) tuples,
+    # counts given as (past, upcoming). With repair, also fixes them.
+    # Counters follow Show.is_past, not the clock: a show that has started but
+    # not been rolled over yet is still upcoming, and rollover_shows moves it.
+    drift = []
+    for model, foreign_key in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+        rows = db.session.query(
+            model.id,
+            model.past_shows_count,
+            model.upcoming_shows_count,
+            db.func.count(Show.id).filter(Show.is_past == db.true()),
+            db.func.count(Show.id).filter(Show.is_past == db.false())
+        ) \
+            .outerjoin(Show, foreign_key == model.id) \
+            .group_by(model.id) \
+            .all()
+        for id, past, upcoming, actual_past, actual_upcoming in rows:
+            if (past, upcoming) != (actual_past, actual_upcoming):
+                drift.append((model, id, (past, upcoming), (actual_past, actual_upcoming)))
+
+    if repair and drift:
+        for model in (Venue, Artist):
+            rows = [
+                {'_id': id, '_past': actual[0], '_upcoming': actual[1]}
+                for drifted_model, id, stored, actual in drift if drifted_model is model
+            ]
+            if rows:
+                table = model.__table__
+                db.session.execute(
+                    table.update()
+                    .where(table.c.id == db.bindparam('_id'))
+                    .values(past_shows_count=db.bindparam('_past'), upcoming_shows_count=db.bindparam('_upcoming')),
+                    rows
+                )
+        db.session.commit()
+
+    return drift
+
+
+@app.cli.command('rollover-shows')
+@click.option('--batch-size', default=1000, help='Shows moved per transaction.')
+def rollover_shows_command(batch_size):
+    """Move shows that have started from the upcoming to the past counters."""
+    moved = rollover_shows(batch_size=batch_size)
+    if moved:
+        # Past shows are the suggestions' play history
+        invalidate('venues', STALE)
+    click.echo(f'Moved {moved} shows to past.')
+
+
+@app.cli.command('check-show-counts')
+@click.option('--repair', is_flag=True, help='Rewrite drifted counters.')
+def check_show_counts_command(repair):
+    """Recompute venue and artist show counters and report drift."""
+    drift = check_show_counts(repair=repair)
+    for model, id, stored, actual in drift:
+        click.echo(f'{model.__name__} {id}: stored past/upcoming {stored}, actual {actual}')
+    click.echo(f'{len(drift)} drifted rows' + (' repaired.' if repair and drift else '.'))
+    if repair and drift:
+        invalidate('venues')
@@ -0,0 +1,247 @@
+import random
+import time
+from datetime import datetime, timedelta
+import click
+from models import app, db, Venue, Artist, Show
+from forms import VenueForm
+from genres import genre_mask
+from cache import invalidate
+import cache
+from importer import insert_batch
+import partitions
+import geo
+import counters
+import autocomplete
+import matching
+
+# ----------------------------------------------------------------------------#
+# Synthetic dataset.
+#
+# `flask seed --scale small|medium|large` fills Venue, Artist and Show with
+# reproducible fake data (1k, 100k or 1M shows) for benchmarking: a few big
+# cities hold most venues and artists, a few genres dominate, and shows fall
+# mostly on weekend evenings, two years back to one year ahead.
+# ----------------------------------------------------------------------------#
+
+SCALES = {
+    'small': 1000,
+    'medium': 100000,
+    'large': 1000000
+}
+
+# City, state and relative weight, roughly following metro population
+CITIES = [
+    ('New York', 'NY', 20), ('Los Angeles', 'CA', 13), ('Chicago', 'IL', 9),
+    ('Houston', 'TX', 7), ('Phoenix', 'AZ', 5), ('Philadelphia', 'PA', 6),
+    ('San Antonio', 'TX', 3), ('San Diego', 'CA', 3), ('Dallas', 'TX', 7),
+    ('Austin', 'TX', 4), ('San Francisco', 'CA', 5), ('Seattle', 'WA', 4),
+    ('Denver', 'CO', 3), ('Nashville', 'TN', 3), ('Boston', 'MA', 5),
+    ('Portland', 'OR', 2), ('Atlanta', 'GA', 6), ('Miami', 'FL', 6),
+    ('New Orleans', 'LA', 2), ('Minneapolis', 'MN', 3), ('Detroit', 'MI', 4),
+    ('Las Vegas', 'NV', 2), ('Kansas City', 'MO', 2), ('Baltimore', 'MD', 3),
+    ('Memphis', 'TN', 1), ('Albuquerque', 'NM', 1), ('Omaha', 'NE', 1),
+    ('Boise', 'ID', 1), ('Burlington', 'VT', 1), ('Anchorage', 'AK', 1)
+]
+
+# Genre popularity; the rest of the form's genres get weight 1
+GENRE_WEIGHTS = {
+    'Rock n Roll': 12, 'Pop': 10, 'Hip-Hop': 9, 'Electronic': 7, 'Alternative': 7,
+    'Jazz': 5, 'R&B': 5, 'Country': 5, 'Folk': 4, 'Punk': 3, 'Blues': 3, 'Soul': 3
+}
+
+# Shows per weekday, Monday first, and per evening start hour
+WEEKDAY_WEIGHTS = [4, 4, 6, 8, 14, 16, 8]
+HOUR_WEIGHTS = {18: 2, 19: 5, 20: 8, 21: 7, 22: 4, 23: 1}
+# Show lengths in minutes; every show ends before the next evening
+SHOW_MINUTES = (90, 105, 120, 135, 150)
+# Days start_time() spans: two years back and a year ahead, give or take the
+# weekday shift
+FIRST_DAY = -736
+DAYS = 736 + 372
+
+VENUE_NAMES = ['Hall', 'Room', 'Lounge', 'Club', 'Theatre', 'Tavern', 'Ballroom', 'Garage', 'Cellar', 'Hop']
+ARTIST_NAMES = ['Band', 'Trio', 'Collective', 'Orchestra', 'Project', 'Ensemble', 'Quartet', 'Sound', 'Kids', 'Brothers']
+WORDS = ['Velvet', 'Golden', 'Electric', 'Midnight', 'Crimson', 'Silver', 'Wild', 'Blue', 'Lucky', 'Hollow',
+         'Neon', 'Rusty', 'Quiet', 'Paper', 'Iron', 'Little', 'Broken', 'Northern', 'Radio', 'Saint']
+
+
+class Generator(object):
+    def __init__(self, seed=0, now=None):
+        self.random = random.Random(seed)
+        self.now = now or datetime.now().replace(minute=0, second=0, microsecond=0)
+        genres = [value for value, label in VenueForm.genres.kwargs['choices']]
+        self.genres = genres
+        self.genre_weights = [GENRE_WEIGHTS.get(genre, 1) for genre in genres]
+        self.city_weights = [weight for city, state, weight in CITIES]
+        # Bitmaps of the (venue or artist position, day) pairs already booked;
+        # one show per venue and per artist a day keeps bookings apart
+        self.booked = {'venue': bytearray(), 'artist': bytearray()}
+
+    def _name(self, suffixes, number):
+        # Word pairs repeat at scale; the number keeps names distinct
+        return '{} {} {} {}'.format(
+            self.random.choice(WORDS), self.random.choice(WORDS), self.random.choice(suffixes), number)
+
+    def _entity(self, number, suffixes):
+        city, state, weight = self.random.choices(CITIES, self.city_weights)[0]
+        genres = sorted(set(self.random.choices(self.genres, self.genre_weights, k=self.random.randint(1, 3))))
+        name = self._name(suffixes, number)
+        slug = name.lower().replace(' ', '-')
+        return {
+            'name': name,
+            'genres': genres,
+            'genre_mask': genre_mask(genres),
+            'city': city,
+            'state': state,
+            'phone': '{:03d}-{:03d}-{:04d}'.format(
+                self.random.randint(200, 999), self.random.randint(200, 999), self.random.randint(0, 9999)),
+            'image_link': f'https://images.example.com/{slug}.jpg',
+            'facebook_link': f'https://www.facebook.com/{slug}',
+            'website_link': f'https://{slug}.example.com',
+            'seeking_description': None,
+            'updated_at': datetime.utcnow(),
+            'upcoming_shows_count': 0,
+            'past_shows_count': 0
+        }
+
+    def venue(self, number):
+        values = self._entity(number, VENUE_NAMES)
+        values['address'] = '{} {} St'.format(self.random.randint(1, 9999), self.random.choice(WORDS))
+        values['seeking_talent'] = self.random.random() < 0.3
+        if values['seeking_talent']:
+            values['seeking_description'] = 'Looking for {} acts on weekends.'.format(values['genres'][0])
+        # Spread around the city centre, mostly within 20km or so
+        latitude, longitude = geo.centroid(values['city'], values['state'])
+        values['latitude'] = latitude + self.random.gauss(0, 0.1)
+        values['longitude'] = longitude + self.random.gauss(0, 0.1)
+        return geo.locate(values)
+
+    def artist(self, number):
+        values = self._entity(number, ARTIST_NAMES)
+        values['seeking_venue'] = self.random.random() < 0.4
+        if values['seeking_venue']:
+            values['seeking_description'] = 'Booking {} gigs in {}.'.format(values['genres'][0], values['city'])
+        return values
+
+    def start_time(self):
+        # A weekday- and hour-weighted evening between two years ago and a year ahead
+        day = self.now.date() + timedelta(days=self.random.randint(-730, 365))
+        weekday = self.random.choices(range(7), WEEKDAY_WEIGHTS)[0]
+        day += timedelta(days=weekday - day.weekday())
+        hour = self.random.choices(list(HOUR_WEIGHTS), list(HOUR_WEIGHTS.values()))[0]
+        return datetime(day.year, day.month, day.day, hour, self.random.choice((0, 30)))
+
+    def _pick(self, ids, skewed=True):
+        # Position in ids. Half the picks are Pareto-skewed towards the low
+        # ids, so a few venues and artists get many shows
+        if skewed and self.random.random() < 0.5:
+            return min(int(self.random.paretovariate(1.2)) - 1, len(ids) - 1)
+        return self.random.randrange(len(ids))
+
+    def _free(self, kind, position, day):
+        booked = self.booked[kind]
+        bit = position * DAYS + day
+        if len(booked) <= bit // 8:
+            booked.extend(bytes(bit // 8 + 1 - len(booked)))
+        return not booked[bit // 8] & (1 << bit % 8)
+
+    def _book(self, kind, position, day):
+        bit = position * DAYS + day
+        self.booked[kind][bit // 8] |= 1 << bit % 8
+
+    def show(self, venue_ids, artist_ids):
+        # Busy venues and artists fill up; after a few tries, pick uniformly
+        for attempt in range(1000):
+            start_time = self.start_time()
+            day = (start_time.date() - self.now.date()).days - FIRST_DAY
+            venue = self._pick(venue_ids, attempt < 8)
+            artist = self._pick(artist_ids, attempt < 8)
+            if self._free('venue', venue, day) and self._free('artist', artist, day):
+                break
+        else:
+            raise ValueError('Too many shows for the venues and artists; pass more of them.')
+        self._book('venue', venue, day)
+        self._book('artist', artist, day)
+        return {
+            'venue_id': venue_ids[venue],
+            'artist_id': artist_ids[artist],
+            'start_time': start_time,
+            'end_time': start_time + timedelta(minutes=self.random.choice(SHOW_MINUTES)),
+            'is_past': start_time <= self.now,
+            'updated_at': datetime.utcnow()
+        }
+
+
+def reset():
+    # Empties the three tables in the current transaction
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(db.text('TRUNCATE "Show", "Artist", "Venue" RESTART IDENTITY'))
+    else:
+        for model in (Show, Artist, Venue):
+            db.session.query(model).delete(synchronize_session=False)
+
+
+def _insert(model, rows, batch_size, after_batch=None):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            insert_batch(model, batch)
+            if after_batch:
+                after_batch(batch)
+            db.session.commit()
+            batch = []
+    insert_batch(model, batch)
+    if after_batch:
+        after_batch(batch)
+    db.session.commit()
+
+
+def generate(shows, venues=None, artists=None, seed=0, batch_size=5000):
+    # Inserts the dataset and returns {table: rows inserted}
+    venues = venues or max(20, shows // 50)
+    artists = artists or max(40, shows // 20)
+    generator = Generator(seed)
+
+    _insert(Venue, (generator.venue(number) for number in range(1, venues + 1)), batch_size)
+    _insert(Artist, (generator.artist(number) for number in range(1, artists + 1)), batch_size)
+    venue_ids = [id for id, in db.session.query(Venue.id).order_by(Venue.id)]
+    artist_ids = [id for id, in db.session.query(Artist.id).order_by(Artist.id)]
+    if partitions.partitioned():
+        # Route the shows straight to their monthly partitions
+        partitions.ensure_partitions(generator.now + timedelta(days=FIRST_DAY),
+                                     generator.now + timedelta(days=FIRST_DAY + DAYS))
+    _insert(Show, (generator.show(venue_ids, artist_ids) for number in range(shows)), batch_size,
+            counters.count_shows)
+
+    return {'venues': venues, 'artists': artists, 'shows': shows}
+
+
+@app.cli.command('seed')
+@click.option('--scale', type=click.Choice(list(SCALES)), default='small', help='1k, 100k or 1M shows.')
+@click.option('--shows', type=int, help='Number of shows; overrides --scale.')
+@click.option('--venues', type=int, help='Defaults to one per 50 shows.')
+@click.option('--artists', type=int, help='Defaults to one per 20 shows.')
+@click.option('--seed', default=0, help='Random seed; the same seed gives the same data, relative to today.')
+@click.option('--reset', 'reset_first', is_flag=True, help='Create missing tables, then delete all venues, artists and shows first.')
+def seed_command(scale, shows, venues, artists, seed, reset_first):
+    """Fill the database with synthetic venues, artists and shows."""
+    started = time.perf_counter()
+    try:
+        if reset_first:
+            # A scratch database may not have the tables yet
+            db.create_all()
+            reset()
+        counts = generate(shows or SCALES[scale], venues, artists, seed)
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if reset_first:
+        # Ids are reused after a reset, so per-entity pages are stale too
+        cache.clear()
+    else:
+        invalidate('venues', 'artists', 'shows', matching.STALE, *matching.CHANGED.values())
+        autocomplete.changed('venue', 'artist')
+    click.echo('Seeded {venues} venues, {artists} artists and {shows} shows'.format(**counts) +
+               f' in {time.perf_counter() - started:.1f}s.')
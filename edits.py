@@ -0,0 +1,105 @@
+from sqlalchemy.orm.exc import StaleDataError
+from models import app, db, Venue, Artist
+from forms import VenueForm, ArtistForm
+from formdata import VENUE_FIELDS, ARTIST_FIELDS, to_formdata, form_values
+
+# ----------------------------------------------------------------------------#
+# Venue and artist edits.
+#
+# Edits write only the columns whose value changed, and only to the row
+# version the client started from: Venue.version and Artist.version are the
+# mappers' version counters, so the ORM's UPDATE matches on the version it
+# loaded and bumps it. A client version that is already behind is caught
+# before anything is written; a row changed between load and commit fails
+# the UPDATE instead. Both surface as a 409.
+#
+# Changes are validated with the entity's form, as on create. Only errors in
+# the fields being changed count, so a row stored before a validator existed
+# can still be edited elsewhere.
+# ----------------------------------------------------------------------------#
+
+# The columns an edit may change, by model, with the form validating them
+EDITABLE = {
+    Venue: (VenueForm, VENUE_FIELDS),
+    Artist: (ArtistForm, ARTIST_FIELDS)
+}
+
+
+def form_changes(entity, form, fields=None):
+    # Validates a submitted edit form of entity. Returns ({column: value} of
+    # the fields (default: all editable ones) whose value differs, None), or
+    # (None, errors) when a changed field or the CSRF token is invalid.
+    values = form_values(form, fields or EDITABLE[type(entity)][1])
+    # A form posts a column left NULL as an empty string
+    changes = {key: value for key, value in values.items()
+               if getattr(entity, key) != value and not (getattr(entity, key) is None and value == '')}
+    form.validate()
+    errors = {key: errors for key, errors in form.errors.items() if key in changes or key == 'csrf_token'}
+    if errors:
+        return None, errors
+    return changes, None
+
+
+def validate(entity, changes):
+    # Validates a partial change of entity (a PATCH item) as the full form it
+    # would post. Returns (values that differ, None) or (None, errors).
+    form_class, fields = EDITABLE[type(entity)]
+    unknown = [key for key in changes if key not in fields]
+    if unknown:
+        return None, {key: ['Not an editable field.'] for key in unknown}
+    row = {field: getattr(entity, field) for field in fields}
+    row.update(changes)
+    form = form_class(formdata=to_formdata(row), meta={'csrf': False})
+    return form_changes(entity, form, list(changes))
+
+
+def apply_changes(entity, changes):
+    # Sets the changed values; returns their keys, in order. Unchanged
+    # columns are left out of the UPDATE, and an entity with no changes is
+    # not written at all (nor its version bumped).
+    for key, value in changes.items():
+        setattr(entity, key, value)
+    return list(changes)
+
+
+def commit(entities):
+    # Commits the session and returns the entities' versions, read before the
+    # commit expires them; rolls back and returns None instead when one of
+    # the rows changed since it was loaded
+    try:
+        db.session.flush()
+        versions = [entity.version for entity in entities]
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        return None
+    return versions
+
+
+def load(model, ids):
+    # {id: entity} of the ids that exist, in one query
+    return {entity.id: entity for entity in model.query.filter(model.id.in_(ids))} if ids else {}
+
+
+def parse_batch(model, body):
+    # The changes of a PATCH body: a list of objects holding the id, the
+    # version the client read and the fields to change. Returns
+    # ([(id, version, changes)], None) or (None, error message).
+    if not isinstance(body, list) or not body:
+        return None, 'Expected a non-empty list of changes.'
+    if len(body) > app.config['EDIT_BATCH_MAX']:
+        return None, f'At most {app.config["EDIT_BATCH_MAX"]} changes per request.'
+    batch = []
+    seen = set()
+    for item in body:
+        if not isinstance(item, dict):
+            return None, 'Each change must be an object.'
+        changes = dict(item)
+        id, version = changes.pop('id', None), changes.pop('version', None)
+        if type(id) is not int or type(version) is not int:
+            return None, 'Each change needs an integer id and version.'
+        if id in seen:
+            return None, f'{model.__name__} {id} is changed more than once.'
+        seen.add(id)
+        batch.append((id, version, changes))
+    return batch, None
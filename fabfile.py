@@ -1,4 +1,4 @@
-from fabric.api import local, settings, abort
+from fabric.api import local, settings, abort, shell_env
 from fabric.contrib.console import confirm
 
 # prepare for deployment
@@ -7,12 +7,25 @@ from fabric.contrib.console import confirm
 def test():
     with settings(warn_only=True):
         result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
+            "python -m pytest", capture=True
         )
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
 
 
+def benchmark(database_url=None):
+    # fab benchmark:database_url=sqlite:////tmp/fyyur-bench.db
+    # Seeding empties the database first, so it only runs against a scratch
+    # database given explicitly, never the configured one
+    import config
+    if not database_url:
+        abort("Pass a scratch database: fab benchmark:database_url=<url>")
+    if database_url == config.SQLALCHEMY_DATABASE_URI:
+        abort("{} is the configured database; pass a scratch one.".format(database_url))
+    with shell_env(DATABASE_URL=database_url):
+        local("flask seed --reset && flask benchmark")
+
+
 def commit():
     message = raw_input("Enter a git commit message: ")
     local("git add . && git commit -am '{}'".format(message))
@@ -40,7 +53,7 @@ def heroku():
 
 def heroku_test():
     local(
-        "heroku run python test_tasks.py -v && heroku run python test_users.py -v"
+        "heroku run python -m pytest"
     )
 
 
@@ -0,0 +1,52 @@
+from datetime import datetime
+from werkzeug.datastructures import MultiDict
+
+# ----------------------------------------------------------------------------#
+# Form data outside the browser.
+#
+# The importer, the batch edit API and the benchmark feed plain rows (CSV,
+# JSON or generated dicts) through the same WTForms forms as the web
+# handlers. to_formdata() turns a row into what a browser would have posted,
+# and the field lists say which form fields map onto which columns.
+# ----------------------------------------------------------------------------#
+
+FALSE_VALUES = ('', '0', 'f', 'false', 'n', 'no', 'off')
+
+# Form fields stored as the column of the same name
+VENUE_FIELDS = ('name', 'genres', 'address', 'city', 'state', 'phone', 'website_link',
+                'facebook_link', 'seeking_talent', 'seeking_description', 'image_link')
+ARTIST_FIELDS = ('name', 'genres', 'city', 'state', 'phone', 'website_link',
+                 'facebook_link', 'seeking_venue', 'seeking_description', 'image_link')
+
+
+def to_formdata(row):
+    # Turns a CSV/JSON row into the form data a browser would have posted
+    formdata = MultiDict()
+    for key, value in row.items():
+        if value is None:
+            continue
+        if key == 'genres':
+            genres = value if isinstance(value, list) else [genre.strip() for genre in value.split(';')]
+            for genre in genres:
+                if genre:
+                    formdata.add(key, genre)
+        elif key in ('seeking_talent', 'seeking_venue'):
+            if str(value).strip().lower() not in FALSE_VALUES:
+                formdata.add(key, 'y')
+        elif key in ('start_time', 'end_time') and isinstance(value, str) and value.strip():
+            try:
+                formdata.add(key, datetime.fromisoformat(value.strip()).strftime('%Y-%m-%d %H:%M:%S'))
+            except ValueError:
+                formdata.add(key, value)
+        else:
+            formdata.add(key, str(value))
+    return formdata
+
+
+def form_values(form, fields):
+    # {column: value} of the fields of a submitted form
+    values = {field: getattr(form, field).data for field in fields}
+    for field in ('seeking_talent', 'seeking_venue'):
+        if field in values:
+            values[field] = bool(values[field])
+    return values
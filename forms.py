@@ -1,7 +1,8 @@
 from datetime import datetime
 from flask_wtf import Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField
-from wtforms.validators import DataRequired, AnyOf, URL
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, IntegerField
+from wtforms.widgets import HiddenInput
+from wtforms.validators import DataRequired, AnyOf, URL, Optional
 
 class ShowForm(Form):
     artist_id = StringField(
@@ -15,6 +16,11 @@ class ShowForm(Form):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    # Defaults to SHOW_DEFAULT_MINUTES after the start
+    end_time = DateTimeField(
+        'end_time',
+        validators=[Optional()]
+    )
 
 class VenueForm(Form):
     name = StringField(
@@ -126,6 +132,11 @@ class VenueForm(Form):
         'seeking_description'
     )
 
+    # The row version an edit started from; only the edit forms render it
+    version = IntegerField(
+        'version', widget=HiddenInput(), validators=[Optional()]
+    )
+
 
 
 class ArtistForm(Form):
@@ -237,3 +248,8 @@ class ArtistForm(Form):
             'seeking_description'
      )
 
+    # The row version an edit started from; only the edit forms render it
+    version = IntegerField(
+        'version', widget=HiddenInput(), validators=[Optional()]
+    )
+
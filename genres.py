@@ -0,0 +1,26 @@
+from forms import VenueForm
+
+# ----------------------------------------------------------------------------#
+# Genre bitsets.
+#
+# Each genre in the forms' fixed choice list owns one bit of a 64-bit mask,
+# in list order. Bits are stored, so new genres must be appended to the
+# choices, never inserted or reordered.
+# ----------------------------------------------------------------------------#
+
+GENRES = [value for value, label in VenueForm.genres.kwargs['choices']]
+BITS = {genre: 1 << index for index, genre in enumerate(GENRES)}
+
+assert len(GENRES) <= 63, 'genre masks are signed 64-bit integers'
+
+
+def genre_mask(genres):
+    # Unknown genres have no bit and are left out
+    mask = 0
+    for genre in genres or ():
+        mask |= BITS.get(genre, 0)
+    return mask
+
+
+def mask_genres(mask):
+    return [genre for genre in GENRES if mask & BITS[genre]]
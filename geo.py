@@ -0,0 +1,181 @@
+import csv
+import math
+import os
+import click
+from models import app, db, Venue
+
+# ----------------------------------------------------------------------------#
+# Venue locations.
+#
+# Venues get a latitude and longitude from the bundled city centroid table
+# (data/centroids.csv, with a row per state as the fallback), so locating
+# them needs no network. Each venue also stores its cell in a uniform grid of
+# GEO_CELL_DEGREES squares, numbered row by row, so a bounding box becomes one
+# geocell range per grid row. nearby() prefilters on those ranges and the
+# box, then keeps the venues within the exact (haversine) radius.
+# ----------------------------------------------------------------------------#
+
+CENTROIDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'centroids.csv')
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+_centroids = None
+
+
+def centroids():
+    # {(lowercased city, state): (latitude, longitude)}; states under city ''
+    global _centroids
+    if _centroids is None:
+        with open(CENTROIDS_FILE, newline='', encoding='utf-8') as f:
+            _centroids = {
+                (row['city'].lower(), row['state']): (float(row['latitude']), float(row['longitude']))
+                for row in csv.DictReader(f)
+            }
+    return _centroids
+
+
+def centroid(city, state):
+    # The city's centroid, else its state's, else None
+    table = centroids()
+    return table.get(((city or '').strip().lower(), state)) or table.get(('', state))
+
+
+def _grid():
+    size = app.config['GEO_CELL_DEGREES']
+    return size, int(round(360 / size))
+
+
+def geocell(latitude, longitude):
+    size, columns = _grid()
+    row = int((latitude + 90) // size)
+    column = int((longitude + 180) // size) % columns
+    return row * columns + column
+
+
+def locate(values):
+    # Fills in latitude and longitude (when missing) and geocell of a dict of
+    # venue columns
+    if values.get('latitude') is None or values.get('longitude') is None:
+        values['latitude'], values['longitude'] = centroid(values.get('city'), values.get('state')) or (None, None)
+    values['geocell'] = None if values['latitude'] is None else geocell(values['latitude'], values['longitude'])
+    return values
+
+
+@db.event.listens_for(Venue, 'before_insert')
+@db.event.listens_for(Venue, 'before_update')
+def _locate_venue(mapper, connection, venue):
+    # Coordinates set explicitly are kept; otherwise a venue that is new or
+    # changed city or state is placed on its centroid
+    state = db.inspect(venue)
+    placed = any(state.attrs[key].history.has_changes() for key in ('latitude', 'longitude'))
+    moved = any(state.attrs[key].history.has_changes() for key in ('city', 'state'))
+    if not (placed or moved or venue.latitude is None or venue.geocell is None):
+        return
+    values = {'city': venue.city, 'state': venue.state}
+    if placed or not moved:
+        values.update(latitude=venue.latitude, longitude=venue.longitude)
+    locate(values)
+    venue.latitude, venue.longitude, venue.geocell = values['latitude'], values['longitude'], values['geocell']
+
+
+def haversine_km(latitude1, longitude1, latitude2, longitude2):
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(longitude2 - longitude1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    # (south, north, west, east) around the circle; west/east may fall
+    # outside [-180, 180] when the box crosses the antimeridian
+    latitude_delta = radius_km / KM_PER_DEGREE
+    south, north = max(-90.0, latitude - latitude_delta), min(90.0, latitude + latitude_delta)
+    # A degree of longitude is shortest at the box's edge furthest from the equator
+    cosine = math.cos(math.radians(max(abs(south), abs(north))))
+    longitude_delta = 180.0 if cosine < 1e-9 else min(180.0, radius_km / (KM_PER_DEGREE * cosine))
+    return south, north, longitude - longitude_delta, longitude + longitude_delta
+
+
+def cell_ranges(south, north, west, east):
+    # Inclusive (first, last) geocell ranges covering the box, one or two per
+    # grid row, merged where they meet
+    size, columns = _grid()
+    first_column = int((west + 180) // size)
+    last_column = int((east + 180) // size)
+    ranges = []
+    for row in range(int((south + 90) // size), min(int((north + 90) // size), int(round(180 / size)) - 1) + 1):
+        base = row * columns
+        if last_column - first_column + 1 >= columns:
+            spans = [(0, columns - 1)]
+        elif first_column < 0:
+            spans = [(0, last_column), (first_column % columns, columns - 1)]
+        elif last_column >= columns:
+            spans = [(0, last_column - columns), (first_column, columns - 1)]
+        else:
+            spans = [(first_column, last_column)]
+        for first, last in spans:
+            if ranges and ranges[-1][1] + 1 >= base + first:
+                ranges[-1] = (ranges[-1][0], max(ranges[-1][1], base + last))
+            else:
+                ranges.append((base + first, base + last))
+    return sorted(ranges)
+
+
+def _within(latitude, longitude, radius_km, columns):
+    south, north, west, east = bounding_box(latitude, longitude, radius_km)
+    query = db.session.query(Venue.latitude, Venue.longitude, *columns) \
+        .filter(db.or_(*[Venue.geocell.between(first, last) for first, last in cell_ranges(south, north, west, east)])) \
+        .filter(Venue.latitude.between(south, north))
+    if west >= -180 and east <= 180:
+        query = query.filter(Venue.longitude.between(west, east))
+    found = []
+    for row in query:
+        distance = haversine_km(latitude, longitude, row.latitude, row.longitude)
+        if distance <= radius_km:
+            found.append((distance, row))
+    return found
+
+
+def nearby(latitude, longitude, radius_km, limit, columns=(Venue.id,)):
+    # The limit closest venues within radius_km, as (distance in km, row)
+    # pairs nearest first, each row holding latitude, longitude and columns
+    # (which must include Venue.id).
+    # Searches a small circle first and widens it only while it holds fewer
+    # than limit venues, so dense cities don't load every venue in range:
+    # to where limit venues should be at the density seen so far, or four
+    # times as far after finding none. The last step covers radius_km.
+    steps = app.config['NEARBY_SEARCH_STEPS']
+    radius = min(radius_km, app.config['NEARBY_START_KM'])
+    for step in range(steps):
+        if step == steps - 1:
+            radius = radius_km
+        found = _within(latitude, longitude, radius, columns)
+        if len(found) >= limit or radius >= radius_km:
+            break
+        growth = max(2.0, 1.2 * math.sqrt(limit / len(found))) if found else 4.0
+        radius = min(radius_km, radius * growth)
+    found.sort(key=lambda item: (item[0], item[1].id))
+    return found[:limit]
+
+
+@app.cli.command('locate-venues')
+@click.option('--all', 'everything', is_flag=True,
+              help='Also recompute the grid cell of located venues, e.g. after changing GEO_CELL_DEGREES.')
+@click.option('--batch-size', default=5000, help='Venues updated per transaction.')
+def locate_venues_command(everything, batch_size):
+    """Fill in venue coordinates from the bundled centroid table."""
+    query = db.session.query(Venue.id, Venue.city, Venue.state, Venue.latitude, Venue.longitude).order_by(Venue.id)
+    if not everything:
+        query = query.filter(db.or_(Venue.latitude.is_(None), Venue.geocell.is_(None)))
+    rows = [locate(dict(row._asdict())) for row in query]
+    table = Venue.__table__
+    statement = table.update().where(table.c.id == db.bindparam('_id')).values(
+        latitude=db.bindparam('_latitude'), longitude=db.bindparam('_longitude'), geocell=db.bindparam('_geocell'))
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(statement, [
+            {'_id': row['id'], '_latitude': row['latitude'], '_longitude': row['longitude'], '_geocell': row['geocell']}
+            for row in rows[start:start + batch_size]
+        ])
+        db.session.commit()
+    unknown = sum(1 for row in rows if row['latitude'] is None)
+    click.echo(f'Located {len(rows) - unknown} venues; {unknown} have no known city or state.')
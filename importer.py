@@ -0,0 +1,302 @@
+import csv
+import io
+import json
+import os
+import time
+from datetime import datetime, timedelta
+import click
+from models import app, db, Venue, Artist, Show, default_end_time
+from forms import VenueForm, ArtistForm, ShowForm
+from formdata import VENUE_FIELDS, ARTIST_FIELDS, to_formdata, form_values
+from genres import genre_mask
+from cache import invalidate
+import counters
+import bookings
+import geo
+import autocomplete
+import matching
+
+# ----------------------------------------------------------------------------#
+# Bulk import.
+#
+# `flask import venues|artists|shows FILE` streams a CSV or JSONL file,
+# validates every row with the same form the web handlers use, and inserts
+# the valid rows in large batches: COPY on Postgres, executemany elsewhere.
+# ----------------------------------------------------------------------------#
+
+
+def read_rows(path):
+    # Yields (line number, row dict) from a .csv or .jsonl/.ndjson file
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline='', encoding='utf-8') as f:
+        if extension == '.csv':
+            for number, row in enumerate(csv.DictReader(f), start=2):
+                yield number, row
+        elif extension in ('.jsonl', '.ndjson'):
+            for number, line in enumerate(f, start=1):
+                if line.strip():
+                    try:
+                        yield number, json.loads(line)
+                    except ValueError as ex:
+                        yield number, ex
+        else:
+            raise click.BadParameter(f'unsupported file type {extension!r}; use .csv or .jsonl', param_hint='FILE')
+
+
+class EntityImporter(object):
+    form = None
+    fields = ()
+
+    def __init__(self, model):
+        self.model = model
+
+    def validate(self, row):
+        # Returns (values, None) for a valid row or (None, errors)
+        form = self.form(formdata=to_formdata(row), meta={'csrf': False})
+        if not form.validate():
+            return None, form.errors
+        now = datetime.utcnow()
+        values = form_values(form, self.fields)
+        values.update(updated_at=now, upcoming_shows_count=0, past_shows_count=0,
+                      genre_mask=genre_mask(values['genres']))
+        return values, None
+
+    def screen(self, rows):
+        # Errors (or None) of each validated row in a batch, for checks that
+        # span rows and are cheaper done once per batch
+        return [None] * len(rows)
+
+    def after_batch(self, rows):
+        pass
+
+
+class VenueImporter(EntityImporter):
+    form = VenueForm
+    fields = VENUE_FIELDS
+
+    def __init__(self):
+        super().__init__(Venue)
+
+    def validate(self, row):
+        # Optional latitude/longitude columns; otherwise the city's centroid
+        values, errors = super().validate(row)
+        if errors:
+            return values, errors
+        try:
+            for key, bound in (('latitude', 90), ('longitude', 180)):
+                value = row.get(key)
+                values[key] = None if value in (None, '') else float(value)
+                if values[key] is not None and not -bound <= values[key] <= bound:
+                    raise ValueError(value)
+        except ValueError:
+            return None, {key: ['Not a valid coordinate.']}
+        return geo.locate(values), None
+
+
+class ArtistImporter(EntityImporter):
+    form = ArtistForm
+    fields = ARTIST_FIELDS
+
+    def __init__(self):
+        super().__init__(Artist)
+
+
+class ShowImporter(EntityImporter):
+    # Shows reference their artist and venue by id (artist_id, venue_id) or by
+    # exact name (artist, venue), resolved through id maps preloaded once.
+    # Shows overlapping a booking of their venue or artist are rejected per
+    # batch: one query loads the batch's venues' and artists' shows in its time
+    # range, and each row is checked against those and the rows accepted
+    # before it in memory. Earlier batches are already in the database, and
+    # bookings.lock() keeps other writers out until the batch commits, so
+    # overlaps across a month boundary, which no Postgres constraint covers,
+    # are rejected too.
+
+    form = ShowForm
+
+    def __init__(self):
+        super().__init__(Show)
+        self.now = datetime.now()
+        self.artists = self._id_map(Artist)
+        self.venues = self._id_map(Venue)
+        self.max_length = timedelta(minutes=app.config['SHOW_MAX_MINUTES'])
+
+    @staticmethod
+    def _id_map(model):
+        ids = {}
+        names = {}
+        for id, name in db.session.query(model.id, model.name).yield_per(10000):
+            ids[str(id)] = id
+            # Names shared by several rows are ambiguous and cannot be referenced
+            names[name] = None if name in names else id
+        return ids, names
+
+    @staticmethod
+    def _resolve(row, key, id_map):
+        ids, names = id_map
+        if row.get(f'{key}_id') not in (None, ''):
+            return ids.get(str(row[f'{key}_id']).strip())
+        if row.get(key):
+            return names.get(row[key])
+        return None
+
+    def validate(self, row):
+        form = self.form(formdata=to_formdata(row), meta={'csrf': False})
+        errors = {} if form.validate() else dict(form.errors)
+        artist_id = self._resolve(row, 'artist', self.artists)
+        venue_id = self._resolve(row, 'venue', self.venues)
+        if artist_id is None:
+            errors['artist_id'] = ['Unknown or ambiguous artist.']
+        if venue_id is None:
+            errors['venue_id'] = ['Unknown or ambiguous venue.']
+        if errors:
+            return None, errors
+        start_time = form.start_time.data
+        end_time = form.end_time.data or default_end_time(start_time)
+        if not start_time < end_time <= start_time + self.max_length:
+            return None, {'end_time': ['Must be after start_time, by at most SHOW_MAX_MINUTES.']}
+        return {
+            'artist_id': artist_id,
+            'venue_id': venue_id,
+            'start_time': start_time,
+            'end_time': end_time,
+            'is_past': start_time <= self.now,
+            'updated_at': datetime.utcnow()
+        }, None
+
+    def screen(self, rows):
+        bookings.lock()
+        booked = bookings.IntervalIndex(self.max_length)
+        for id, venue_id, artist_id, start_time, end_time in bookings.booked_between(
+                {row['venue_id'] for row in rows}, {row['artist_id'] for row in rows},
+                min(row['start_time'] for row in rows), max(row['end_time'] for row in rows)):
+            booked.add(('venue', venue_id), start_time, end_time, id)
+            booked.add(('artist', artist_id), start_time, end_time, id)
+
+        errors = []
+        for row in rows:
+            keys = (('venue', row['venue_id']), ('artist', row['artist_id']))
+            clashes = [booked.find(key, row['start_time'], row['end_time']) for key in keys]
+            clashes = sorted({clash[2] for clash in clashes if clash is not None})
+            if clashes == [0]:
+                errors.append({'start_time': ['Overlaps another show in this file.']})
+            elif clashes:
+                errors.append({'start_time': ['Overlaps show {}.'.format(', '.join(str(id) for id in clashes if id))]})
+            else:
+                errors.append(None)
+                for key in keys:
+                    booked.add(key, row['start_time'], row['end_time'])
+        return errors
+
+    def after_batch(self, rows):
+        counters.count_shows(rows)
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, list):
+        return '{' + ','.join('"' + str(item).replace('\\', '\\\\').replace('"', '\\"') + '"' for item in value) + '}'
+    return value
+
+
+def insert_batch(model, rows):
+    # Inserts rows in the current transaction; COPY on Postgres, executemany elsewhere
+    if not rows:
+        return
+    table = model.__table__
+    if db.engine.dialect.name == 'postgresql':
+        columns = list(rows[0])
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([_copy_value(row[column]) for column in columns])
+        buffer.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert(
+            'COPY "{}" ({}) FROM STDIN WITH (FORMAT csv, NULL \'\\N\')'.format(
+                table.name, ', '.join(f'"{column}"' for column in columns)),
+            buffer
+        )
+    else:
+        db.session.execute(table.insert(), rows)
+
+
+def import_file(importer, path, batch_size=5000, rejects=None):
+    # Returns (inserted, rejected, seconds)
+    started = time.perf_counter()
+    inserted = rejected = 0
+    batch = []
+
+    def reject(number, row, errors):
+        nonlocal rejected
+        rejected += 1
+        if rejects is not None:
+            rejects.write(json.dumps({'line': number, 'errors': errors, 'row': row if isinstance(row, dict) else None}) + '\n')
+
+    def flush():
+        nonlocal inserted
+        accepted = []
+        if batch:
+            for (number, row, values), errors in zip(batch, importer.screen([values for _, _, values in batch])):
+                if errors:
+                    reject(number, row, errors)
+                else:
+                    accepted.append(values)
+        insert_batch(importer.model, accepted)
+        importer.after_batch(accepted)
+        db.session.commit()
+        inserted += len(accepted)
+        batch.clear()
+
+    for number, row in read_rows(path):
+        if isinstance(row, dict):
+            values, errors = importer.validate(row)
+        else:
+            values, errors = None, {'row': [f'Invalid JSON: {row}']}
+        if errors:
+            reject(number, row, errors)
+            continue
+        batch.append((number, row, values))
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+
+    return inserted, rejected, time.perf_counter() - started
+
+
+IMPORTERS = {
+    'venues': VenueImporter,
+    'artists': ArtistImporter,
+    'shows': ShowImporter
+}
+
+
+@app.cli.command('import')
+@click.argument('kind', type=click.Choice(sorted(IMPORTERS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=5000, help='Rows inserted per transaction.')
+@click.option('--rejects', type=click.File('w'), help='Write rejected rows and their errors here as JSONL.')
+def import_command(kind, path, batch_size, rejects):
+    """Bulk import venues, artists or shows from a CSV or JSONL file."""
+    importer = IMPORTERS[kind]()
+    try:
+        inserted, rejected, seconds = import_file(importer, path, batch_size, rejects)
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if kind == 'shows':
+        # Past shows change how often venues and artists have played together
+        invalidate(kind, 'venues', matching.STALE)
+    else:
+        invalidate(kind, matching.CHANGED[importer.model])
+        autocomplete.changed(kind[:-1])
+    rate = inserted / seconds if seconds else 0
+    click.echo(f'Imported {inserted} {kind} in {seconds:.2f}s ({rate:.0f} rows/sec); rejected {rejected}.')
+    if rejected and rejects is None:
+        click.echo('Use --rejects FILE to see why rows were rejected.', err=True)
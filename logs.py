@@ -0,0 +1,175 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from logging import Formatter
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler, \
+    WatchedFileHandler
+from flask import g, request
+from models import app
+import metrics
+
+# ----------------------------------------------------------------------------#
+# Logging.
+#
+# Request threads never touch the disk: the error log goes through a
+# QueueHandler to a QueueListener thread, and the JSON access log is queued
+# and written in batches by its own thread. Both queues are bounded; when one
+# is full the record is dropped and counted (fyyur_log_dropped_total in
+# /metrics) instead of slowing the request down.
+#
+# A rotating handler renames its file, which would pull it from under the
+# other workers writing to it; so each worker process rotates files of its
+# own, named after its pid. With LOG_ROTATE_WHEN 'external' the workers share
+# one file instead and leave rotation to logrotate, reopening the file once
+# it has been moved.
+# ----------------------------------------------------------------------------#
+
+
+def process_path(path):
+    # error.log -> error.<pid>.log
+    root, extension = os.path.splitext(path)
+    return f'{root}.{os.getpid()}{extension}'
+
+
+def rotating_handler(path, config):
+    # Rotates daily, hourly, ... with LOG_ROTATE_WHEN, otherwise by size
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if config['LOG_ROTATE_WHEN'] == 'external':
+        return WatchedFileHandler(path, encoding='utf-8', delay=True)
+    path = process_path(path)
+    if config['LOG_ROTATE_WHEN']:
+        return TimedRotatingFileHandler(
+            path, when=config['LOG_ROTATE_WHEN'], backupCount=config['LOG_BACKUP_COUNT'], encoding='utf-8', delay=True)
+    return RotatingFileHandler(
+        path, maxBytes=config['LOG_MAX_BYTES'], backupCount=config['LOG_BACKUP_COUNT'], encoding='utf-8', delay=True)
+
+
+class BoundedQueueHandler(QueueHandler):
+    def __init__(self, queue_size):
+        super().__init__(queue.Queue(queue_size))
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class AccessLog(object):
+    # Queue of access log entries, written as JSON lines by a background
+    # thread in batches of up to batch_size, at least every flush_seconds
+
+    _STOP = object()
+
+    def __init__(self, handler, queue_size=10000, batch_size=100, flush_seconds=1.0):
+        self.handler = handler
+        self.queue = queue.Queue(queue_size)
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name='access-log', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        # Writes what is queued and stops the thread
+        if self._thread.is_alive():
+            self.queue.put(self._STOP)
+            self._thread.join(timeout)
+
+    def write(self, entry):
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_seconds
+            while batch[-1] is not self._STOP and len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            lines = [json.dumps(entry, separators=(',', ':')) for entry in batch if entry is not self._STOP]
+            if lines:
+                # One record, hence one write and one rotation check, per batch
+                self.handler.handle(logging.makeLogRecord({'msg': '\n'.join(lines)}))
+            if batch[-1] is self._STOP:
+                return
+
+
+error_handler = None
+access_log = None
+
+
+def init_error_log(app):
+    global error_handler
+    file_handler = rotating_handler(app.config['ERROR_LOG'], app.config)
+    file_handler.setFormatter(
+        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
+    )
+    file_handler.setLevel(logging.INFO)
+    error_handler = BoundedQueueHandler(app.config['LOG_QUEUE_SIZE'])
+    error_handler.setLevel(logging.INFO)
+    listener = QueueListener(error_handler.queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    app.logger.setLevel(logging.INFO)
+    app.logger.addHandler(error_handler)
+
+
+def init_access_log(app):
+    global access_log
+    if not app.config['ACCESS_LOG']:
+        return
+    access_log = AccessLog(
+        rotating_handler(app.config['ACCESS_LOG'], app.config),
+        app.config['LOG_QUEUE_SIZE'],
+        app.config['ACCESS_LOG_BATCH_SIZE'],
+        app.config['ACCESS_LOG_FLUSH_SECONDS']
+    )
+    access_log.start()
+    atexit.register(access_log.stop)
+
+    # Registered after metrics' hook, so it runs first (Flask runs them in
+    # reverse) and request_stats is still on g
+    @app.after_request
+    def log_request(response):
+        stats = g.get('request_stats')
+        access_log.write({
+            'time': datetime.utcnow().isoformat(timespec='milliseconds') + 'Z',
+            'method': request.method,
+            'path': request.path,
+            'route': request.url_rule.rule if request.url_rule else None,
+            'status': response.status_code,
+            'latency_ms': round((time.perf_counter() - stats['started']) * 1000, 2) if stats else None,
+            'queries': stats['queries'] if stats else None
+        })
+        return response
+
+
+def render_dropped():
+    lines = [
+        '# HELP fyyur_log_dropped_total Log records dropped because the log queue was full.',
+        '# TYPE fyyur_log_dropped_total counter'
+    ]
+    for name, sink in (('error', error_handler), ('access', access_log)):
+        if sink is not None:
+            lines.append(f'fyyur_log_dropped_total{{log="{name}"}} {sink.dropped}')
+    return lines
+
+
+metrics.metrics.collectors.append(render_dropped)
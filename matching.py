@@ -0,0 +1,405 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy.exc import SQLAlchemyError
+from models import app, db, Venue, Artist, Show
+from cache import tag_version, ALL_PAGES
+
+# ----------------------------------------------------------------------------#
+# Artist-venue matching.
+#
+# Suggests artists to a venue and venues to an artist. Each side's
+# candidates are held as NumPy column arrays: the stored genre masks (see
+# genres.py), city and state as integer codes, and the seeking flag. Every
+# candidate is scored in one vectorized pass on genre overlap (Jaccard), same
+# city, same state and how often the pair has already played together.
+#
+# Every entity's top-K is precomputed in one background pass when a worker
+# serves its first request (see warm()), and again once writes have made it
+# stale, at most every SUGGESTIONS_PRECOMPUTE_SECONDS. A side's table holds
+# while its generation, a set of cache tags, is what it was when the table
+# was computed: adding or editing a candidate bumps the candidate side's
+# CHANGED tag, and deletes and show rollover bump STALE. Booking a show only
+# moves the counters (and updated_at) of its venue and artist, so it leaves
+# the tables alone; those two entities are left out of them instead.
+#
+# Until the next pass, entities updated since are scored on demand against
+# arrays topped up from the rows updated since the last refresh (and rebuilt
+# every SUGGESTIONS_REBUILD_SECONDS), and memoized under the same generation
+# plus the entity's own updated_at.
+#
+# The tags live in the page cache's tag store, which every worker on the
+# host shares. Without a page cache there is no tag store: the arrays then
+# only follow the rebuilds and the tables the next pass, and deleted
+# candidates are still dropped when suggestions are looked up.
+# ----------------------------------------------------------------------------#
+
+# Rows written by transactions still open at a refresh carry an updated_at
+# from before it; look back this far so they are picked up next time
+REFRESH_OVERLAP = timedelta(minutes=1)
+# Cache tag bumped when venues, artists or shows are deleted or shows roll over
+STALE = 'suggestions'
+# Cache tags bumped when venues or artists are added or edited, per model
+CHANGED = {
+    Venue: 'suggestions:venues',
+    Artist: 'suggestions:artists'
+}
+# Scores (sources x candidates) precompute() holds at once
+CHUNK_CELLS = 1 << 22
+
+if hasattr(np, 'bitwise_count'):
+    # NumPy 2
+    popcount = np.bitwise_count
+else:
+    # Bits set in each 16-bit value
+    _POPCOUNT = np.array([bin(value).count('1') for value in range(1 << 16)], dtype=np.uint8)
+
+    def popcount(masks):
+        # Bits set in each element of a contiguous uint64 array
+        return _POPCOUNT[masks.view(np.uint16)].reshape(masks.shape + (4,)).sum(axis=-1)
+
+
+def _distinct(masks, cities, states):
+    # The distinct (genre mask, city, state) triples, as three arrays, and
+    # each input's position among them
+    mask_values, mask_index = np.unique(masks, return_inverse=True)
+    # Codes run from -1, for a city or state no candidate has
+    span = int(max(cities.max(initial=-1), states.max(initial=-1))) + 2
+    keys, index = np.unique(
+        (mask_index.reshape(-1).astype(np.int64) * span + cities + 1) * span + states + 1, return_inverse=True)
+    return (mask_values[keys // span // span], keys // span % span - 1, keys % span - 1), index.reshape(-1)
+
+
+def _pairs(ids, scores):
+    # [(id, score)] of a row of top_many(), without the padding
+    return [(int(id), float(score)) for id, score in zip(ids, scores) if id >= 0]
+
+
+class Candidates(object):
+    # One side's matching columns. Deleted rows stay until the next rebuild;
+    # suggestions() drops them when looking up the winners.
+
+    def __init__(self, model, seeking):
+        self.model = model
+        self.seeking_column = seeking
+        self.lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self.version = None
+        self.updated_at = None
+        self.distinct = None
+        self.built = time.monotonic()
+        self.rows = {}
+        self.codes = {}
+        self.ids = np.zeros(0, np.int64)
+        self.masks = np.zeros(0, np.uint64)
+        self.cities = np.zeros(0, np.int64)
+        self.states = np.zeros(0, np.int64)
+        self.seeking = np.zeros(0, bool)
+
+    def _code(self, value):
+        return self.codes.setdefault(value, len(self.codes))
+
+    def code(self, value):
+        # Code of a city or state, or -1 when no candidate has it
+        return self.codes.get(value, -1)
+
+    def refresh(self, version):
+        # Brings the arrays up to version, a generation read before the rows
+        # (see _generation()); call with the lock held
+        if time.monotonic() - self.built > app.config['SUGGESTIONS_REBUILD_SECONDS']:
+            self._clear()
+        if version == self.version:
+            return
+        model = self.model
+        query = db.session.query(
+            model.id, model.genre_mask, model.city, model.state, self.seeking_column, model.updated_at)
+        if self.updated_at is not None:
+            query = query.filter(model.updated_at >= self.updated_at - REFRESH_OVERLAP)
+
+        added = []
+        for id, mask, city, state, seeking, updated_at in query:
+            if updated_at is not None and (self.updated_at is None or updated_at > self.updated_at):
+                self.updated_at = updated_at
+            values = (mask, self._code((city.strip().lower(), state)), self._code(state), bool(seeking))
+            index = self.rows.get(id)
+            if index is None:
+                self.rows[id] = len(self.rows)
+                added.append((id,) + values)
+            else:
+                self.masks[index], self.cities[index], self.states[index], self.seeking[index] = values
+        if added:
+            ids, masks, cities, states, seeking = zip(*added)
+            self.ids = np.concatenate([self.ids, np.array(ids, np.int64)])
+            self.masks = np.concatenate([self.masks, np.array(masks, np.uint64)])
+            self.cities = np.concatenate([self.cities, np.array(cities, np.int64)])
+            self.states = np.concatenate([self.states, np.array(states, np.int64)])
+            self.seeking = np.concatenate([self.seeking, np.array(seeking, bool)])
+        self.version = version
+        self.distinct = None
+
+    def _distinct(self):
+        # _distinct() of the candidates, kept until the arrays change
+        if self.distinct is None:
+            self.distinct = _distinct(self.masks, self.cities, self.states)
+        return self.distinct
+
+    def score_many(self, masks, cities, states, played):
+        # Scores of every candidate (columns) for sources (rows) with the given
+        # genre masks and city and state codes; played holds (row, column,
+        # shows) arrays of the pairs that have played together. Zero for
+        # candidates not seeking or with nothing in common.
+        weights = {key: np.float32(weight) for key, weight in app.config['SUGGESTION_WEIGHTS'].items()}
+        # Genres and location only differ between distinct (mask, city,
+        # state) keys, of which there are few: score each pair of keys once
+        # and look the scores up
+        (candidate_masks, candidate_cities, candidate_states), candidate_index = self._distinct()
+        (source_masks, source_cities, source_states), source_index = _distinct(masks, cities, states)
+        overlap = popcount(candidate_masks & source_masks[:, None])
+        union = popcount(candidate_masks | source_masks[:, None])
+        table = np.divide(overlap, union, out=np.zeros(union.shape, np.float32), where=union > 0, dtype=np.float32)
+        table *= weights['genres']
+        table += weights['city'] * (candidate_cities == source_cities[:, None])
+        table += weights['state'] * (candidate_states == source_states[:, None])
+
+        scores = np.take(table[source_index], candidate_index, axis=1)
+        rows, columns, shows = played
+        scores[rows, columns] += weights['history'] * np.log1p(shows).astype(np.float32)
+        if not self.seeking.all():
+            scores[:, ~self.seeking] = 0
+        return scores
+
+    def seeking_only(self):
+        # A copy holding only the candidates seeking; the others score zero
+        keep = np.flatnonzero(self.seeking)
+        pool = Candidates(self.model, self.seeking_column)
+        pool.codes = self.codes
+        pool.ids, pool.masks, pool.cities, pool.states, pool.seeking = \
+            self.ids[keep], self.masks[keep], self.cities[keep], self.states[keep], self.seeking[keep]
+        pool.rows = {int(id): index for index, id in enumerate(pool.ids)}
+        return pool
+
+    def score(self, mask, city, state, history):
+        # score_many() of one source, with {candidate id: shows played together}
+        played = [(self.rows[id], count) for id, count in history.items() if id in self.rows]
+        columns, shows = (np.array(values, np.int64) for values in zip(*played)) if played else (np.zeros(0, np.int64),) * 2
+        return self.score_many(
+            np.array([mask], np.uint64), np.array([city], np.int64), np.array([state], np.int64),
+            (np.zeros(len(columns), np.int64), columns, shows)
+        )[0]
+
+    def top_many(self, scores, count):
+        # (ids, scores) arrays of each row's count best positive scores, best
+        # first, ties by id; rows with fewer are padded with id -1
+        count = min(count, scores.shape[1])
+        if count == 0:
+            return np.full((len(scores), 0), -1, np.int64), np.zeros((len(scores), 0), np.float32)
+        best = np.argpartition(-scores, count - 1, axis=1)[:, :count]
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        best_ids = self.ids[best]
+        order = np.lexsort((best_ids, -best_scores))
+        best_ids = np.take_along_axis(best_ids, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        return np.where(best_scores > 0, best_ids, -1), best_scores
+
+    def top(self, scores, count):
+        # (id, score) of the count best positive scores, best first, ties by id
+        ids, scores = self.top_many(scores[None], count)
+        return _pairs(ids[0], scores[0])
+
+
+class Precomputed(object):
+    # One side's top candidates for every source, as of a generation (see
+    # _generation()) and the sources' latest updated_at
+
+    def __init__(self, generation=None, updated_at=None, rows=None, ids=None, scores=None):
+        self.generation = generation
+        self.updated_at = updated_at
+        self.rows = rows or {}
+        self.ids = ids
+        self.scores = scores
+
+    def get(self, generation, source_id, updated_at):
+        # The source's (id, score) list, or None when the table is older than
+        # generation or the source was added or updated after it was computed
+        index = self.rows.get(source_id)
+        if index is None or generation != self.generation or updated_at is None or updated_at > self.updated_at:
+            return None
+        return _pairs(self.ids[index], self.scores[index])
+
+
+# For each source model: the candidate model, its matching columns, and the
+# Show columns joining the two
+SIDES = {
+    Venue: (Artist, Artist.seeking_venue, Show.venue_id, Show.artist_id),
+    Artist: (Venue, Venue.seeking_talent, Show.artist_id, Show.venue_id)
+}
+
+candidates = {source: Candidates(model, seeking) for source, (model, seeking, _, _) in SIDES.items()}
+precomputed = {source: Precomputed() for source in SIDES}
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+# Sides being precomputed in the background, and when each last started
+_running = set()
+_started = {}
+_precompute_lock = threading.Lock()
+
+
+def _generation(model):
+    # What suggestions of the candidate model depend on, besides the source
+    # itself: the tags bumped when its rows are added or edited (CHANGED),
+    # deleted or shows roll over (STALE), or the tables are emptied (ALL_PAGES)
+    return tag_version(CHANGED[model]), tag_version(STALE), tag_version(ALL_PAGES)
+
+
+def precompute(source_model):
+    # Computes the top candidates of every venue or artist in one pass: a
+    # query for the sources, one for the pairs that have played together,
+    # and the scores a chunk of sources at a time. The side's candidate
+    # arrays are rebuilt on the way, which drops deleted rows. Call within an
+    # app context.
+    model, seeking, source_key, candidate_key = SIDES[source_model]
+    generation = _generation(model)
+    side = Candidates(model, seeking)
+    side.refresh(generation)
+    sources = db.session.query(
+        source_model.id, source_model.genre_mask, source_model.city, source_model.state, source_model.updated_at
+    ).all()
+    history = db.session.query(source_key, candidate_key, db.func.count(Show.id)) \
+        .filter(Show.start_time <= datetime.now()) \
+        .group_by(source_key, candidate_key) \
+        .all()
+
+    rows = {source.id: index for index, source in enumerate(sources)}
+    pool = side.seeking_only()
+    # Deleted candidates are dropped when looking up the winners, so keep some spares
+    count = min(app.config['SUGGESTIONS_TOP_K'] * 2, len(pool.ids))
+    ids = np.full((len(sources), count), -1, np.int64)
+    scores = np.zeros((len(sources), count), np.float32)
+    if sources and count:
+        masks = np.array([source.genre_mask for source in sources], np.uint64)
+        cities = np.array([pool.code((source.city.strip().lower(), source.state)) for source in sources], np.int64)
+        states = np.array([pool.code(source.state) for source in sources], np.int64)
+        # (source row, candidate column, shows) ordered by source row
+        played = np.array([
+            (rows[source_id], pool.rows[candidate_id], shows) for source_id, candidate_id, shows in history
+            if source_id in rows and candidate_id in pool.rows
+        ], np.int64).reshape(-1, 3)
+        played = played[np.argsort(played[:, 0], kind='stable')]
+
+        chunk = max(1, CHUNK_CELLS // len(pool.ids))
+        for start in range(0, len(sources), chunk):
+            stop = min(start + chunk, len(sources))
+            first, last = np.searchsorted(played[:, 0], [start, stop])
+            together = (played[first:last, 0] - start, played[first:last, 1], played[first:last, 2])
+            ids[start:stop], scores[start:stop] = pool.top_many(
+                pool.score_many(masks[start:stop], cities[start:stop], states[start:stop], together), count)
+
+    updated_at = max((source.updated_at for source in sources if source.updated_at is not None), default=None)
+    candidates[source_model] = side
+    precomputed[source_model] = Precomputed(generation, updated_at, rows, ids, scores)
+
+
+def _precompute_in_background(source_model):
+    with app.app_context():
+        try:
+            precompute(source_model)
+        except SQLAlchemyError as ex:
+            db.session.rollback()
+            app.logger.warning('%s suggestions not precomputed: %s', source_model.__name__, ex)
+        finally:
+            db.session.remove()
+            with _precompute_lock:
+                _running.discard(source_model)
+
+
+def schedule(source_model):
+    # Starts precompute() of the side in a background thread, unless one is
+    # running or started less than SUGGESTIONS_PRECOMPUTE_SECONDS ago
+    now = time.monotonic()
+    with _precompute_lock:
+        started = _started.get(source_model)
+        if source_model in _running or \
+                (started is not None and now - started < app.config['SUGGESTIONS_PRECOMPUTE_SECONDS']):
+            return
+        _running.add(source_model)
+        _started[source_model] = now
+    threading.Thread(target=_precompute_in_background, args=(source_model,), daemon=True).start()
+
+
+def warm():
+    # Starts precomputing both sides in the background, as when they go stale
+    for source_model in SIDES:
+        schedule(source_model)
+
+
+def _memoized(source_model, source_id, source, generation, count):
+    # Scores one source on demand, memoized under the generation and the
+    # source's own updated_at
+    _, _, source_key, candidate_key = SIDES[source_model]
+    key = (source_model.__name__, source_id)
+    version = generation + (source.updated_at,)
+    with _memo_lock:
+        memo = _memo.get(key)
+        if memo is not None:
+            _memo.move_to_end(key)
+    if memo is None or memo[0] != version:
+        history = dict(
+            db.session.query(candidate_key, db.func.count(Show.id))
+            .filter(source_key == source_id, Show.start_time <= datetime.now())
+            .group_by(candidate_key)
+        )
+        side = candidates[source_model]
+        with side.lock:
+            side.refresh(generation)
+            scores = side.score(
+                source.genre_mask,
+                side.code((source.city.strip().lower(), source.state)),
+                side.code(source.state),
+                history
+            )
+            # Deleted candidates are dropped below, so keep some spares
+            memo = (version, side.top(scores, count * 2))
+        with _memo_lock:
+            _memo[key] = memo
+            while len(_memo) > app.config['SUGGESTIONS_MEMO_SIZE']:
+                _memo.popitem(last=False)
+    return memo[1]
+
+
+def suggestions(source_model, source_id):
+    # Up to SUGGESTIONS_TOP_K candidates for the venue or artist, best first,
+    # as dicts with a score; None if it doesn't exist
+    model, seeking, _, _ = SIDES[source_model]
+    source = db.session.query(
+        source_model.genre_mask, source_model.city, source_model.state, source_model.updated_at
+    ).filter(source_model.id == source_id).first()
+    if source is None:
+        return None
+
+    generation = _generation(model)
+    count = app.config['SUGGESTIONS_TOP_K']
+    winners = precomputed[source_model].get(generation, source_id, source.updated_at)
+    if winners is None:
+        schedule(source_model)
+        winners = _memoized(source_model, source_id, source, generation, count)
+
+    if not winners:
+        return []
+    rows = {
+        row.id: row for row in db.session.query(
+            model.id, model.name, model.city, model.state, model.genres, model.image_link, seeking.label('seeking')
+        ).filter(model.id.in_([id for id, score in winners]))
+    }
+    return [{
+        'id': id,
+        'name': rows[id].name,
+        'city': rows[id].city,
+        'state': rows[id].state,
+        'genres': rows[id].genres,
+        'image_link': rows[id].image_link,
+        'score': round(score, 4)
+    } for id, score in winners if id in rows and rows[id].seeking][:count]
@@ -0,0 +1,172 @@
+import threading
+import time
+from bisect import bisect_left
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from models import app, db
+from database import pool_stats
+
+# ----------------------------------------------------------------------------#
+# Request and SQL instrumentation.
+#
+# Every request records its latency, the number of SQL statements it ran,
+# the time spent in them and the rows they returned, aggregated per endpoint
+# in this process and rendered in the Prometheus text format by /metrics.
+# Rows are the driver's rowcount, which SQLite leaves at -1 for SELECTs.
+# ----------------------------------------------------------------------------#
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class EndpointStats(object):
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.sql_seconds = 0.0
+        self.rows = 0
+        self.errors = 0
+
+
+class Metrics(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        # Callables returning extra exposition lines, e.g. from other modules
+        self.collectors = []
+
+    def record(self, endpoint, method, status, seconds, queries, sql_seconds, rows):
+        with self._lock:
+            stats = self._endpoints.get((endpoint, method))
+            if stats is None:
+                stats = self._endpoints[(endpoint, method)] = EndpointStats()
+            stats.latency.observe(seconds)
+            stats.queries.observe(queries)
+            stats.sql_seconds += sql_seconds
+            stats.rows += rows
+            if status >= 500:
+                stats.errors += 1
+
+    def render(self):
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            lines = []
+
+            def histogram(name, help, attribute):
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} histogram')
+                for (endpoint, method), stats in endpoints:
+                    labels = f'endpoint="{endpoint}",method="{method}"'
+                    values = getattr(stats, attribute)
+                    cumulative = 0
+                    for bound, count in zip(values.buckets + ('+Inf',), values.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{{labels}}} {values.sum}')
+                    lines.append(f'{name}_count{{{labels}}} {cumulative}')
+
+            def counter(name, help, value):
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} counter')
+                for (endpoint, method), stats in endpoints:
+                    lines.append(f'{name}{{endpoint="{endpoint}",method="{method}"}} {value(stats)}')
+
+            histogram('fyyur_request_duration_seconds', 'Request latency by endpoint.', 'latency')
+            histogram('fyyur_request_queries', 'SQL statements per request by endpoint.', 'queries')
+            counter('fyyur_request_sql_seconds_total', 'Time spent in SQL statements by endpoint.',
+                    lambda stats: stats.sql_seconds)
+            counter('fyyur_request_sql_rows_total', 'Rows returned or affected by SQL statements by endpoint.',
+                    lambda stats: stats.rows)
+            counter('fyyur_request_errors_total', 'Requests that ended in a 5xx by endpoint.',
+                    lambda stats: stats.errors)
+
+        pool = pool_stats.snapshot(db.engine.pool)
+        for key, name, kind, help in [
+            ('checkouts', 'fyyur_db_pool_checkouts_total', 'counter', 'Connections checked out of the pool.'),
+            ('connects', 'fyyur_db_pool_connects_total', 'counter', 'New database connections opened.'),
+            ('timeouts', 'fyyur_db_pool_timeouts_total', 'counter', 'Checkouts that timed out waiting for a connection.'),
+            ('wait_seconds_total', 'fyyur_db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a pooled connection.'),
+            ('checked_out', 'fyyur_db_pool_checked_out', 'gauge', 'Connections currently checked out.'),
+            ('overflow', 'fyyur_db_pool_overflow', 'gauge', 'Connections currently open beyond the pool size.')
+        ]:
+            if key in pool:
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                lines.append(f'{name} {pool[key]}')
+
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'request_stats' in g:
+        conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _finish_statement(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('statement_started')
+    if not started or not has_request_context() or 'request_stats' not in g:
+        return
+    stats = g.request_stats
+    stats['queries'] += 1
+    stats['sql_seconds'] += time.perf_counter() - started.pop()
+    if cursor.rowcount > 0:
+        stats['rows'] += cursor.rowcount
+
+
+@event.listens_for(Engine, 'handle_error')
+def _fail_statement(context):
+    if context.connection is not None:
+        started = context.connection.info.get('statement_started')
+        if started:
+            started.pop()
+
+
+@app.before_request
+def start_request_stats():
+    g.request_stats = {'started': time.perf_counter(), 'queries': 0, 'sql_seconds': 0.0, 'rows': 0}
+
+
+def _record(status):
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return None
+    seconds = time.perf_counter() - stats['started']
+    metrics.record(request.endpoint or 'unmatched', request.method, status,
+                   seconds, stats['queries'], stats['sql_seconds'], stats['rows'])
+    return stats, seconds
+
+
+@app.after_request
+def finish_request_stats(response):
+    recorded = _record(response.status_code)
+    if recorded is not None and app.config['METRICS_HEADER']:
+        stats, seconds = recorded
+        response.headers['Server-Timing'] = 'db;dur={:.2f};desc="{} queries, {} rows", total;dur={:.2f}'.format(
+            stats['sql_seconds'] * 1000, stats['queries'], stats['rows'], seconds * 1000)
+    return response
+
+
+@app.teardown_request
+def abort_request_stats(error):
+    # Requests that raised never reach after_request
+    if error is not None:
+        _record(500)
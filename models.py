@@ -0,0 +1,363 @@
+import sqlite3
+from datetime import datetime, timedelta
+from flask import Flask
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.compiler import compiles
+from flask_moment import Moment
+from flask_migrate import Migrate
+from database import engine_options
+from routing import RoutingSQLAlchemy
+from genres import BITS, genre_mask
+
+# ----------------------------------------------------------------------------#
+# App Config.
+# ----------------------------------------------------------------------------#
+
+app = Flask(__name__)
+moment = Moment(app)
+app.config.from_object('config')
+app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+db = RoutingSQLAlchemy(app)
+migrate = Migrate(app, db)
+
+# ----------------------------------------------------------------------------#
+# Models.
+# ----------------------------------------------------------------------------#
+
+# Genres are a Postgres array; SQLite (used for local testing) stores them as JSON.
+Genres = db.ARRAY(db.String).with_variant(db.JSON, 'sqlite')
+
+# Full-text document over name, city, state and genres, maintained by a trigger
+# on Postgres (see search_ddl below). SQLite keeps its index in an FTS5 table instead.
+SearchVector = TSVECTOR().with_variant(db.Text, 'sqlite')
+
+
+def genre_indexes(table):
+    # genre_mask has a bit per genre (see genres.py). One partial index per
+    # genre over the rows with that bit, in the listings' (name, id) order,
+    # makes a ?genre= page an index range scan; queries must spell the
+    # condition the same way, as search.genre_filter does.
+    return tuple(
+        db.Index(f'ix_{table}_genre_{index}', 'name', 'id',
+                 postgresql_where=db.text(f'genre_mask & {bit} <> 0'),
+                 sqlite_where=db.text(f'genre_mask & {bit} <> 0'))
+        for index, bit in enumerate(BITS.values())
+    )
+
+
+class Venue(db.Model):
+    __tablename__ = 'Venue'
+    __table_args__ = (
+        # Keyset pagination on (name, id)
+        db.Index('ix_venue_name_id', 'name', 'id'),
+        # /shows?city=
+        db.Index('ix_venue_city', 'city'),
+        # /venues/nearby: geocell ranges, with the coordinates for the box
+        db.Index('ix_venue_geocell', 'geocell', 'latitude', 'longitude'),
+    ) + genre_indexes('venue')
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String, nullable=False)
+    genres = db.Column(Genres, nullable=False)
+    genre_mask = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    city = db.Column(db.String(120), nullable=False)
+    state = db.Column(db.String(120), nullable=False)
+    address = db.Column(db.String(120), nullable=False)
+    # Filled in by geo.py; geocell is the venue's cell in the search grid
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geocell = db.Column(db.Integer)
+    phone = db.Column(db.String(120))
+    image_link = db.Column(db.String(500))
+    facebook_link = db.Column(db.String(120))
+    website_link = db.Column(db.String(120))
+    seeking_talent = db.Column(db.Boolean, nullable=False, default=False)
+    seeking_description = db.Column(db.String(500))
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    # Bumped by every ORM update, which only succeeds against the version it
+    # loaded; edits.py turns a mismatch into a 409
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+    search_vector = db.deferred(db.Column(SearchVector))
+    shows = db.relationship('Show', backref='venue', lazy=True, cascade='all, delete-orphan')
+
+    __mapper_args__ = {'version_id_col': version}
+
+    def __repr__(self):
+        return f'<Venue {self.id} {self.name}>'
+
+
+class Artist(db.Model):
+    __tablename__ = 'Artist'
+    __table_args__ = (
+        # Keyset pagination on (name, id)
+        db.Index('ix_artist_name_id', 'name', 'id'),
+    ) + genre_indexes('artist')
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String, nullable=False)
+    genres = db.Column(Genres, nullable=False)
+    genre_mask = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    city = db.Column(db.String(120), nullable=False)
+    state = db.Column(db.String(120), nullable=False)
+    phone = db.Column(db.String(120))
+    image_link = db.Column(db.String(500))
+    facebook_link = db.Column(db.String(120))
+    website_link = db.Column(db.String(120))
+    seeking_venue = db.Column(db.Boolean, nullable=False, default=False)
+    seeking_description = db.Column(db.String(500))
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    # See Venue.version
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+    search_vector = db.deferred(db.Column(SearchVector))
+    shows = db.relationship('Show', backref='artist', lazy=True, cascade='all, delete-orphan')
+
+    __mapper_args__ = {'version_id_col': version}
+
+    def __repr__(self):
+        return f'<Artist {self.id} {self.name}>'
+
+
+def default_end_time(start_time):
+    return start_time + timedelta(minutes=app.config['SHOW_DEFAULT_MINUTES'])
+
+
+class Show(db.Model):
+    __tablename__ = 'Show'
+    __table_args__ = (
+        # Keyset pagination on (start_time, id)
+        db.Index('ix_show_start_time_id', 'start_time', 'id'),
+        # Rollover scans for shows still counted as upcoming
+        db.Index('ix_show_is_past_start_time', 'is_past', 'start_time'),
+        # A venue's or artist's shows in time order, and time ranges of them
+        db.Index('ix_show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_show_artist_id_start_time', 'artist_id', 'start_time'),
+        db.CheckConstraint('end_time > start_time', name='ck_show_end_after_start'),
+        # Monthly partitions on Postgres; see partitions.py
+        {'postgresql_partition_by': 'RANGE (start_time)'}
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Shows at the same venue, or by the same artist, may not overlap; see booking_ddl
+    end_time = db.Column(db.DateTime, nullable=False, default=lambda context: default_end_time(
+        context.get_current_parameters()['start_time']))
+    # Whether the show is counted in the past (rather than upcoming) counters
+    # of its venue and artist; flipped by counters.rollover_shows
+    is_past = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<Show {self.id} artist={self.artist_id} venue={self.venue_id}>'
+
+
+@db.event.listens_for(Venue, 'before_insert')
+@db.event.listens_for(Venue, 'before_update')
+@db.event.listens_for(Artist, 'before_insert')
+@db.event.listens_for(Artist, 'before_update')
+def _mask_genres(mapper, connection, target):
+    # Writes outside the ORM (importer, seed) set genre_mask themselves
+    target.genre_mask = genre_mask(target.genres)
+
+
+# ----------------------------------------------------------------------------#
+# Show counters.
+#
+# Venue and Artist carry materialized upcoming/past show counts. They are
+# adjusted here whenever the ORM inserts or deletes a show, and moved from
+# upcoming to past as time passes by counters.rollover_shows.
+# ----------------------------------------------------------------------------#
+
+
+def _adjust_show_counts(connection, show, delta):
+    for model, id in ((Venue, show.venue_id), (Artist, show.artist_id)):
+        table = model.__table__
+        column = table.c.past_shows_count if show.is_past else table.c.upcoming_shows_count
+        connection.execute(table.update().where(table.c.id == id).values({column: column + delta}))
+
+
+@db.event.listens_for(Show, 'before_insert')
+def _classify_show(mapper, connection, show):
+    show.is_past = show.start_time is not None and show.start_time <= datetime.now()
+
+
+@db.event.listens_for(Show, 'after_insert')
+def _count_show(mapper, connection, show):
+    _adjust_show_counts(connection, show, 1)
+
+
+@db.event.listens_for(Show, 'after_delete')
+def _uncount_show(mapper, connection, show):
+    _adjust_show_counts(connection, show, -1)
+
+
+# ----------------------------------------------------------------------------#
+# Search indexes.
+# ----------------------------------------------------------------------------#
+
+
+# FTS5's trigram tokenizer, for substring matches on SQLite, needs 3.34
+SQLITE_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34)
+
+
+def sqlite_names_ddl(table):
+    # SQLite: a trigram FTS5 table of the names, kept in sync by triggers
+    names = f'{table}_names'
+    return [
+        f'''CREATE VIRTUAL TABLE "{names}" USING fts5(name, tokenize='trigram')''',
+        f'''CREATE TRIGGER "{table}_names_insert" AFTER INSERT ON "{table}" BEGIN
+            INSERT INTO "{names}"(rowid, name) VALUES (new.id, new.name);
+        END''',
+        f'''CREATE TRIGGER "{table}_names_update" AFTER UPDATE OF name ON "{table}" BEGIN
+            UPDATE "{names}" SET name = new.name WHERE rowid = old.id;
+        END''',
+        f'''CREATE TRIGGER "{table}_names_delete" AFTER DELETE ON "{table}" BEGIN
+            DELETE FROM "{names}" WHERE rowid = old.id;
+        END''',
+    ]
+
+
+def search_ddl(model):
+    # Postgres: a trigger-maintained tsvector with a GIN index, plus trigram
+    # indexes for substring and fuzzy matching on name and city.
+    # SQLite: an FTS5 table kept in sync with the entity table by triggers,
+    # and a trigram one of the names for substring matching where supported.
+    table = model.__tablename__
+    fts = f'{table}_fts'
+    names = f'{table}_names'
+    document = "coalesce(NEW.name, '') || ' ' || coalesce(NEW.city, '') || ' ' || " \
+        "coalesce(NEW.state, '') || ' ' || coalesce(array_to_string(NEW.genres, ' '), '')"
+
+    db.event.listen(model.__table__, 'before_create', db.DDL(
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm'
+    ).execute_if(dialect='postgresql'))
+
+    for statement in [
+        f'''CREATE OR REPLACE FUNCTION "{table}_search_vector_update"() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := to_tsvector('simple', {document});
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql''',
+        f'''CREATE TRIGGER "{table}_search_vector_trigger" BEFORE INSERT OR UPDATE ON "{table}"
+        FOR EACH ROW EXECUTE PROCEDURE "{table}_search_vector_update"()''',
+        f'CREATE INDEX "ix_{table.lower()}_search_vector" ON "{table}" USING gin (search_vector)',
+        f'CREATE INDEX "ix_{table.lower()}_name_trgm" ON "{table}" USING gin (name gin_trgm_ops)',
+        f'CREATE INDEX "ix_{table.lower()}_city_trgm" ON "{table}" USING gin (city gin_trgm_ops)',
+    ]:
+        db.event.listen(model.__table__, 'after_create', db.DDL(statement).execute_if(dialect='postgresql'))
+
+    for statement in [
+        f'CREATE VIRTUAL TABLE "{fts}" USING fts5(name, city, state, genres)',
+        f'''CREATE TRIGGER "{table}_fts_insert" AFTER INSERT ON "{table}" BEGIN
+            INSERT INTO "{fts}"(rowid, name, city, state, genres)
+            VALUES (new.id, new.name, new.city, new.state, new.genres);
+        END''',
+        f'''CREATE TRIGGER "{table}_fts_update" AFTER UPDATE ON "{table}" BEGIN
+            UPDATE "{fts}" SET name = new.name, city = new.city, state = new.state, genres = new.genres
+            WHERE rowid = old.id;
+        END''',
+        f'''CREATE TRIGGER "{table}_fts_delete" AFTER DELETE ON "{table}" BEGIN
+            DELETE FROM "{fts}" WHERE rowid = old.id;
+        END''',
+    ]:
+        db.event.listen(model.__table__, 'after_create', db.DDL(statement).execute_if(dialect='sqlite'))
+
+    for statement in sqlite_names_ddl(table):
+        db.event.listen(model.__table__, 'after_create', db.DDL(statement).execute_if(
+            dialect='sqlite', callable_=lambda *args, **kwargs: SQLITE_TRIGRAM))
+
+    for statement in [f'DROP TABLE IF EXISTS "{fts}"', f'DROP TABLE IF EXISTS "{names}"']:
+        db.event.listen(model.__table__, 'after_drop', db.DDL(statement).execute_if(dialect='sqlite'))
+
+
+search_ddl(Venue)
+search_ddl(Artist)
+
+
+@compiles(db.PrimaryKeyConstraint, 'postgresql')
+def _primary_key(constraint, compiler, **kw):
+    # A partitioned table's primary key must contain the partition key; ids
+    # stay unique through their sequence, and the ORM still maps Show by id
+    sql = compiler.visit_primary_key_constraint(constraint, **kw)
+    if constraint.table is Show.__table__:
+        sql = sql.replace('PRIMARY KEY (id)', 'PRIMARY KEY (id, start_time)')
+    return sql
+
+
+def show_partition_ddl(partition):
+    # Exclusion constraints for one partition of Show: Postgres can't enforce
+    # them across a partitioned table, only within each partition. Shows
+    # overlapping across a month boundary are refused by the checks in
+    # bookings, under bookings.lock().
+    return [
+        f'''ALTER TABLE "{partition}" ADD CONSTRAINT "{partition}_{column}_overlap"
+        EXCLUDE USING gist ({column} WITH =, tsrange(start_time, end_time) WITH &&)'''
+        for column in ('venue_id', 'artist_id')
+    ]
+
+
+def booking_ddl():
+    # Postgres: exclusion constraints, so no two shows at a venue or by an
+    # artist overlap, backed by GiST indexes that also serve range queries.
+    # SQLite: an R*Tree (venue, artist, minutes) interval index kept in sync
+    # by triggers, and triggers that reject overlapping shows through it.
+    # Ranges are half-open, so back-to-back shows don't overlap.
+    table = Show.__table__
+
+    db.event.listen(table, 'before_create', db.DDL(
+        'CREATE EXTENSION IF NOT EXISTS btree_gist'
+    ).execute_if(dialect='postgresql'))
+
+    # Shows outside the monthly partitions land here until
+    # `flask show-partitions` moves them
+    for statement in ['CREATE TABLE "Show_default" PARTITION OF "Show" DEFAULT'] + show_partition_ddl('Show_default'):
+        db.event.listen(table, 'after_create', db.DDL(statement).execute_if(dialect='postgresql'))
+
+    # Minutes since the epoch, rounded outwards; '%%' is a literal '%' in DDL
+    start = "CAST(strftime('%%s', {}.start_time) AS INTEGER) / 60"
+    end = "(CAST(strftime('%%s', {}.end_time) AS INTEGER) + 59) / 60"
+    overlap = '''EXISTS (SELECT 1 FROM "Show_intervals" JOIN "Show" ON "Show".id = "Show_intervals".id
+        WHERE "Show_intervals".{column}_lo <= NEW.{column}_id AND "Show_intervals".{column}_hi >= NEW.{column}_id
+        AND "Show_intervals".start_lo < {end} AND "Show_intervals".end_hi > {start}
+        AND "Show".start_time < NEW.end_time AND "Show".end_time > NEW.start_time AND "Show".id IS NOT NEW.id)'''
+    conflict = '''SELECT RAISE(ABORT, 'show overlaps another booking') WHERE {} OR {};'''.format(
+        overlap.format(column='venue', start=start.format('NEW'), end=end.format('NEW')),
+        overlap.format(column='artist', start=start.format('NEW'), end=end.format('NEW'))
+    )
+    row = f"NEW.venue_id, NEW.venue_id, NEW.artist_id, NEW.artist_id, {start.format('NEW')}, {end.format('NEW')}"
+
+    for statement in [
+        '''CREATE VIRTUAL TABLE "Show_intervals" USING rtree_i32(
+            id, venue_lo, venue_hi, artist_lo, artist_hi, start_lo, end_hi)''',
+        f'''CREATE TRIGGER "Show_overlap_insert" BEFORE INSERT ON "Show" BEGIN
+            {conflict}
+        END''',
+        f'''CREATE TRIGGER "Show_overlap_update"
+        BEFORE UPDATE OF venue_id, artist_id, start_time, end_time ON "Show" BEGIN
+            {conflict}
+        END''',
+        f'''CREATE TRIGGER "Show_intervals_insert" AFTER INSERT ON "Show" BEGIN
+            INSERT INTO "Show_intervals" VALUES (NEW.id, {row});
+        END''',
+        f'''CREATE TRIGGER "Show_intervals_update" AFTER UPDATE ON "Show" BEGIN
+            DELETE FROM "Show_intervals" WHERE id = OLD.id;
+            INSERT INTO "Show_intervals" VALUES (NEW.id, {row});
+        END''',
+        '''CREATE TRIGGER "Show_intervals_delete" AFTER DELETE ON "Show" BEGIN
+            DELETE FROM "Show_intervals" WHERE id = OLD.id;
+        END''',
+    ]:
+        db.event.listen(table, 'after_create', db.DDL(statement).execute_if(dialect='sqlite'))
+
+    db.event.listen(table, 'after_drop', db.DDL(
+        'DROP TABLE IF EXISTS "Show_intervals"'
+    ).execute_if(dialect='sqlite'))
+
+
+booking_ddl()
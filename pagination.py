@@ -0,0 +1,119 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from flask import abort, current_app, redirect, request, url_for
+from models import db
+
+# ----------------------------------------------------------------------------#
+# Keyset (cursor) pagination.
+#
+# Pages are addressed by the sort key of their first/last row instead of an
+# OFFSET, so every page is a single indexed range scan no matter how deep it is.
+# ----------------------------------------------------------------------------#
+
+
+class Page(object):
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def to_dict(self):
+        return {
+            'next_cursor': self.next_cursor,
+            'prev_cursor': self.prev_cursor
+        }
+
+
+def encode_cursor(values):
+    # Opaque, URL-safe token for a sort key
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    token = base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+    return token.decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError(cursor)
+        return [
+            datetime.fromisoformat(value) if isinstance(column.type, db.DateTime) else value
+            for column, value in zip(columns, values)
+        ]
+    except (ValueError, TypeError, UnicodeError, binascii.Error):
+        abort(400)  # Malformed cursor
+
+
+def _cursor_for(item, columns):
+    return encode_cursor([getattr(item, column.key) for column in columns])
+
+
+def paginate(query, columns, per_page=None):
+    # Paginates query on the (unique) sort key given by columns, reading the
+    # `after`, `before` and `per_page` request arguments. A `before` cursor
+    # with less than a page ahead of it redirects to the first page.
+    if per_page is None:
+        per_page = request.args.get('per_page', current_app.config['PAGE_SIZE'], type=int)
+    per_page = max(1, min(per_page, current_app.config['MAX_PAGE_SIZE']))
+
+    after = request.args.get('after')
+    before = request.args.get('before')
+    key = db.tuple_(*columns)
+
+    # The extra bound on the leading column is implied by the tuple comparison;
+    # it lets Postgres use it for index ranges and partition pruning as well
+    if before is not None:
+        # Walk backwards from the cursor, then restore ascending order
+        cursor = decode_cursor(before, columns)
+        items = query \
+            .filter(columns[0] <= cursor[0], key < db.tuple_(*cursor)) \
+            .order_by(*[column.desc() for column in columns]) \
+            .limit(per_page + 1) \
+            .all()
+        if len(items) < per_page:
+            # Rows before the cursor went away since the link was made; a
+            # short (or empty) page here would have no Previous link and no
+            # rows to link Next from, so start over from the first page
+            abort(redirect(page_url()))
+        has_prev = len(items) > per_page
+        items = items[:per_page][::-1]
+        has_next = True
+    else:
+        if after is not None:
+            cursor = decode_cursor(after, columns)
+            query = query.filter(columns[0] >= cursor[0], key > db.tuple_(*cursor))
+        items = query \
+            .order_by(*columns) \
+            .limit(per_page + 1) \
+            .all()
+        has_next = len(items) > per_page
+        items = items[:per_page]
+        has_prev = after is not None
+
+    if not items:
+        return Page(items)
+
+    return Page(
+        items,
+        next_cursor=_cursor_for(items[-1], columns) if has_next else None,
+        prev_cursor=_cursor_for(items[0], columns) if has_prev else None
+    )
+
+
+def page_url(**cursor):
+    # URL of the current view with a new cursor, keeping its other arguments
+    # (filters, per_page), repeated ones like ?genre= included
+    args = {key: values for key, values in request.args.lists() if key not in ('after', 'before')}
+    args.update(cursor)
+    return url_for(request.endpoint, **request.view_args, **args)
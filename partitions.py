@@ -0,0 +1,146 @@
+import re
+from datetime import datetime
+import click
+from models import app, db, show_partition_ddl
+import cache
+import counters
+
+# ----------------------------------------------------------------------------#
+# Show partitions.
+#
+# On Postgres, Show is range-partitioned by start_time into one table per
+# month (Show_2024_05, ...), so a query for a time range only scans the months
+# it covers. Shows outside every monthly partition go to Show_default.
+# `flask show-partitions` creates the partitions for the coming months, moves
+# shows out of the default partition into partitions of their own, and
+# detaches the months older than the retention period. Run it from cron,
+# e.g. daily.
+# ----------------------------------------------------------------------------#
+
+_PARTITION = re.compile(r'^Show_(\d{4})_(\d{2})$')
+
+
+def partition_name(month):
+    return 'Show_{:%Y_%m}'.format(month)
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partitioned():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def partitions():
+    # The attached monthly partitions as {month: table name}
+    rows = db.session.execute(db.text('''
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = '"Show"'::regclass
+    '''))
+    months = {}
+    for name, in rows:
+        match = _PARTITION.match(name)
+        if match:
+            months[datetime(int(match.group(1)), int(match.group(2)), 1)] = name
+    return months
+
+
+def default_months():
+    # Months with shows waiting in the default partition
+    rows = db.session.execute(db.text('SELECT DISTINCT date_trunc(\'month\', start_time) FROM "Show_default"'))
+    return [month for month, in rows]
+
+
+def create_partition(month):
+    # Creates the partition for month and commits. Its shows are moved out of
+    # the default partition first: Postgres won't attach a partition while
+    # the default one still holds rows in its range.
+    name = partition_name(month)
+    start, end = month, add_months(month, 1)
+    db.session.execute(db.text(f'CREATE TABLE "{name}" (LIKE "Show" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+    for statement in show_partition_ddl(name):
+        db.session.execute(db.text(statement))
+    db.session.execute(db.text(f'''
+        WITH moved AS (
+            DELETE FROM "Show_default" WHERE start_time >= :start AND start_time < :end RETURNING *
+        )
+        INSERT INTO "{name}" SELECT * FROM moved
+    '''), {'start': start, 'end': end})
+    db.session.execute(db.text(
+        f'''ALTER TABLE "Show" ATTACH PARTITION "{name}" FOR VALUES FROM ('{start}') TO ('{end}')'''
+    ))
+    db.session.commit()
+    return name
+
+
+def ensure_partitions(first, last):
+    # Creates the missing partitions for the months from first to last
+    existing = partitions()
+    created = []
+    month = month_start(first)
+    while month <= last:
+        if month not in existing:
+            created.append(create_partition(month))
+        month = add_months(month, 1)
+    return created
+
+
+def detach_partitions(before, drop=False):
+    # Detaches (or drops) the partitions of the months before `before`. The
+    # shows leave the Show table, so the venue and artist counters are
+    # recomputed and cached pages thrown away: past_shows_count then only
+    # counts the past shows still attached.
+    detached = []
+    for month, name in sorted(partitions().items()):
+        if month >= before:
+            break
+        db.session.execute(db.text(f'ALTER TABLE "Show" DETACH PARTITION "{name}"'))
+        if drop:
+            db.session.execute(db.text(f'DROP TABLE "{name}"'))
+        db.session.commit()
+        detached.append(name)
+    if detached:
+        counters.check_show_counts(repair=True)
+        cache.clear()
+    return detached
+
+
+def maintain(ahead, retain=0, drop=False, now=None):
+    # Returns (created, detached) partition names
+    now = month_start(now or datetime.now())
+    created = ensure_partitions(now, add_months(now, ahead))
+    for month in default_months():
+        created += ensure_partitions(month, month)
+    detached = detach_partitions(add_months(now, -retain), drop) if retain else []
+    return created, detached
+
+
+@app.cli.command('show-partitions')
+@click.option('--ahead', type=int, help='Months to create partitions for in advance; SHOW_PARTITIONS_AHEAD by default.')
+@click.option('--retain', type=int,
+              help='Months of past shows to keep attached, 0 for all; SHOW_PARTITIONS_RETAIN_MONTHS by default.')
+@click.option('--drop', is_flag=True, help='Drop expired partitions instead of only detaching them.')
+def show_partitions_command(ahead, retain, drop):
+    """Create upcoming monthly Show partitions and detach expired ones."""
+    if not partitioned():
+        click.echo('Show is only partitioned on Postgres.')
+        return
+    ahead = app.config['SHOW_PARTITIONS_AHEAD'] if ahead is None else ahead
+    retain = app.config['SHOW_PARTITIONS_RETAIN_MONTHS'] if retain is None else retain
+    try:
+        created, detached = maintain(ahead, retain, drop)
+    except Exception:
+        db.session.rollback()
+        raise
+    for name in created:
+        click.echo(f'Created {name}')
+    for name in detached:
+        click.echo(('Dropped ' if drop else 'Detached ') + name)
+    click.echo(f'{len(partitions())} monthly partitions attached.')
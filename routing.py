@@ -0,0 +1,132 @@
+import itertools
+import threading
+import time
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, orm, text
+from sqlalchemy.exc import SQLAlchemyError
+from database import engine_options
+
+# ----------------------------------------------------------------------------#
+# Read-replica routing.
+#
+# GET and HEAD requests read from the replicas in SQLALCHEMY_REPLICA_URIS,
+# round-robin, skipping replicas that fail a health check. A request picks
+# its replica once and reads everything from it, so its validators, body and
+# page cache entry all come from the same snapshot. Every other
+# request, the CLI and anything outside a request use the primary. A client
+# that has just written keeps reading from the primary for
+# READ_YOUR_WRITES_SECONDS, so the redirect after a save shows its own change
+# even if the replicas lag.
+# ----------------------------------------------------------------------------#
+
+PRIMARY_UNTIL_COOKIE = 'fyyur_primary_until'
+
+
+class Replica(object):
+    def __init__(self, engine):
+        self.engine = engine
+        # Unverified until the first health check
+        self.healthy = False
+        self.checked_at = 0.0
+
+
+class ReplicaSet(object):
+    def __init__(self, engines, check_interval):
+        self.replicas = [Replica(engine) for engine in engines]
+        self.check_interval = check_interval
+        self._next = itertools.count()
+        for replica in self.replicas:
+            event.listen(replica.engine, 'handle_error', self._error_listener(replica))
+
+    @staticmethod
+    def _error_listener(replica):
+        def on_error(context):
+            # A dropped or refused connection takes the replica out of rotation
+            # until it passes a check
+            if context.is_disconnect or context.connection is None:
+                replica.healthy = False
+        return on_error
+
+    def _check(self, replica):
+        now = time.monotonic()
+        if now - replica.checked_at < self.check_interval:
+            return replica.healthy
+        replica.checked_at = now
+        try:
+            with replica.engine.connect() as connection:
+                connection.execution_options(health_check=True).execute(text('SELECT 1'))
+            replica.healthy = True
+        except SQLAlchemyError:
+            replica.healthy = False
+        return replica.healthy
+
+    def choose(self):
+        # Next healthy replica engine, or None to fall back to the primary
+        count = len(self.replicas)
+        start = next(self._next)
+        for offset in range(count):
+            replica = self.replicas[(start + offset) % count]
+            if replica.healthy or self._check(replica):
+                return replica.engine
+        return None
+
+
+class RoutingSession(SignallingSession):
+    def __init__(self, db, **options):
+        self._db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if has_request_context() and g.get('db_role') == 'replica' and not self._flushing:
+            if 'db_replica' not in g:
+                g.db_replica = self._db.replicas(self.app).choose()
+            if g.db_replica is not None:
+                return g.db_replica
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def __init__(self, app=None, **kwargs):
+        self._replicas = None
+        self._replicas_lock = threading.Lock()
+        super().__init__(app, **kwargs)
+        if app is not None:
+            self.init_routing(app)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def replicas(self, app):
+        if self._replicas is None:
+            with self._replicas_lock:
+                if self._replicas is None:
+                    self._replicas = ReplicaSet(
+                        [create_engine(uri, **engine_options(app.config, uri))
+                         for uri in app.config['SQLALCHEMY_REPLICA_URIS']],
+                        app.config['REPLICA_HEALTH_CHECK_SECONDS']
+                    )
+        return self._replicas
+
+    def init_routing(self, app):
+        window = app.config['READ_YOUR_WRITES_SECONDS']
+
+        @app.before_request
+        def choose_database():
+            g.db_role = 'primary'
+            # The replica is picked on the request's first read
+            g.pop('db_replica', None)
+            if request.method not in ('GET', 'HEAD') or not app.config['SQLALCHEMY_REPLICA_URIS']:
+                return
+            # Only honour windows this server could have issued
+            now = time.time()
+            primary_until = request.cookies.get(PRIMARY_UNTIL_COOKIE, type=float)
+            if primary_until is None or not now < primary_until <= now + window:
+                g.db_role = 'replica'
+
+        @app.after_request
+        def remember_write(response):
+            if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400 and \
+                    app.config['SQLALCHEMY_REPLICA_URIS']:
+                response.set_cookie(PRIMARY_UNTIL_COOKIE, str(time.time() + window), max_age=window, httponly=True)
+            return response
@@ -0,0 +1,154 @@
+import re
+import click
+from flask import current_app
+from models import app, db, Venue, Artist, SQLITE_TRIGRAM, sqlite_names_ddl
+from genres import BITS, genre_mask
+from cache import invalidate
+import matching
+
+# ----------------------------------------------------------------------------#
+# Indexed search over venues and artists.
+#
+# Matches name, city, state and genres through the indexes created by
+# models.search_ddl: tsvector + trigram GIN indexes on Postgres, FTS5 on SQLite.
+# Both find the rows whose name contains the term, and those where every word
+# of the term starts a word of any field.
+# Genre filters test bits of genre_mask, served by models.genre_indexes.
+# ----------------------------------------------------------------------------#
+
+
+def _tokens(term):
+    return re.findall(r'\w+', term.lower())
+
+
+def _escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _search_postgresql(model, term, limit):
+    tokens = _tokens(term)
+    pattern = f'%{_escape_like(term)}%'
+
+    # Substring matches on name are served by the trigram index, word-prefix
+    # matches on any field by the tsvector index.
+    condition = model.name.ilike(pattern, escape='\\')
+    rank = db.func.similarity(model.name, term)
+    if tokens:
+        query = db.func.to_tsquery('simple', ' & '.join(token + ':*' for token in tokens))
+        condition = db.or_(condition, model.search_vector.op('@@')(query))
+        rank = rank + db.func.ts_rank(model.search_vector, query)
+
+    return db.session.query(model.id, model.name) \
+        .filter(condition) \
+        .order_by(rank.desc(), model.name, model.id) \
+        .limit(limit) \
+        .all()
+
+
+def _search_sqlite(model, term, limit):
+    tokens = _tokens(term)
+    table = model.__tablename__
+    parameters = {'limit': limit}
+
+    # Names containing the term: the trigram table matches it as a phrase of
+    # its trigrams, so shorter terms (or an SQLite without the tokenizer) scan
+    if SQLITE_TRIGRAM and len(term) >= 3:
+        names = f'''
+            SELECT "{table}".id AS id, "{table}".name AS name
+            FROM "{table}_names" JOIN "{table}" ON "{table}".id = "{table}_names".rowid
+            WHERE "{table}_names" MATCH :phrase'''
+        parameters['phrase'] = '"{}"'.format(term.replace('"', '""'))
+    else:
+        names = f'''
+            SELECT id, name FROM "{table}" WHERE name LIKE :pattern ESCAPE '\\' '''
+        parameters['pattern'] = f'%{_escape_like(term)}%'
+    order = f'"{table}".name, "{table}".id'
+    if not tokens:
+        statement = db.text(f'SELECT id, name FROM ({names} ORDER BY {order}) LIMIT :limit')
+        return db.session.execute(statement, parameters).fetchall()
+
+    # Rows where every token matches as a word prefix come first, ranked by
+    # bm25 weighting name over the other columns, then the other name
+    # matches. SQLite reads UNION ALL branches in order, so the second one is
+    # only run when the first leaves room under the limit.
+    statement = db.text(f'''
+        SELECT id, name FROM (
+            SELECT "{table}".id AS id, "{table}".name AS name
+            FROM "{table}_fts" JOIN "{table}" ON "{table}".id = "{table}_fts".rowid
+            WHERE "{table}_fts" MATCH :query
+            ORDER BY bm25("{table}_fts", 10.0, 2.0, 2.0, 1.0), {order}
+        )
+        UNION ALL
+        SELECT id, name FROM (
+            {names}
+            AND "{table}".id NOT IN (SELECT rowid FROM "{table}_fts" WHERE "{table}_fts" MATCH :query)
+            ORDER BY {order}
+        )
+        LIMIT :limit
+    ''')
+    parameters['query'] = ' '.join('"{}"*'.format(token) for token in tokens)
+    return db.session.execute(statement, parameters).fetchall()
+
+
+def _search_fallback(model, term, limit):
+    return db.session.query(model.id, model.name) \
+        .filter(model.name.ilike(f'%{_escape_like(term)}%', escape='\\')) \
+        .order_by(model.name, model.id) \
+        .limit(limit) \
+        .all()
+
+
+def search(model, term, limit=None):
+    # Returns up to `limit` (id, name) rows of model matching term, best match first
+    term = term.strip()
+    if limit is None:
+        limit = current_app.config['SEARCH_LIMIT']
+    if not term:
+        return _search_fallback(model, term, limit)
+
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return _search_postgresql(model, term, limit)
+    if dialect == 'sqlite':
+        return _search_sqlite(model, term, limit)
+    return _search_fallback(model, term, limit)
+
+
+def genre_filter(model, genres, match='any'):
+    # Condition for rows of model with any (or all) of genres. One term per
+    # genre, written like the partial index conditions so the planner can
+    # use them; the bits are literals for the same reason.
+    terms = [model.genre_mask.op('&')(db.literal_column(str(BITS[genre]))) != db.literal_column('0') for genre in genres]
+    return db.and_(*terms) if match == 'all' else db.or_(*terms)
+
+
+@app.cli.command('index-genres')
+@click.option('--batch-size', default=5000, help='Rows updated per transaction.')
+def index_genres_command(batch_size):
+    """Recompute every venue's and artist's genre_mask from its genres."""
+    for model in (Venue, Artist):
+        rows = [{'_id': id, '_mask': genre_mask(genres)} for id, genres in db.session.query(model.id, model.genres)]
+        table = model.__table__
+        statement = table.update().where(table.c.id == db.bindparam('_id')).values(genre_mask=db.bindparam('_mask'))
+        for start in range(0, len(rows), batch_size):
+            db.session.execute(statement, rows[start:start + batch_size])
+            db.session.commit()
+        invalidate(matching.CHANGED[model])
+        click.echo(f'Indexed the genres of {len(rows)} {model.__tablename__.lower()}s.')
+
+
+@app.cli.command('index-names')
+def index_names_command():
+    """Create and fill the SQLite name substring indexes of an existing database."""
+    if db.engine.dialect.name != 'sqlite' or not SQLITE_TRIGRAM:
+        raise click.ClickException('Only needed on SQLite 3.34 or later.')
+    for model in (Venue, Artist):
+        table = model.__tablename__
+        if db.engine.has_table(f'{table}_names'):
+            click.echo(f'{table}_names exists already.')
+            continue
+        for statement in sqlite_names_ddl(table):
+            db.session.execute(db.text(statement))
+        db.session.execute(db.text(f'INSERT INTO "{table}_names"(rowid, name) SELECT id, name FROM "{table}"'))
+        db.session.commit()
+        click.echo(f'Indexed the names of {model.__tablename__.lower()}s.')
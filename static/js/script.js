@@ -2,3 +2,37 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// Navbar typeahead backed by /api/autocomplete
+document.addEventListener('DOMContentLoaded', function () {
+  var inputs = document.querySelectorAll('input[data-autocomplete]');
+  Array.prototype.forEach.call(inputs, function (input) {
+    var list = document.getElementById(input.getAttribute('list'));
+    var pending = null;
+    input.addEventListener('input', function () {
+      var q = input.value.trim();
+      if (pending) {
+        pending.abort();
+      }
+      if (!q) {
+        list.innerHTML = '';
+        return;
+      }
+      pending = new XMLHttpRequest();
+      pending.open('GET', '/api/autocomplete?type=' + input.getAttribute('data-autocomplete') +
+        '&q=' + encodeURIComponent(q));
+      pending.onload = function () {
+        if (this.status !== 200) {
+          return;
+        }
+        list.innerHTML = '';
+        JSON.parse(this.responseText).results.forEach(function (result) {
+          var option = document.createElement('option');
+          option.value = result.name;
+          list.appendChild(option);
+        });
+      };
+      pending.send();
+    });
+  });
+});
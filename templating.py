@@ -0,0 +1,62 @@
+import os
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from models import app
+from cache import MemoryCache, NullCache
+
+# ----------------------------------------------------------------------------#
+# Template caching.
+#
+# Compiled templates are kept on disk, so a fresh worker loads bytecode
+# instead of compiling every template again. Fragments wrapped in
+# {% cache 'name', id, version %} ... {% endcache %} are kept in a per-process
+# LRU keyed on the template and those values: the key changes whenever the
+# entity's version (its updated_at) does, so nothing needs invalidating.
+# ----------------------------------------------------------------------------#
+
+
+def create_fragment_cache(config):
+    if config.get('CACHE_TYPE', 'null') == 'null':
+        return NullCache()
+    # Never expire; versioned keys don't go stale and the LRU bounds the size
+    return MemoryCache(0, config['FRAGMENT_CACHE_MAX_BYTES'])
+
+
+fragment_cache = create_fragment_cache(app.config)
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        call = self.call_method('_render', [nodes.Const(f'{parser.name}:{lineno}'), nodes.List(parts)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, location, parts, caller):
+        # A missing id or version can't tell entities apart; render uncached
+        if any(part is None for part in parts):
+            return caller()
+        key = 'fragment:{}:{}'.format(location, ':'.join(str(part) for part in parts))
+        hit = fragment_cache.get(key)
+        if hit is not None:
+            return Markup(hit.decode('utf-8'))
+        rendered = caller()
+        fragment_cache.set(key, str(rendered).encode('utf-8'))
+        return rendered
+
+
+def init_templates(app):
+    directory = app.config['JINJA_BYTECODE_CACHE_DIR']
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+    app.jinja_env.add_extension(FragmentCacheExtension)
+
+
+init_templates(app)
@@ -0,0 +1,54 @@
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+import pytest
+
+# config.py reads these when app.py is first imported: a throwaway SQLite
+# database and tag directory, a fixed key, and no indexes or suggestions
+# built ahead of the first request
+scratch = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(scratch, 'fyyur.db')
+os.environ['CACHE_TYPE'] = 'memory'
+os.environ['CACHE_TAG_DIR'] = os.path.join(scratch, 'tags')
+os.environ['SECRET_KEY'] = 'test'
+os.environ['AUTOCOMPLETE_WARM'] = '0'
+os.environ['SUGGESTIONS_WARM'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app
+    from models import db, Venue, Artist, Show
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with app.app_context():
+        db.create_all()
+        venue = Venue(name='The Musical Hop', genres=['Jazz'], city='San Francisco', state='CA',
+                      address='1015 Folsom Street')
+        artist = Artist(name='Guns N Petals', genres=['Rock n Roll'], city='San Francisco', state='CA')
+        db.session.add_all([venue, artist])
+        db.session.commit()
+        now = datetime.now()
+        db.session.add_all([
+            Show(venue_id=venue.id, artist_id=artist.id, start_time=now + timedelta(days=days))
+            for days in (-30, -2, 3, 40)
+        ])
+        db.session.commit()
+        db.session.remove()
+    # Each request then gets its own app context, g and session, as when served
+    yield app
+    with app.app_context():
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture(autouse=True)
+def empty_page_cache(app):
+    # Each test starts with no cached pages, so its first requests run their queries
+    import cache
+    cache.page_cache.clear()
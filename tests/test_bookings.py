@@ -0,0 +1,120 @@
+from datetime import datetime
+import io
+import json
+import pytest
+import bookings
+import importer
+from models import db, Venue, Artist, Show
+
+# Across the January/February boundary, so a Postgres run spans two partitions
+START = datetime(2100, 1, 31, 23, 0)
+END = datetime(2100, 2, 1, 1, 0)
+
+
+@pytest.fixture
+def booked(app):
+    # Two venues and two artists, with one show by the first artist at the
+    # first venue from START to END; yields their ids
+    with app.app_context():
+        venues = [Venue(name=f'Booking Hall {number}', genres=['Jazz'], city='Oakland', state='CA',
+                        address=f'{number} Broadway') for number in range(2)]
+        artists = [Artist(name=f'Booking Band {number}', genres=['Jazz'], city='Oakland', state='CA')
+                   for number in range(2)]
+        db.session.add_all(venues + artists)
+        db.session.flush()
+        show = Show(venue_id=venues[0].id, artist_id=artists[0].id, start_time=START, end_time=END)
+        db.session.add(show)
+        db.session.commit()
+        ids = {
+            'venues': [venue.id for venue in venues],
+            'artists': [artist.id for artist in artists],
+            'show': show.id
+        }
+        db.session.remove()
+    yield ids
+
+    with app.app_context():
+        for show in Show.query.filter(Show.venue_id.in_(ids['venues'])).all():
+            db.session.delete(show)
+        db.session.flush()
+        for model, key in ((Venue, 'venues'), (Artist, 'artists')):
+            model.query.filter(model.id.in_(ids[key])).delete(synchronize_session=False)
+        db.session.commit()
+        db.session.remove()
+
+
+def show_count(app, venue_ids):
+    with app.app_context():
+        return Show.query.filter(Show.venue_id.in_(venue_ids)).count()
+
+
+@pytest.mark.parametrize('start, end, venue, artist', [
+    # Same venue, other artist, starting after midnight
+    (datetime(2100, 2, 1, 0, 30), datetime(2100, 2, 1, 2, 0), 0, 1),
+    # Same artist, other venue, ending before midnight
+    (datetime(2100, 1, 31, 22, 0), datetime(2100, 1, 31, 23, 30), 1, 0),
+])
+def test_conflicts_across_a_month_boundary(app, booked, start, end, venue, artist):
+    with app.app_context():
+        clashes = bookings.conflicts(booked['venues'][venue], booked['artists'][artist], start, end)
+        assert [show.id for show in clashes] == [booked['show']]
+
+
+def test_touching_bookings_do_not_conflict(app, booked):
+    with app.app_context():
+        venue, artist = booked['venues'][0], booked['artists'][0]
+        assert bookings.conflicts(venue, artist, END, datetime(2100, 2, 1, 3, 0)) == []
+        assert bookings.conflicts(venue, artist, datetime(2100, 1, 31, 21, 0), START) == []
+
+
+def test_conflicts_exclude_the_show_being_moved(app, booked):
+    with app.app_context():
+        venue, artist = booked['venues'][0], booked['artists'][0]
+        later = datetime(2100, 2, 1, 0, 0)
+        assert bookings.conflicts(venue, artist, later, later.replace(hour=2), exclude_id=booked['show']) == []
+        assert len(bookings.conflicts(venue, artist, later, later.replace(hour=2))) == 1
+
+
+@pytest.mark.parametrize('venue, artist, message', [
+    (0, 1, b'overlaps a show at the venue'),
+    (1, 0, b'overlaps a show by the artist'),
+])
+def test_create_show_rejects_overlaps(app, client, booked, venue, artist, message):
+    response = client.post('/shows/create', data={
+        'venue_id': booked['venues'][venue],
+        'artist_id': booked['artists'][artist],
+        'start_time': '2100-02-01 00:30:00',
+        'end_time': '2100-02-01 02:00:00'
+    })
+    assert message in response.data
+    assert show_count(app, booked['venues']) == 1
+
+
+def test_create_show_after_the_booking(app, client, booked):
+    response = client.post('/shows/create', data={
+        'venue_id': booked['venues'][0],
+        'artist_id': booked['artists'][0],
+        'start_time': '2100-02-01 01:00:00'
+    })
+    assert b'Show was successfully listed!' in response.data
+    assert show_count(app, booked['venues']) == 2
+
+
+def test_import_rejects_overlaps_across_batches(app, booked, tmp_path):
+    # One row per batch: the second row overlaps the first across midnight,
+    # and the third overlaps the fixture's show
+    venue, artist = booked['venues'][1], booked['artists'][1]
+    rows = [
+        {'venue_id': venue, 'artist_id': artist,
+         'start_time': '2100-02-28 23:00:00', 'end_time': '2100-03-01 01:00:00'},
+        {'venue_id': venue, 'artist_id': booked['artists'][0], 'start_time': '2100-03-01 00:30:00'},
+        {'venue_id': booked['venues'][0], 'artist_id': artist, 'start_time': '2100-01-31 22:00:00'},
+    ]
+    path = tmp_path / 'shows.jsonl'
+    path.write_text(''.join(json.dumps(row) + '\n' for row in rows))
+    rejects = io.StringIO()
+    with app.app_context():
+        inserted, rejected, seconds = importer.import_file(importer.ShowImporter(), str(path), 1, rejects)
+    assert (inserted, rejected) == (1, 2)
+    assert [json.loads(line)['line'] for line in rejects.getvalue().splitlines()] == [2, 3]
+    assert show_count(app, booked['venues']) == 2
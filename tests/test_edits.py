@@ -0,0 +1,67 @@
+import pytest
+from formdata import VENUE_FIELDS, ARTIST_FIELDS, to_formdata
+from models import db, Venue, Artist
+
+FIELDS = {Venue: VENUE_FIELDS, Artist: ARTIST_FIELDS}
+
+
+@pytest.fixture(params=[Venue, Artist])
+def entity(app, request):
+    # A venue or an artist of its own; yields (model, id)
+    model = request.param
+    with app.app_context():
+        row = model(name=f'Edited {model.__name__}', genres=['Folk'], city='Portland', state='OR')
+        if model is Venue:
+            row.address = '1 Burnside St'
+        db.session.add(row)
+        db.session.commit()
+        id = row.id
+        db.session.remove()
+    yield model, id
+
+    with app.app_context():
+        model.query.filter_by(id=id).delete()
+        db.session.commit()
+        db.session.remove()
+
+
+def current(app, model, id):
+    with app.app_context():
+        row = model.query.get(id)
+        values = {field: getattr(row, field) for field in FIELDS[model]}
+        db.session.remove()
+    return values, row.version
+
+
+def kind(model):
+    return model.__tablename__.lower() + 's'
+
+
+def test_patch_with_a_stale_version_is_a_conflict(app, client, entity):
+    model, id = entity
+    values, version = current(app, model, id)
+
+    response = client.patch(f'/api/{kind(model)}', json=[{'id': id, 'version': version, 'city': 'Salem'}])
+    assert response.status_code == 200
+    assert response.get_json()['updated'] == [{'id': id, 'version': version + 1, 'changed': ['city']}]
+
+    response = client.patch(f'/api/{kind(model)}', json=[{'id': id, 'version': version, 'city': 'Eugene'}])
+    assert response.status_code == 409
+    assert response.get_json()['stale'] == [{'id': id, 'version': version + 1}]
+    assert current(app, model, id) == (dict(values, city='Salem'), version + 1)
+
+
+def test_edit_form_with_a_stale_version_is_a_conflict(app, client, entity):
+    model, id = entity
+    values, version = current(app, model, id)
+    url = f'/{kind(model)}/{id}/edit'
+
+    response = client.post(url, data=to_formdata(dict(values, city='Salem', version=version)))
+    assert response.status_code == 302
+
+    response = client.post(url, data=to_formdata(dict(values, city='Eugene', version=version)))
+    assert response.status_code == 409
+    assert b'was changed by someone else meanwhile' in response.data
+    # The form comes back holding the current version, so saving it again works
+    assert f'value="{version + 1}"'.encode() in response.data
+    assert current(app, model, id) == (dict(values, city='Salem'), version + 1)
@@ -0,0 +1,64 @@
+import pytest
+from models import db, Venue, Artist
+
+GENRES = {
+    'Both': ['Blues', 'Jazz'],
+    'Blues': ['Blues'],
+    'Jazz': ['Jazz', 'Folk'],
+    'Neither': ['Classical']
+}
+
+
+@pytest.fixture(params=[Venue, Artist])
+def model(app, request):
+    # A venue or artist named 'Genre <key>' per GENRES entry; yields the model
+    model = request.param
+    with app.app_context():
+        rows = [model(name=f'Genre {key}', genres=genres, city='Denver', state='CO') for key, genres in GENRES.items()]
+        if model is Venue:
+            for row in rows:
+                row.address = '1 Colfax Ave'
+        db.session.add_all(rows)
+        db.session.commit()
+        ids = [row.id for row in rows]
+        db.session.remove()
+    yield model
+
+    with app.app_context():
+        model.query.filter(model.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        db.session.remove()
+
+
+def listed(client, model, **args):
+    # Names of the GENRES rows in the model's listing
+    url = '/venues' if model is Venue else '/artists'
+    response = client.get(url, query_string=dict(args, format='json', per_page=100))
+    assert response.status_code == 200
+    body = response.get_json()
+    if model is Venue:
+        rows = [venue for area in body['areas'] for venue in area['venues']]
+    else:
+        rows = body['artists']
+    return sorted(row['name'][len('Genre '):] for row in rows if row['name'].startswith('Genre '))
+
+
+def test_any_of_the_genres(client, model):
+    assert listed(client, model, genre=['Blues', 'Jazz']) == ['Blues', 'Both', 'Jazz']
+    assert listed(client, model, genre=['Blues', 'Jazz'], match='any') == ['Blues', 'Both', 'Jazz']
+    assert listed(client, model, genre='Folk') == ['Jazz']
+
+
+def test_all_of_the_genres(client, model):
+    assert listed(client, model, genre=['Blues', 'Jazz'], match='all') == ['Both']
+    assert listed(client, model, genre=['Jazz', 'Folk', 'Blues'], match='all') == []
+
+
+def test_without_genres_every_row_is_listed(client, model):
+    assert listed(client, model) == sorted(GENRES)
+
+
+@pytest.mark.parametrize('args', [{'genre': 'Polka'}, {'genre': 'Jazz', 'match': 'some'}])
+def test_unknown_genre_or_match_is_rejected(client, model, args):
+    url = '/venues' if model is Venue else '/artists'
+    assert client.get(url, query_string=args).status_code == 400
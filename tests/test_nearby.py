@@ -0,0 +1,78 @@
+import math
+import random
+import pytest
+from models import db, Venue
+
+# (latitude, longitude, radius in km): a city, the far north, and a circle
+# across the antimeridian
+CENTRES = [(37.77, -122.42, 50), (64.84, -147.72, 150), (-17.71, 179.9, 200)]
+
+
+def distance_km(latitude1, longitude1, latitude2, longitude2):
+    # Great-circle distance from the spherical law of cosines, independent of
+    # geo.haversine_km
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    cosine = math.sin(phi1) * math.sin(phi2) + \
+        math.cos(phi1) * math.cos(phi2) * math.cos(math.radians(longitude2 - longitude1))
+    return 6371.0088 * math.acos(max(-1.0, min(1.0, cosine)))
+
+
+@pytest.fixture(scope='module')
+def located(app):
+    # Sixty venues scattered up to twice the radius around each centre
+    generator = random.Random(22)
+    with app.app_context():
+        venues = []
+        for latitude, longitude, radius in CENTRES:
+            spread = 2 * radius / 111.2
+            for number in range(60):
+                venue_latitude = latitude + generator.uniform(-spread, spread)
+                venue_longitude = longitude + generator.uniform(-spread, spread) / math.cos(math.radians(latitude))
+                venues.append(Venue(
+                    name=f'Nearby {len(venues)}', genres=['Jazz'], city='Nowhere', state='CA', address='1 Any St',
+                    latitude=venue_latitude, longitude=(venue_longitude + 180) % 360 - 180))
+        db.session.add_all(venues)
+        db.session.commit()
+        ids = [venue.id for venue in venues]
+        db.session.remove()
+    yield
+
+    with app.app_context():
+        Venue.query.filter(Venue.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        db.session.remove()
+
+
+def brute_force(app, latitude, longitude, radius, limit):
+    # Ids of the limit venues nearest within radius, from every located venue
+    with app.app_context():
+        rows = db.session.query(Venue.id, Venue.latitude, Venue.longitude) \
+            .filter(Venue.latitude.isnot(None)) \
+            .all()
+        db.session.remove()
+    distances = sorted((distance_km(latitude, longitude, row.latitude, row.longitude), row.id) for row in rows)
+    return [id for distance, id in distances if distance <= radius][:limit]
+
+
+@pytest.mark.parametrize('latitude, longitude, radius', CENTRES)
+@pytest.mark.parametrize('limit', [5, 100])
+def test_nearby_matches_a_brute_force_scan(app, client, located, latitude, longitude, radius, limit):
+    response = client.get('/venues/nearby', query_string={
+        'lat': latitude, 'lng': longitude, 'radius': radius, 'limit': limit, 'format': 'json'})
+    assert response.status_code == 200
+    venues = response.get_json()['venues']
+    expected = brute_force(app, latitude, longitude, radius, limit)
+    assert expected, 'no venue in range to compare'
+    assert [venue['id'] for venue in venues] == expected
+    distances = [venue['distance_km'] for venue in venues]
+    assert distances == sorted(distances) and distances[-1] <= radius
+
+
+@pytest.mark.parametrize('args', [
+    {'lat': 37.77},
+    {'lat': 91, 'lng': 0},
+    {'lat': 37.77, 'lng': -122.42, 'radius': 0},
+    {'lat': 37.77, 'lng': -122.42, 'radius': 1e6},
+])
+def test_nearby_rejects_bad_arguments(client, args):
+    assert client.get('/venues/nearby', query_string=args).status_code == 400
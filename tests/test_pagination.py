@@ -0,0 +1,70 @@
+from urllib.parse import urlsplit, parse_qs
+import pytest
+from models import db, Artist
+
+
+@pytest.fixture
+def names(app):
+    # Seven more artists; yields every artist name in page order
+    with app.app_context():
+        artists = [Artist(name=f'Paged Artist {number}', genres=['Jazz'], city='Austin', state='TX')
+                   for number in range(7)]
+        db.session.add_all(artists)
+        db.session.commit()
+        ids = [artist.id for artist in artists]
+        names = [name for name, in db.session.query(Artist.name).order_by(Artist.name, Artist.id)]
+        db.session.remove()
+    yield names
+
+    with app.app_context():
+        Artist.query.filter(Artist.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        db.session.remove()
+
+
+def page(client, per_page=3, **args):
+    response = client.get('/artists', query_string=dict(args, format='json', per_page=per_page))
+    assert response.status_code == 200
+    body = response.get_json()
+    return [artist['name'] for artist in body['artists']], body['prev_cursor'], body['next_cursor']
+
+
+def test_after_cursors_walk_every_row_once(client, names):
+    seen, prev, next = page(client)
+    assert prev is None
+    while next is not None:
+        items, prev, next = page(client, after=next)
+        assert prev is not None
+        seen.extend(items)
+    assert seen == names
+
+
+def test_before_cursors_walk_back_to_the_first_page(client, names):
+    pages = [page(client)]
+    while pages[-1][2] is not None:
+        pages.append(page(client, after=pages[-1][2]))
+
+    prev = pages[-1][1]
+    for expected, _, _ in reversed(pages[:-1]):
+        items, prev, next = page(client, before=prev)
+        assert items == expected
+        assert next is not None
+    assert prev is None
+
+
+def test_short_before_page_redirects_to_the_first_page(client, names):
+    # A cursor on the second row has less than a page before it
+    _, _, next = page(client, per_page=2)
+    response = client.get('/artists', query_string={'before': next, 'per_page': 3, 'format': 'json'})
+    assert response.status_code == 302
+    location = urlsplit(response.headers['Location'])
+    assert location.path == '/artists'
+    assert parse_qs(location.query) == {'per_page': ['3'], 'format': ['json']}
+
+
+def test_full_before_page_is_not_redirected(client, names):
+    # Exactly one page before the cursor: served, with no Previous link
+    _, _, next = page(client, per_page=4)
+    items, prev, _ = page(client, before=next)
+    assert items == names[:3]
+    assert prev is None
@@ -0,0 +1,48 @@
+import pytest
+from sqlalchemy import event
+import cache
+from models import db
+
+
+@pytest.fixture
+def statements(app):
+    # SQL statements run while the fixture is active
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    yield executed
+    event.remove(db.engine, 'before_cursor_execute', record)
+
+
+@pytest.mark.parametrize('url', ['/venues/1', '/artists/1'])
+def test_detail_page_query_count(client, statements, url):
+    # One query for the conditional GET validators, one for the entity and
+    # one for its shows with their venues or artists, however many shows
+    response = client.get(url)
+    assert response.status_code == 200
+    assert len(statements) == 3, statements
+
+
+@pytest.mark.parametrize('url', ['/venues/1', '/artists/1'])
+def test_not_modified_runs_only_the_validators(client, statements, url):
+    etag = client.get(url).headers['ETag']
+    del statements[:]
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert len(statements) == 1, statements
+
+
+@pytest.mark.parametrize('url', ['/venues/1', '/artists/1'])
+def test_without_a_page_cache_no_tags_are_read(client, statements, monkeypatch, url):
+    # No tag store either, so no validators and no ETag: only the page's queries
+    monkeypatch.setattr(cache, 'page_cache', cache.create_cache({'CACHE_TYPE': 'null'}))
+    monkeypatch.setattr(cache, 'tag_store', cache.create_tag_store({'CACHE_TYPE': 'null'}, cache.page_cache))
+    for _ in range(2):
+        del statements[:]
+        response = client.get(url)
+        assert response.status_code == 200
+        assert 'ETag' not in response.headers and 'X-Cache' not in response.headers
+        assert len(statements) == 2, statements
@@ -0,0 +1,69 @@
+import time
+import pytest
+from sqlalchemy import create_engine, event
+from models import db, Venue
+from routing import PRIMARY_UNTIL_COOKIE
+
+
+@pytest.fixture
+def replicas(app, tmp_path):
+    # Two replica files holding venue 1 under their own name; yields the
+    # replica names read by each statement run while the fixture is active
+    engines = []
+    for number in range(2):
+        engine = create_engine('sqlite:///' + str(tmp_path / f'replica{number}.db'))
+        db.Model.metadata.create_all(engine)
+        engine.execute(Venue.__table__.insert().values(
+            id=1, name=f'Replica {number}', genres=['Jazz'], city='San Francisco', state='CA', address='1 Main St'))
+        engine.dispose()
+        engines.append(engine)
+
+    app.config['SQLALCHEMY_REPLICA_URIS'] = [str(engine.url) for engine in engines]
+    db._replicas = None
+    reads = []
+    for number, replica in enumerate(db.replicas(app).replicas):
+        def record(conn, cursor, statement, parameters, context, executemany, number=number):
+            if not context.execution_options.get('health_check'):
+                reads.append(f'Replica {number}')
+        event.listen(replica.engine, 'before_cursor_execute', record)
+    yield reads
+
+    for replica in db.replicas(app).replicas:
+        replica.engine.dispose()
+    app.config['SQLALCHEMY_REPLICA_URIS'] = []
+    db._replicas = None
+
+
+def test_request_reads_from_one_replica(client, replicas):
+    # The validators, the venue and its shows come from the same replica,
+    # and requests take turns
+    used = set()
+    for number in range(4):
+        del replicas[:]
+        response = client.get(f'/venues/1?request={number}')
+        assert response.status_code == 200
+        assert len(set(replicas)) == 1, replicas
+        assert replicas[0].encode() in response.data
+        used.update(replicas)
+    assert used == {'Replica 0', 'Replica 1'}
+
+
+def test_reads_follow_own_writes_to_primary(app, client, replicas):
+    assert b'Replica' in client.get('/venues/1/edit').data
+
+    with app.app_context():
+        version = Venue.query.get(1).version
+    response = client.patch('/api/venues', json=[{'id': 1, 'version': version, 'seeking_description': 'Routing'}])
+    assert response.status_code == 200
+    del replicas[:]
+    response = client.get('/venues/1/edit')
+    assert b'The Musical Hop' in response.data
+    assert replicas == []
+
+
+def test_primary_window_beyond_the_configured_one_is_ignored(app, client, replicas):
+    window = app.config['READ_YOUR_WRITES_SECONDS']
+    client.set_cookie('localhost', PRIMARY_UNTIL_COOKIE, str(time.time() + window * 10))
+    assert b'Replica' in client.get('/venues/1/edit').data
+    client.set_cookie('localhost', PRIMARY_UNTIL_COOKIE, str(time.time() - 1))
+    assert b'Replica' in client.get('/venues/1/edit').data
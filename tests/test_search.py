@@ -0,0 +1,58 @@
+import pytest
+import search as search_module
+from models import db, Venue
+from search import search
+
+
+@pytest.fixture
+def venues(app):
+    # Venues of their own, besides The Musical Hop in San Francisco
+    with app.app_context():
+        rows = [
+            Venue(name='Park Square Live Music & Coffee', genres=['Folk'], city='San Francisco', state='CA',
+                  address='34 Whiskey Moore Ave'),
+            Venue(name='The Dueling Pianos Bar', genres=['Classical'], city='New York', state='NY',
+                  address='335 Delancey Street'),
+            Venue(name='50%_off Club', genres=['Jazz'], city='Chicago', state='IL', address='1 Wacker Dr'),
+            Venue(name='Bishop Lounge', genres=['Blues'], city='Seattle', state='WA', address='2 Pike St')
+        ]
+        db.session.add_all(rows)
+        db.session.commit()
+        ids = [row.id for row in rows]
+        db.session.remove()
+    yield
+
+    with app.app_context():
+        Venue.query.filter(Venue.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        db.session.remove()
+
+
+def names(app, term):
+    with app.app_context():
+        return sorted(name for id, name in search(Venue, term))
+
+
+@pytest.mark.parametrize('term, expected', [
+    # Word prefixes on any field
+    ('music', ['Park Square Live Music & Coffee', 'The Musical Hop']),
+    ('san fran', ['Park Square Live Music & Coffee', 'The Musical Hop']),
+    ('jazz', ['50%_off Club', 'The Musical Hop']),
+    # Substrings of the name, as Postgres's ILIKE finds them
+    ('usical', ['The Musical Hop']),
+    ('Hop', ['Bishop Lounge', 'The Musical Hop']),
+    ('IANOS B', ['The Dueling Pianos Bar']),
+    ('ub', ['50%_off Club']),
+    ('%_o', ['50%_off Club']),
+    ('zzq', []),
+])
+@pytest.mark.parametrize('trigram', [True, False])
+def test_search_matches_words_and_name_substrings(app, venues, monkeypatch, term, expected, trigram):
+    # Without the trigram tokenizer, name substrings are found by scanning
+    monkeypatch.setattr(search_module, 'SQLITE_TRIGRAM', search_module.SQLITE_TRIGRAM and trigram)
+    assert names(app, term) == expected
+
+
+def test_word_matches_rank_before_other_name_matches(app, venues):
+    with app.app_context():
+        assert [name for id, name in search(Venue, 'hop')] == ['The Musical Hop', 'Bishop Lounge']